@@ -0,0 +1,695 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from quart import current_app
+
+from db import (
+    INSERT_USER_SQL,
+    REVOKE_ALL_SQL,
+    REVOKE_VERSION_SQL,
+    USER_FIELDS,
+    DuplicateError,
+    MySQLBackend,
+    PoolTimeout,
+    SQLiteBackend,
+    VersionMismatch,
+    delete_statement,
+    search_statement,
+    update_statement
+)
+
+# =============================================
+# ASYNCIO BACKENDS
+# =============================================
+# Counterparts of the db.py backends for the ASGI app: same tables, same
+# %s placeholders, but every round trip is awaited instead of blocking
+class AsyncMySQLBackend(MySQLBackend):
+    """
+    Opens connections to the configured MySQL server through aiomysql
+    Args:
+        config (dict): App config holding the MYSQL_* settings
+    """
+    def __init__(self, config):
+        import aiomysql
+        self._driver = aiomysql
+        self.integrity_error = aiomysql.IntegrityError
+        self._params = {
+            'host': config['MYSQL_HOST'],
+            'port': config.get('MYSQL_PORT', 3306),
+            'user': config['MYSQL_USER'],
+            'password': config['MYSQL_PASSWORD'],
+            'db': config['MYSQL_DB'],
+            'charset': 'utf8mb4',
+            'connect_timeout': config.get('MYSQL_CONNECT_TIMEOUT', 10),
+            'autocommit': False
+        }
+
+    async def connect(self):
+        return await self._driver.connect(**self._params)
+
+    async def ping(self, conn):
+        await conn.ping(reconnect=False)
+
+    async def begin(self, conn):
+        pass  # autocommit is off: the first statement opens the transaction
+
+    async def cursor(self, conn, streaming=False):
+        if streaming:
+            return await conn.cursor(self._driver.SSCursor)
+        return await conn.cursor()
+
+    async def close(self, conn):
+        conn.close()
+
+
+class _AsyncSQLiteCursor:
+    """
+    Cursor wrapper that accepts the %s placeholders used throughout the API
+    """
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    async def execute(self, query, params=()):
+        await self._cursor.execute(query.replace('%s', '?'), params)
+        return self
+
+    async def executemany(self, query, seq_of_params):
+        await self._cursor.executemany(query.replace('%s', '?'), seq_of_params)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class AsyncInstrumentedCursor:
+    """
+    Counterpart of db.InstrumentedCursor timing awaited statements
+    """
+    def __init__(self, cursor, observers):
+        self._cursor = cursor
+        self._observers = observers
+
+    async def execute(self, query, *args):
+        start = time.perf_counter()
+        try:
+            return await self._cursor.execute(query, *args)
+        finally:
+            self._report(query, time.perf_counter() - start)
+
+    async def executemany(self, query, seq_of_params):
+        start = time.perf_counter()
+        try:
+            return await self._cursor.executemany(query, seq_of_params)
+        finally:
+            self._report(query, time.perf_counter() - start)
+
+    def _report(self, query, seconds):
+        for observe in self._observers:
+            observe(query, seconds)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class AsyncSQLiteBackend(SQLiteBackend):
+    """
+    SQLite stand-in for MySQL through aiosqlite, which runs each connection
+    on its own thread
+    Args:
+        config (dict): App config holding SQLITE_PATH
+    """
+    def __init__(self, config):
+        import aiosqlite
+        super().__init__(config)
+        self._driver = aiosqlite
+
+    async def connect(self):
+        conn = await self._driver.connect(self.path, timeout=30)
+        await conn.execute('PRAGMA journal_mode=WAL')
+        await conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    async def ping(self, conn):
+        await conn.execute('SELECT 1')
+
+    async def begin(self, conn):
+        # See SQLiteBackend.begin
+        await conn.execute('BEGIN IMMEDIATE')
+
+    async def cursor(self, conn, streaming=False):
+        # aiosqlite cursors already step through results lazily
+        return _AsyncSQLiteCursor(await conn.cursor())
+
+    async def close(self, conn):
+        await conn.close()
+
+
+ASYNC_BACKENDS = {
+    'mysql': AsyncMySQLBackend,
+    'sqlite': AsyncSQLiteBackend
+}
+
+
+# =============================================
+# CONNECTION POOL
+# =============================================
+class AsyncConnectionPool:
+    """
+    Pool of database connections shared by the coroutines of one event loop,
+    with the same sizing, timeout and health check rules as ConnectionPool,
+    opened up to min_size on its first checkout
+    Args:
+        connect (coroutine function): Opens a new connection
+        ping (coroutine function): Raises if the given connection is no longer usable
+        close (coroutine function): Closes the given connection
+        min_size (int): Connections kept open even when idle
+        max_size (int): Upper bound on open connections
+        timeout (float): Seconds to wait for a free connection on checkout
+        max_idle (float): Seconds after which idle connections above
+            min_size are closed
+        ping_interval (float): Idle seconds after which a connection is
+            health checked before being handed out
+    """
+    def __init__(self, connect, ping, close, min_size=1, max_size=10, timeout=5.0,
+                 max_idle=300.0, ping_interval=30.0):
+        if min_size > max_size:
+            raise ValueError('min_size cannot exceed max_size')
+        self._connect = connect
+        self._ping = ping
+        self._close = close
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.ping_interval = ping_interval
+        self._idle = deque()  # (connection, released_at), most recent last
+        self._size = 0
+        self._in_use = 0
+        self._last_reap = time.monotonic()
+        self._closed = False
+        self._filled = False
+        self._cond = None  # created on first use, inside the serving loop
+
+    async def fill(self):
+        """
+        Opens connections until min_size are available
+        """
+        while self._size < self.min_size:
+            self._size += 1
+            try:
+                conn = await self._connect()
+            except Exception:
+                self._size -= 1
+                await self._notify()
+                raise
+            self._idle.append((conn, time.monotonic()))
+            await self._notify()
+
+    async def acquire(self):
+        """
+        Checks out a connection, opening one if below max_size
+        Returns:
+            A healthy database connection
+        Raises:
+            PoolTimeout: No connection became free within timeout
+        """
+        if not self._filled:
+            # Once only, so a database that is down costs one connect
+            # attempt per checkout; the checkout reports the failure itself
+            self._filled = True
+            try:
+                await self.fill()
+            except Exception:
+                pass
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn, released_at = await self._checkout(deadline)
+            if conn is None:
+                try:
+                    conn = await self._connect()
+                except BaseException:
+                    await self._discard(None)
+                    raise
+                return conn
+
+            if time.monotonic() - released_at < self.ping_interval:
+                return conn
+            try:
+                await self._ping(conn)
+                return conn
+            except Exception:
+                await self._discard(conn)
+
+    async def release(self, conn, broken=False):
+        """
+        Returns a connection to the pool
+        Args:
+            conn: Connection obtained from acquire()
+            broken (bool): Close the connection instead of reusing it
+        """
+        if broken or self._closed:
+            await self._discard(conn)
+            return
+        self._in_use -= 1
+        self._idle.append((conn, time.monotonic()))
+        await self._notify()
+        if time.monotonic() - self._last_reap > min(self.max_idle, 60):
+            await self.reap()
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Async context manager that checks a connection out and always returns it
+        """
+        conn = await self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                await conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        except BaseException:
+            # Cancelled mid-use (e.g. a client disconnecting), so the
+            # connection state is unknown
+            broken = True
+            raise
+        finally:
+            await self.release(conn, broken=broken)
+
+    async def reap(self):
+        """
+        Closes connections idle for longer than max_idle, keeping min_size open
+        """
+        now = time.monotonic()
+        self._last_reap = now
+        stale = []
+        while (self._idle and self._size > self.min_size
+               and now - self._idle[0][1] > self.max_idle):
+            stale.append(self._idle.popleft()[0])
+            self._size -= 1
+        if stale:
+            await self._notify(len(stale))
+        for conn in stale:
+            await self._close_quietly(conn)
+
+    async def close(self):
+        """
+        Closes every idle connection; checked out ones close on release
+        """
+        self._closed = True
+        idle = [conn for conn, _ in self._idle]
+        self._idle.clear()
+        self._size -= len(idle)
+        for conn in idle:
+            await self._close_quietly(conn)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Open, idle and checked out connection counts
+        """
+        return {
+            "size": self._size,
+            "idle": len(self._idle),
+            "in_use": self._in_use,
+            "min_size": self.min_size,
+            "max_size": self.max_size
+        }
+
+    async def _checkout(self, deadline):
+        # Returns an idle (connection, released_at) pair, or (None, None)
+        # once a slot for a new connection has been reserved
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            while True:
+                if self._idle:
+                    self._in_use += 1
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    self._in_use += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        'No database connection available after %.1fs' % self.timeout
+                    )
+                try:
+                    await asyncio.wait_for(self._cond.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _notify(self, n=1):
+        if self._cond is not None:
+            async with self._cond:
+                self._cond.notify(n)
+
+    async def _discard(self, conn):
+        self._size -= 1
+        self._in_use -= 1
+        await self._notify()
+        if conn is not None:
+            await self._close_quietly(conn)
+
+    async def _close_quietly(self, conn):
+        try:
+            await self._close(conn)
+        except Exception:
+            pass
+
+
+# =============================================
+# REPOSITORIES
+# =============================================
+class AsyncUserRepository:
+    """
+    Awaitable twin of UserRepository, sharing its statements
+    Args:
+        database (AsyncDatabase): Database the queries run against
+    """
+    def __init__(self, database):
+        self.db = database
+
+    async def create_table(self, sample_users):
+        """
+        Creates the users table and seeds it when empty
+        Args:
+            sample_users (list): (username, password) pairs to insert
+        """
+        async with self.db.transaction() as cursor:
+            await cursor.execute(self.db.backend.users_table_sql)
+
+            # Tables created before row versions existed get the column added
+            await cursor.execute("SELECT * FROM midterm_database LIMIT 0")
+            if 'version' not in [x[0] for x in cursor.description]:
+                await cursor.execute("ALTER TABLE midterm_database ADD COLUMN version INT NOT NULL DEFAULT 1")
+
+            if self.db.backend.search_index_sql:
+                await cursor.execute(self.db.backend.search_index_sql)
+            await cursor.execute(self.db.backend.revocations_table_sql)
+
+            await cursor.execute("SELECT COUNT(*) FROM midterm_database")
+            count = (await cursor.fetchone())[0]
+
+            if count == 0:
+                await cursor.executemany(INSERT_USER_SQL, sample_users)
+
+    async def dump(self, after_id=0, limit=100, columns=USER_FIELDS):
+        """
+        Returns one keyset page of rows ordered by id
+        Returns:
+            tuple: Column names and the rows of the page
+        """
+        async with self.db.cursor() as cursor:
+            await cursor.execute("SELECT %s FROM midterm_database WHERE id > %%s ORDER BY id LIMIT %%s"
+                                 % ', '.join(columns), (after_id, limit))
+            row_headers = [x[0] for x in cursor.description]
+            return row_headers, await cursor.fetchall()
+
+    async def find_by_username(self, username):
+        """
+        Returns:
+            tuple: (id, username, version) of the user, or None
+        """
+        async with self.db.cursor() as cursor:
+            await cursor.execute("SELECT id, username, version FROM midterm_database WHERE username = %s", (username,))
+            return await cursor.fetchone()
+
+    async def find_by_credentials(self, username, password):
+        """
+        Returns:
+            tuple: (id, version) of the user matching both fields, or None
+        """
+        async with self.db.cursor() as cursor:
+            await cursor.execute("SELECT id, version FROM midterm_database WHERE username = %s AND password = %s",
+                                 (username, password))
+            return await cursor.fetchone()
+
+    async def exists(self, user_id):
+        """
+        Returns:
+            bool: True if a user with this ID exists
+        """
+        async with self.db.cursor() as cursor:
+            await cursor.execute("SELECT 1 FROM midterm_database WHERE id = %s", (user_id,))
+            return await cursor.fetchone() is not None
+
+    async def list(self, after_id=0, limit=100, columns=USER_FIELDS):
+        """
+        Returns one keyset page of users ordered by id
+        Returns:
+            list: The columns of the users in the page
+        """
+        async with self.db.cursor() as cursor:
+            await cursor.execute("SELECT %s FROM midterm_database WHERE id > %%s ORDER BY id LIMIT %%s"
+                                 % ', '.join(columns), (after_id, limit))
+            return await cursor.fetchall()
+
+    async def search(self, text, mode='prefix', limit=10, columns=USER_FIELDS):
+        """
+        Returns the first users, by username, matching a search
+        Returns:
+            list: The columns of the matching users
+        """
+        async with self.db.cursor() as cursor:
+            await cursor.execute(*search_statement(self.db.backend, text, mode, limit, columns))
+            return await cursor.fetchall()
+
+    async def export(self, batch_size=1000):
+        """
+        Streams every user from a server-side cursor
+        Yields:
+            list: Batches of (id, username) ordered by id
+        """
+        async with self.db.cursor(streaming=True) as cursor:
+            await cursor.execute("SELECT id, username FROM midterm_database ORDER BY id")
+            while True:
+                rows = await cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield rows
+
+    async def get(self, user_id, columns=USER_FIELDS):
+        """
+        Returns:
+            tuple: The columns then the row version of the user, or None
+        """
+        async with self.db.cursor() as cursor:
+            await cursor.execute("SELECT %s, version FROM midterm_database WHERE id = %%s" % ', '.join(columns),
+                                 (user_id,))
+            return await cursor.fetchone()
+
+    async def create(self, username, password):
+        """
+        Inserts a new user, relying on the unique key to reject taken names
+        Returns:
+            int: ID of the new user
+        Raises:
+            DuplicateError: The username is taken
+        """
+        try:
+            async with self.db.transaction() as cursor:
+                await cursor.execute(INSERT_USER_SQL, (username, password))
+                return cursor.lastrowid
+        except self.db.backend.integrity_error:
+            raise DuplicateError('Username already exists')
+
+    async def create_many(self, users, chunk_size=500):
+        """
+        Inserts many users in a single transaction, skipping usernames that
+        are taken instead of failing the whole batch
+        Returns:
+            set: Usernames that were inserted
+        """
+        created = set()
+
+        async with self.db.transaction() as cursor:
+            for i in range(0, len(users), chunk_size):
+                chunk = users[i:i + chunk_size]
+
+                await cursor.execute(
+                    "SELECT username FROM midterm_database WHERE username IN (%s)"
+                    % ', '.join(['%s'] * len(chunk)),
+                    [username for username, _ in chunk]
+                )
+                taken = {row[0] for row in await cursor.fetchall()} | created
+                rows = []
+                for username, password in chunk:
+                    if username not in taken:
+                        taken.add(username)
+                        rows.append((username, password))
+                if not rows:
+                    continue
+
+                await cursor.execute("SAVEPOINT batch_chunk")
+                try:
+                    await cursor.executemany(INSERT_USER_SQL, rows)
+                    created.update(username for username, _ in rows)
+                except self.db.backend.integrity_error:
+                    await cursor.execute("ROLLBACK TO SAVEPOINT batch_chunk")
+                    for row in rows:
+                        try:
+                            await cursor.execute(INSERT_USER_SQL, row)
+                            created.add(row[0])
+                        except self.db.backend.integrity_error:
+                            pass
+                await cursor.execute("RELEASE SAVEPOINT batch_chunk")
+
+        return created
+
+    async def update(self, user_id, fields, versions=None, revoke_tokens=True):
+        """
+        Updates the given columns of a user in a single statement and bumps
+        its row version
+        Returns:
+            bool: False if no such user exists
+        Raises:
+            DuplicateError: The new username is taken
+            VersionMismatch: The user exists but is at another version
+        """
+        update_query, update_params = update_statement(user_id, fields, versions)
+
+        try:
+            async with self.db.transaction() as cursor:
+                await cursor.execute(update_query, update_params)
+                updated = cursor.rowcount > 0
+                if updated and revoke_tokens:
+                    await cursor.execute(REVOKE_VERSION_SQL, (time.time(), user_id))
+        except self.db.backend.integrity_error:
+            raise DuplicateError('Username already exists')
+        return await self._check_write(updated, user_id, versions)
+
+    async def delete(self, user_id, versions=None, revoke_tokens=True):
+        """
+        Deletes a user in a single statement
+        Returns:
+            bool: False if no such user exists
+        Raises:
+            VersionMismatch: The user exists but is at another version
+        """
+        delete_query, delete_params = delete_statement(user_id, versions)
+
+        async with self.db.transaction() as cursor:
+            await cursor.execute(delete_query, delete_params)
+            deleted = cursor.rowcount > 0
+            if deleted and revoke_tokens:
+                await cursor.execute(REVOKE_ALL_SQL, (user_id, time.time()))
+        return await self._check_write(deleted, user_id, versions)
+
+    async def _check_write(self, written, user_id, versions):
+        if written:
+            return True
+        if versions and await self.exists(user_id):
+            raise VersionMismatch('User was modified')
+        return False
+
+
+class AsyncRevocationRepository:
+    """
+    Awaitable twin of RevocationRepository
+    Args:
+        database (AsyncDatabase): Database the queries run against
+    """
+    def __init__(self, database):
+        self.db = database
+
+    async def since(self, after_id, logged_since=None):
+        """
+        Returns:
+            list: (id, user_id, min_version, created_at) logged after after_id
+                or at or after logged_since
+        """
+        async with self.db.cursor() as cursor:
+            await cursor.execute(
+                "SELECT id, user_id, min_version, created_at FROM token_revocations "
+                "WHERE id > %s OR created_at >= %s ORDER BY id",
+                (after_id, time.time() if logged_since is None else logged_since)
+            )
+            return await cursor.fetchall()
+
+    async def prune(self, before):
+        """
+        Deletes entries logged before the given time
+        """
+        async with self.db.transaction() as cursor:
+            await cursor.execute("DELETE FROM token_revocations WHERE created_at < %s", (before,))
+
+
+# =============================================
+# QUART EXTENSION
+# =============================================
+class AsyncDatabase:
+    """
+    Quart extension owning the asyncio connection pool and repositories;
+    reads the same DB_* configuration as Database, and reports statements
+    to app.extensions['query_observers'] likewise
+    """
+    def __init__(self, app=None):
+        self.users = AsyncUserRepository(self)
+        self.revocations = AsyncRevocationRepository(self)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = ASYNC_BACKENDS[app.config.get('DB_BACKEND', 'mysql')](app.config)
+        pool = AsyncConnectionPool(
+            backend.connect,
+            backend.ping,
+            backend.close,
+            min_size=app.config.get('DB_POOL_MIN_SIZE', 1),
+            max_size=app.config.get('DB_POOL_MAX_SIZE', 10),
+            timeout=app.config.get('DB_POOL_TIMEOUT', 5.0),
+            max_idle=app.config.get('DB_POOL_MAX_IDLE', 300.0),
+            ping_interval=app.config.get('DB_POOL_PING_INTERVAL', 30.0)
+        )
+        app.extensions['database'] = (backend, pool)
+        app.extensions.setdefault('query_observers', [])
+        # Connections belong to the serving loop, so they are opened and
+        # closed with it
+        app.after_serving(pool.close)
+
+    @property
+    def backend(self):
+        return current_app.extensions['database'][0]
+
+    @property
+    def pool(self):
+        return current_app.extensions['database'][1]
+
+    @asynccontextmanager
+    async def cursor(self, streaming=False):
+        """
+        Yields a cursor on a pooled connection for read-only statements
+        Args:
+            streaming (bool): Use an unbuffered server-side cursor
+        """
+        async with self.pool.connection() as conn:
+            cursor = await self.backend.cursor(conn, streaming)
+            yield self._instrument(cursor)
+            await cursor.close()
+            await conn.rollback()  # end the read transaction so the next checkout sees fresh data
+
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Yields a cursor whose statements are committed together, or rolled
+        back if the block raises
+        """
+        async with self.pool.connection() as conn:
+            await self.backend.begin(conn)
+            cursor = await self.backend.cursor(conn)
+            try:
+                yield self._instrument(cursor)
+            finally:
+                await cursor.close()
+            await conn.commit()
+
+    def _instrument(self, cursor):
+        observers = current_app.extensions['query_observers']
+        return AsyncInstrumentedCursor(cursor, observers) if observers else cursor
@@ -0,0 +1,62 @@
+import zipfile
+
+# =============================================
+# STREAMING ZIP ARCHIVES
+# =============================================
+CHUNK_SIZE = 64 * 1024
+
+
+class _Pipe:
+    """
+    Write-only, unseekable file object collecting what ZipFile writes until
+    the generator hands it to the server. Being unseekable makes ZipFile
+    write sizes and CRCs after each entry instead of seeking back.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries, compresslevel=6):
+    """
+    Builds a ZIP archive while it is being sent: each file is read in chunks
+    and every chunk is yielded as soon as it is written, so memory use does
+    not depend on the size of the archive and nothing touches the disk
+    Args:
+        entries (iterable): (name in the archive, path, compress) tuples;
+            compress False stores the file as it is, e.g. images that
+            would not shrink. Missing paths are skipped.
+        compresslevel (int): Deflate level of compressed entries
+    Yields:
+        bytes: The archive, piece by piece
+    """
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as archive:
+        for name, path, compress in entries:
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                continue  # removed since the request started
+            with f:
+                info = zipfile.ZipInfo.from_file(path, name)
+                info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+                with archive.open(info, 'w') as entry:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                        entry.write(chunk)
+                        data = pipe.drain()
+                        if data:
+                            yield data
+            yield pipe.drain()
+    yield pipe.drain()  # central directory
+
@@ -0,0 +1,1177 @@
+from quart import (Quart, Response, current_app, g, has_request_context, jsonify, request, send_file,
+                   send_from_directory, stream_with_context)
+from quart.utils import run_sync
+from quart.wrappers.response import FileBody, IterableBody
+from werkzeug.exceptions import NotFound, RequestedRangeNotSatisfiable
+from werkzeug.utils import secure_filename
+from functools import wraps
+from aiodb import AsyncDatabase
+from archive import stream_zip
+from cache import ResponseCache, RevocationList, TokenCache, create_tag_versions
+from compression import FLUSH_SIZE, Compression, StreamCompressor, compress
+from db import DuplicateError, VersionMismatch, user_columns
+from filestore import FileStore
+from jobs import JobQueue
+from jsonprovider import error_body
+from metrics import EXPOSITION_TYPE, Metrics, render, scrape_allowed
+from querylog import QueryProfiler
+from ratelimit import RateLimiter, create_store, parse_limit
+from uploads import UploadError, UploadSessions
+import payloads
+import os
+import time
+
+# =============================================
+# ASYNC SERVING MODE
+# =============================================
+"""
+The routes of main.py served by Quart under an ASGI server, e.g.
+
+    hypercorn asgi:app --workers 4 --bind 0.0.0.0:5001
+
+Database round trips go through aiomysql/aiosqlite and file I/O through the
+event loop's executor, so a worker process keeps serving while thousands of
+slow clients upload, download or wait on the database. Request parsing,
+validation and response documents come from payloads.py, shared with the
+WSGI app, so URLs, payloads, error format and token semantics are the same;
+both read config.py, then the file named by FLASK_API_SETTINGS and FLASK_*
+variables. This module only awaits, streams and builds responses.
+Reads are not routed to DB_REPLICAS, and draining is left to the server:
+on SIGTERM Hypercorn stops accepting connections and lets in-flight
+requests finish within --graceful-timeout.
+"""
+app = Quart(__name__)
+app.config.from_object('config')
+app.config.from_envvar('FLASK_API_SETTINGS', silent=True)
+app.config.from_prefixed_env('FLASK')  # the same variables as the WSGI app
+
+
+class AsyncRateLimiter(RateLimiter):
+    """
+    RateLimiter for coroutine views; buckets, stores and headers are shared
+    with the WSGI app, the store being hit from the executor
+    """
+    def init_app(self, app):
+        app.extensions['ratelimit'] = create_store(app.config)
+        app.after_request(self._add_headers)
+
+    def limit(self, limit, key='ip'):
+        def decorator(f):
+            @wraps(f)
+            async def decorated(*args, **kwargs):
+                if current_app.config.get('RATELIMIT_ENABLED', True):
+                    requests_allowed, period = parse_limit(current_app.config.get(limit, limit))
+                    result = await run_sync(current_app.extensions['ratelimit'].hit)(
+                        self._bucket(request, key), requests_allowed, period)
+                    self._record(g, requests_allowed, result)
+                return await f(*args, **kwargs)
+            return decorated
+        return decorator
+
+    async def _add_headers(self, response):
+        return self._set_headers(getattr(g, 'rate_limit', None), response)
+
+
+class AsyncMetrics(Metrics):
+    """
+    Metrics for the Quart app, snapshotted to the same METRICS_DIR as the
+    WSGI app's
+    """
+    async def expose(self):
+        state = current_app.extensions['metrics']
+        self._flush(state)
+        snapshot = await run_sync(state.directory.collect)()
+        return Response(render(snapshot), content_type=EXPOSITION_TYPE)
+
+    async def _before_request(self):
+        self._start(current_app.extensions['metrics'], g)
+
+    async def _after_request(self, response):
+        state = current_app.extensions['metrics']
+        self._record(state, g, request, response)
+        if time.monotonic() >= state.next_flush:
+            self._flush(state)
+        return response
+
+    async def _teardown_request(self, error):
+        self._finish(current_app.extensions['metrics'], g)
+
+    def _observe_query(self, query, seconds):
+        self._record_query(current_app.extensions['metrics'], g if has_request_context() else None,
+                           query, seconds)
+
+
+class AsyncQueryProfiler(QueryProfiler):
+    """
+    QueryProfiler fed by the instrumented cursors of AsyncDatabase
+    """
+    @property
+    def stats(self):
+        return current_app.extensions['query_stats']
+
+    def _observe(self, query, seconds):
+        self._record(current_app, g if has_request_context() else None, request, query, seconds)
+
+    async def _check_repeats(self, error):
+        self._report_repeats(current_app, g, request)
+
+
+class AsyncCompression(Compression):
+    """
+    Compression choosing encodings like the WSGI app; streamed bodies are
+    compressed as their generators produce them. File downloads are left
+    alone, being served from their precompressed variants.
+    """
+    async def _compress(self, response):
+        if isinstance(response.response, FileBody):
+            return response
+        streamed = isinstance(response.response, IterableBody)
+        choice = self._choose(current_app, response, streamed, request.accept_encodings)
+        if choice is None:
+            return response
+        encoding, level = choice
+
+        if streamed:
+            response.response = IterableBody(compress_body(
+                response.response,
+                encoding,
+                level,
+                current_app.config.get('COMPRESSION_FLUSH_SIZE', FLUSH_SIZE)
+            ))
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(compress(await response.get_data(), encoding, level))
+        self._mark(response, encoding)
+        return response
+
+
+async def compress_body(body, encoding, level, flush_size):
+    """
+    Compresses a streamed response body chunk by chunk
+    Args:
+        body (IterableBody): The body to compress
+    """
+    compressor = StreamCompressor(encoding, level, flush_size)
+    async with body as chunks:
+        async for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    yield compressor.flush()
+
+
+metrics = AsyncMetrics(app)  # first, so its timer wraps the other request hooks
+compression = AsyncCompression(app)  # after_request runs in reverse: metrics sees compressed sizes
+db = AsyncDatabase(app)
+query_profiler = AsyncQueryProfiler(app)
+limiter = AsyncRateLimiter(app)
+token_cache = TokenCache(app.config['TOKEN_CACHE_SIZE'], app.config['TOKEN_CACHE_TTL'])
+response_cache = ResponseCache(
+    app.config['RESPONSE_CACHE_SIZE'],
+    versions=create_tag_versions(app.config)
+)
+
+def invalidate_user(user_id, publish=True):
+    """
+    Drops every cached token and response built from a user that changed;
+    publish=False when the change was read from the revocation log
+    """
+    token_cache.invalidate_user(user_id)
+    response_cache.invalidate('users', 'user:%d' % user_id, publish=publish)
+
+revocations = RevocationList(
+    db.revocations.since,
+    db.revocations.prune,
+    app.config['JWT_EXPIRATION'],
+    app.config['JWT_REVOCATION_REFRESH'],
+    on_revoke=lambda user_id: invalidate_user(user_id, publish=False),
+    overlap=app.config['JWT_REVOCATION_OVERLAP']
+)
+
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+file_store = FileStore(app.config['UPLOAD_FOLDER'])
+upload_sessions = UploadSessions(
+    file_store,
+    app.config['UPLOAD_MAX_SIZE'],
+    app.config['UPLOAD_SESSION_TTL']
+)
+job_queue = JobQueue(
+    file_store,
+    app.config['JOBS_MAX_PENDING'],
+    app.config['JOBS_MAX_ATTEMPTS'],
+    app.config['JOBS_RETRY_DELAY'],
+    app.config['JOBS_LEASE'],
+    app.config['JOBS_HEARTBEAT_TIMEOUT']
+)
+
+# =============================================
+# ERROR HANDLING AND HELPERS
+# =============================================
+def error_response(status_code, message):
+    """
+    Creates a standardized error response format
+    Args:
+        status_code (int): HTTP status code
+        message (str): Error message
+    Returns:
+        JSON response with error details
+    """
+    return current_app.response_class(error_body(status_code, message), status=status_code,
+                                      mimetype='application/json')
+
+def busy_response(message):
+    """
+    503 telling the client to retry shortly
+    """
+    response = error_response(503, message)
+    response.headers['Retry-After'] = '1'
+    return response
+
+def conditional(response):
+    """
+    Answers 304 when If-None-Match names the response's ETag
+    Args:
+        response (Response): Complete 200 response
+    Returns:
+        The response, or an empty 304 carrying its ETag
+    """
+    etag, _ = response.get_etag()
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        return Response('', 304, {'ETag': response.headers['ETag']})
+    return response
+
+# =============================================
+# AUTHENTICATION
+# =============================================
+def token_required(f):
+    """
+    Decorator for protecting routes that require authentication
+    Args:
+        f (function): The coroutine view to protect
+    Returns:
+        decorated coroutine that checks for valid JWT token
+    """
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        try:
+            token = payloads.request_token(request.headers.get('Authorization'))
+        except ValueError as e:
+            return error_response(401, str(e))
+
+        try:
+            await revocations.refresh_async()
+
+            current_user = token_cache.get(token)
+            if current_user is None:
+                data = payloads.decode_token(token, app.config)
+
+                current_user = payloads.stateless_user(data, app.config, revocations)
+                if current_user is None:
+                    current_user = await db.users.find_by_username(data['username'])
+
+                if not current_user:
+                    return error_response(401, 'Invalid token')
+
+                token_cache.put(token, current_user, data['exp'])
+
+        except Exception as e:
+            return error_response(401, 'Invalid token')
+
+        return await f(current_user, *args, **kwargs)
+
+    return decorated
+
+def cached_response(route, tags):
+    """
+    Decorator serving a read view's 200 responses from the response cache
+    Place it below token_required so authentication still runs on hits
+    Args:
+        route (str): Key of RESPONSE_CACHE_TTLS holding the lifetime
+        tags (function): Maps the view's URL arguments to the tags of the
+            data the response is built from, purged by writes
+    """
+    def decorator(f):
+        @wraps(f)
+        async def decorated(*args, **kwargs):
+            key = request.full_path
+            entry = response_cache.get(key)
+            if entry is not None:
+                body, status, headers = entry[:3]
+                return conditional(Response(body, status, headers))
+
+            entry_tags = tags(**kwargs)
+            generation = response_cache.generation(entry_tags)
+            response = await f(*args, **kwargs)
+            if response.status_code == 200:
+                response_cache.put(
+                    key,
+                    await response.get_data(),
+                    response.status_code,
+                    list(response.headers.items()),
+                    entry_tags,
+                    app.config['RESPONSE_CACHE_TTLS'][route],
+                    generation
+                )
+            return response
+
+        return decorated
+
+    return decorator
+
+@app.route('/create_table')
+async def create_table():
+    """
+    Initializes the database table and populates it with sample users
+    Returns:
+        200: Table created successfully
+        500: Database error
+    """
+    try:
+        await db.users.create_table(payloads.SAMPLE_USERS)
+        return jsonify({"message": "Table created and populated successfully"}), 200
+
+    except Exception as e:
+        return error_response(500, str(e))
+
+@app.route('/show_table', methods=['POST', 'GET'])
+async def show_table():
+    """
+    Returns one page of table rows, ordered by id, with the columns clients
+    may see
+    Returns:
+        200: List of rows, with a Link rel="next" header when more remain
+        400: Invalid pagination parameters or unknown field
+    """
+    try:
+        after_id, limit = payloads.page_params(request.args, app.config)
+        fields = payloads.fields_param(request.args)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    columns = user_columns(fields)
+    row_headers, rv = await db.users.dump(after_id, limit, columns)
+    json_data, link = payloads.table_page(row_headers, rv, fields, request.base_url, limit)
+    response = jsonify(json_data)
+    if link:
+        response.headers['Link'] = link
+    return response
+
+@app.route('/login', methods=['POST'])
+@limiter.limit('RATELIMIT_LOGIN', key='ip')
+async def login():
+    """
+    Authenticates user and provides JWT token
+    Returns:
+        200: JWT token
+        401: Invalid credentials
+    """
+    auth = request.authorization
+
+    if not auth or not auth.username or not auth.password:
+        return error_response(401, 'Login required')
+
+    user = await db.users.find_by_credentials(auth.username, auth.password)
+
+    if not user:
+        return error_response(401, 'Invalid credentials')
+
+    return jsonify({'token': payloads.issue_token(auth.username, user, app.config)})
+
+# =============================================
+# FILE HANDLING
+# =============================================
+@app.route('/admin/upload', methods=['POST'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_UPLOAD', key='token')
+@token_required
+async def upload_file(current_user):
+    """
+    Handles single-request file uploads, or adds a name for content that is
+    already stored when "filename" and "sha256" are sent instead of a file
+    Returns:
+        200: File uploaded successfully
+        400: Invalid file or file type
+        401: Invalid authentication
+        404: Content with the given sha256 is not stored; send the file
+        503: Too many files waiting to be processed, retry later
+    """
+    if await run_sync(job_queue.full)():
+        return busy_response('Processing queue is full')
+
+    files = await request.files
+    if 'file' not in files:
+        try:
+            filename, sha256 = payloads.link_request(await request.get_json(silent=True) or await request.form,
+                                                     app.config)
+        except ValueError as e:
+            return error_response(400, str(e))
+
+        result = await run_sync(file_store.link)(secure_filename(filename), sha256)
+        if result is None:
+            return error_response(404, 'Unknown content, upload the file')
+        await run_sync(job_queue.enqueue)(result['sha256'], result['filename'])
+        response_cache.invalidate('files')
+        return jsonify(payloads.uploaded_document(result))
+
+    file = files['file']
+
+    if file.filename == '':
+        return error_response(400, 'No selected file')
+
+    if file and payloads.allowed_file(file.filename, app.config):
+        filename = secure_filename(file.filename)
+        result = await run_sync(file_store.save)(filename, file.stream)
+        await run_sync(job_queue.enqueue)(result['sha256'], filename)
+        response_cache.invalidate('files')
+        return jsonify(payloads.uploaded_document(result))
+
+    return error_response(400, 'File type not allowed')
+
+def upload_session_response(session, status_code=200):
+    """
+    Serializes a chunked upload session, exposing its offset as a header too
+    """
+    response = jsonify(payloads.upload_session_document(session))
+    response.status_code = status_code
+    response.headers['Upload-Offset'] = str(session['offset'])
+    return response
+
+def upload_error_response(error):
+    """
+    Converts an UploadError, telling the client where to resume when known
+    """
+    response = error_response(error.status_code, str(error))
+    if error.offset is not None:
+        response.headers['Upload-Offset'] = str(error.offset)
+    return response
+
+@app.route('/admin/uploads', methods=['POST'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_UPLOAD', key='token')
+@token_required
+async def create_upload(current_user):
+    """
+    Starts a resumable chunked upload for files beyond MAX_CONTENT_LENGTH
+    Returns:
+        200: Content with this sha256 was already stored under another name
+        201: Upload session with its upload_id and offset 0
+        400: Invalid input or file type
+        413: Declared size is too large
+        503: Processing queue is full; retry
+    """
+    try:
+        filename, size, sha256 = payloads.upload_request(await request.get_json(silent=True), app.config)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    if await run_sync(job_queue.full)():
+        return busy_response('Processing queue is full')
+
+    if sha256:
+        result = await run_sync(file_store.link)(secure_filename(filename), sha256)
+        if result is not None:
+            await run_sync(job_queue.enqueue)(result['sha256'], result['filename'])
+            response_cache.invalidate('files')
+            return jsonify(payloads.uploaded_document(result))
+
+    try:
+        session = await run_sync(upload_sessions.create)(secure_filename(filename), current_user[0], size)
+    except UploadError as e:
+        return upload_error_response(e)
+
+    response = upload_session_response(session, 201)
+    response.headers['Location'] = '/admin/uploads/%s' % session['upload_id']
+    return response
+
+@app.route('/admin/uploads/<upload_id>', methods=['GET'])
+@token_required
+async def get_upload(current_user, upload_id):
+    """
+    Reports how much of a chunked upload has been received
+    Returns:
+        200: Upload session with its current offset
+        404: Upload not found
+    """
+    try:
+        return upload_session_response(await run_sync(upload_sessions.get)(upload_id, current_user[0]))
+    except UploadError as e:
+        return upload_error_response(e)
+
+@app.route('/admin/uploads/<upload_id>', methods=['PATCH'])
+@token_required
+async def append_upload(current_user, upload_id):
+    """
+    Appends the raw request body to a chunked upload as it arrives
+    Returns:
+        200: New offset
+        400: Missing or invalid Upload-Offset
+        404: Upload not found
+        409: Offset mismatch or concurrent chunk, with the current offset
+        413: Upload exceeds its declared or the maximum size
+    """
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None or offset < 0:
+        return error_response(400, 'Upload-Offset header is required')
+
+    try:
+        session = await run_sync(upload_sessions.get)(upload_id, current_user[0])
+        session['offset'] = await upload_sessions.append_async(
+            upload_id, current_user[0], offset, request.body)
+        return upload_session_response(session)
+    except UploadError as e:
+        return upload_error_response(e)
+
+@app.route('/admin/uploads/<upload_id>/complete', methods=['POST'])
+@token_required
+async def complete_upload(current_user, upload_id):
+    """
+    Finalizes a chunked upload and moves the file into the upload directory
+    Returns:
+        200: File uploaded successfully
+        404: Upload not found
+        409: Upload is incomplete
+        422: Checksum mismatch
+    """
+    data = await request.get_json(silent=True) or {}
+
+    try:
+        result = await run_sync(upload_sessions.complete)(upload_id, current_user[0], data.get('sha256'))
+    except UploadError as e:
+        return upload_error_response(e)
+
+    await run_sync(job_queue.enqueue)(result['sha256'], result['filename'])
+    response_cache.invalidate('files')
+    return jsonify(payloads.uploaded_document(result))
+
+@app.route('/admin/uploads/<upload_id>', methods=['DELETE'])
+@token_required
+async def abort_upload(current_user, upload_id):
+    """
+    Cancels a chunked upload and discards the data received so far
+    Returns:
+        200: Upload cancelled
+        404: Upload not found
+    """
+    try:
+        await run_sync(upload_sessions.abort)(upload_id, current_user[0])
+    except UploadError as e:
+        return upload_error_response(e)
+
+    return jsonify({"message": "Upload cancelled"})
+
+# =============================================
+# PUBLIC AND PROTECTED ROUTES
+# =============================================
+@app.route('/public/items', methods=['GET'])
+@cached_response('public_items', lambda: ['public_items'])
+async def get_public_items():
+    """
+    Public endpoint that doesn't require authentication
+    Returns:
+        200: List of public items
+    """
+    return jsonify({"items": payloads.PUBLIC_ITEMS})
+
+# =============================================
+# HEALTH CHECKS AND METRICS
+# =============================================
+@app.route('/healthz', methods=['GET'])
+async def liveness():
+    """
+    Liveness probe: the worker is up and serving requests
+    Returns:
+        200: Always
+    """
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods=['GET'])
+async def readiness():
+    """
+    Readiness probe: a database connection answers and the upload folder
+    is writable
+    Returns:
+        200: Ready, with the connection pool counters
+        503: Not ready, and why
+    """
+    try:
+        async with db.pool.connection() as conn:
+            await db.backend.ping(conn)
+    except Exception as e:
+        return error_response(503, 'Database unavailable: %s' % e)
+
+    if not os.access(app.config['UPLOAD_FOLDER'], os.W_OK):
+        return error_response(503, 'Upload folder is not writable')
+
+    return jsonify({"status": "ready", "pool": db.pool.stats()})
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    """
+    Request, database, cache and pool metrics of every worker on the host,
+    in the Prometheus text format, for clients in METRICS_ALLOWED_NETWORKS
+    Returns:
+        200: The exposition
+        403: The client is not allowed to scrape
+    """
+    if not scrape_allowed(request.remote_addr, app.config['METRICS_ALLOWED_NETWORKS']):
+        return error_response(403, 'Metrics are not available to this client')
+    return await metrics.expose()
+
+@metrics.collector
+def collect_state(registry):
+    """
+    Copies the cache and connection pool counters of this worker into the
+    metrics registry before each snapshot
+    """
+    hits = registry.counter('cache_hits_total', 'Cache lookups answered from memory', ('cache',))
+    misses = registry.counter('cache_misses_total', 'Cache lookups that missed', ('cache',))
+    entries = registry.gauge('cache_entries', 'Entries held by the cache', ('cache',))
+    for name, cache in (('token', token_cache), ('response', response_cache)):
+        stats = cache.stats()
+        hits.set(stats['hits'], cache=name)
+        misses.set(stats['misses'], cache=name)
+        entries.set(stats['size'], cache=name)
+
+    pool = db.pool.stats()
+    connections = registry.gauge('db_pool_connections', 'Pooled database connections', ('state',))
+    connections.set(pool['in_use'], state='in_use')
+    connections.set(pool['idle'], state='idle')
+
+@app.route('/admin/profile', methods=['GET'])
+@token_required
+async def get_profile(current_user):
+    """
+    Protected route that returns the current user's profile
+    Returns:
+        200: User profile information
+        401: Invalid or missing token
+    """
+    return jsonify({
+        "username": current_user[1],
+        "message": "This is a protected route"
+    })
+
+@app.route('/admin/token_cache', methods=['GET'])
+@token_required
+async def get_token_cache_stats(current_user):
+    """
+    Protected route reporting the token cache counters
+    Returns:
+        200: Token cache size and hit/miss counters
+        401: Invalid or missing token
+    """
+    return jsonify(token_cache.stats())
+
+@app.route('/admin/queries', methods=['GET'])
+@token_required
+async def get_query_stats(current_user):
+    """
+    Protected route reporting the statements this worker spent the most
+    time on and the routes showing N+1 patterns
+    Returns:
+        200: Top fingerprints with count, total, mean and max time
+        400: Invalid sort or limit
+        401: Invalid or missing token
+    """
+    try:
+        sort, limit = payloads.query_report_params(request.args)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    report = query_profiler.stats.report(sort, limit)
+    report['slow_threshold_ms'] = app.config['SLOW_QUERY_THRESHOLD'] * 1000
+    return jsonify(report)
+
+# =============================================
+# CRUD SERVICES
+# =============================================
+@app.route('/users', methods=['POST'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_USERS', key='token')
+@token_required
+async def create_user(current_user):
+    """
+    Creates a new user in the system
+    Returns:
+        201: User created successfully
+        400: Invalid input
+        409: Username already exists
+    """
+    try:
+        try:
+            username, password = payloads.new_user(await request.get_json())
+        except ValueError as e:
+            return error_response(400, str(e))
+
+        user_id = await db.users.create(username, password)
+        response_cache.invalidate('users')
+
+        response = jsonify(payloads.created_user_document(user_id, username))
+        response.status_code = 201
+        response.set_etag(payloads.user_etag(1))
+        return response
+
+    except DuplicateError:
+        return error_response(409, 'Username already exists')
+
+    except Exception as e:
+        return error_response(500, str(e))
+
+@app.route('/users/batch', methods=['POST'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_USERS', key='token')
+@token_required
+async def create_users_batch(current_user):
+    """
+    Creates many users in one transaction, from a JSON array or NDJSON
+    Returns:
+        200: Per-item results plus created/conflict totals
+        400: Malformed payload or invalid items
+    """
+    try:
+        try:
+            if request.mimetype == 'application/x-ndjson':
+                items = payloads.ndjson_items(await request.get_data(as_text=True))
+            else:
+                items = await request.get_json(silent=True)
+            users = payloads.batch_users(items, app.config['BATCH_MAX_USERS'])
+        except ValueError as e:
+            return error_response(400, str(e))
+
+        created = await db.users.create_many(users, chunk_size=app.config['BATCH_CHUNK_SIZE'])
+        if created:
+            response_cache.invalidate('users')
+
+        return jsonify(payloads.batch_document(users, created))
+
+    except Exception as e:
+        return error_response(500, str(e))
+
+@app.route('/users', methods=['GET'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_USERS', key='token')
+@token_required
+@cached_response('users', lambda: ['users'])
+async def get_all_users(current_user):
+    """
+    Retrieves users in the system, one keyset page at a time, or the first
+    users matching ?q= in ?mode= prefix, substring or fuzzy, with only the
+    ?fields= asked for
+    Returns:
+        200: List of users and the cursor of the next page (null on the last,
+            and for searches)
+        400: Invalid pagination, search or fields parameters
+        500: Server error
+    """
+    try:
+        fields = payloads.fields_param(request.args)
+    except ValueError as e:
+        return error_response(400, str(e))
+    columns = user_columns(fields)
+
+    if 'q' in request.args:
+        try:
+            text, mode, limit = payloads.search_params(request.args, app.config)
+        except ValueError as e:
+            return error_response(400, str(e))
+
+        try:
+            users = await db.users.search(text, mode, limit, columns)
+            return jsonify(payloads.users_document(columns, users, fields))
+
+        except Exception as e:
+            return error_response(500, str(e))
+
+    try:
+        after_id, limit = payloads.page_params(request.args, app.config)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    try:
+        users = await db.users.list(after_id, limit, columns)
+        return jsonify(payloads.users_document(columns, users, fields, limit))
+
+    except Exception as e:
+        return error_response(500, str(e))
+
+@app.route('/users/export', methods=['GET'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_USERS', key='token')
+@token_required
+async def export_users(current_user):
+    """
+    Streams every user for bulk syncs, straight from a server-side cursor
+    Returns:
+        200: Chunked NDJSON or CSV body of id and username
+        400: Unsupported format
+    """
+    export_format = request.args.get('format', 'ndjson')
+    try:
+        encode, header, mimetype = payloads.export_format(export_format)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    # The app context is gone once the view returns; the cursor needs it
+    @stream_with_context
+    async def generate():
+        if header:
+            yield header.encode()
+        async for rows in db.users.export():
+            yield encode(rows).encode()
+
+    response = Response(generate(), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename=users.%s' % export_format
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/users/<int:user_id>', methods=['GET'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_USERS', key='token')
+@token_required
+@cached_response('user', lambda user_id: ['user:%d' % user_id])
+async def get_user(current_user, user_id):
+    """
+    Retrieves a specific user by ID, with only the ?fields= asked for
+    Returns:
+        200: User details, with an ETag of the row version
+        304: Not modified since the ETag sent in If-None-Match
+        400: Unknown field
+        404: User not found
+    """
+    try:
+        fields = payloads.fields_param(request.args)
+    except ValueError as e:
+        return error_response(400, str(e))
+    columns = user_columns(fields)
+
+    try:
+        user = await db.users.get(user_id, columns)
+
+        if not user:
+            return error_response(404, 'User not found')
+
+        response = jsonify(payloads.user_document(columns, user, fields))
+        response.set_etag(payloads.user_etag(user[-1]))
+        return conditional(response)
+
+    except Exception as e:
+        return error_response(500, str(e))
+
+@app.route('/users/<int:user_id>', methods=['PUT'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_USERS', key='token')
+@token_required
+async def update_user(current_user, user_id):
+    """
+    Updates an existing user's information
+    Returns:
+        200: User updated successfully
+        400: Invalid input
+        404: User not found
+        409: Username already exists
+        412: User was modified since the ETag in If-Match
+    """
+    try:
+        versions = payloads.if_match_versions(request.if_match)
+    except ValueError as e:
+        return error_response(412, str(e))
+
+    try:
+        try:
+            data = payloads.user_changes(await request.get_json())
+        except ValueError as e:
+            return error_response(400, str(e))
+
+        if not await db.users.update(user_id, data, versions):
+            return error_response(404, 'User not found')
+        invalidate_user(user_id)
+        await revocations.refresh_async(force=True)
+
+        return jsonify({"message": "User updated successfully"})
+
+    except VersionMismatch:
+        return error_response(412, 'Precondition Failed')
+
+    except DuplicateError:
+        return error_response(409, 'Username already exists')
+
+    except Exception as e:
+        return error_response(500, str(e))
+
+@app.route('/users/<int:user_id>', methods=['DELETE'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_USERS', key='token')
+@token_required
+async def delete_user(current_user, user_id):
+    """
+    Deletes a user from the system
+    Returns:
+        200: User deleted successfully
+        404: User not found
+        412: User was modified since the ETag in If-Match
+    """
+    try:
+        versions = payloads.if_match_versions(request.if_match)
+    except ValueError as e:
+        return error_response(412, str(e))
+
+    try:
+        if not await db.users.delete(user_id, versions):
+            return error_response(404, 'User not found')
+        invalidate_user(user_id)
+        await revocations.refresh_async(force=True)
+
+        return jsonify({"message": "User deleted successfully"})
+
+    except VersionMismatch:
+        return error_response(412, 'Precondition Failed')
+
+    except Exception as e:
+        return error_response(500, str(e))
+
+@app.route('/files', methods=['GET'])
+@token_required
+@cached_response('files', lambda: ['files'])
+async def get_all_files(current_user):
+    """
+    Lists the files in the upload directory from the file index, one
+    keyset page at a time, with the filters of the WSGI route
+    Returns:
+        200: List of file information and the cursor of the next page
+        400: Invalid query parameters
+        500: Server error
+    """
+    try:
+        sort, descending, after, limit, filters = payloads.file_list_params(request.args, app.config)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    try:
+        files, next_key = await run_sync(file_store.list)(sort, descending, after, limit, **filters)
+        statuses = await run_sync(job_queue.statuses)([file['sha256'] for file in files])
+        return jsonify(payloads.files_document(files, statuses, sort, descending, next_key))
+
+    except Exception as e:
+        return error_response(500, str(e))
+
+@app.route('/files/archive', methods=['GET', 'POST'])
+@token_required
+async def get_archive(current_user):
+    """
+    Downloads several files as one ZIP archive, built while it is sent,
+    from ?names=a.txt,b.png on GET or {"names": [...]} on POST
+    Returns:
+        200: The ZIP archive
+        400: No names, a path instead of a name, or more than ARCHIVE_MAX_FILES
+        404: Some of the files do not exist, before any byte is sent
+    """
+    data = await request.get_json(silent=True) if request.method == 'POST' else None
+    try:
+        names = payloads.archive_names(request.method, data, request.args, app.config['ARCHIVE_MAX_FILES'])
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    try:
+        entries = await run_sync(payloads.archive_entries)(names, file_store)
+    except LookupError as e:
+        return error_response(404, str(e))
+
+    # stream_zip reads the files on the executor, one chunk at a time
+    response = Response(stream_zip(entries), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename=files.zip'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+async def send_precompressed(meta):
+    """
+    Sends the compressed variant of a stored file that best matches
+    Accept-Encoding
+    Args:
+        meta (dict): Indexed metadata of the file
+    Returns:
+        Response: The variant, or None to send the file as it is
+    """
+    variant = await run_sync(payloads.precompressed_variant)(
+        meta, request.headers, request.accept_encodings, file_store)
+    if variant is None:
+        return None
+    encoding, path = variant
+
+    response = await send_file(
+        path,
+        mimetype=meta['content_type'],
+        as_attachment=True,
+        attachment_filename=meta['filename'],
+        add_etags=False
+    )
+    response.set_etag('%s-%s' % (meta['sha256'], encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return conditional(response)
+
+@app.route('/files/<filename>', methods=['GET'])
+@token_required
+async def get_file(current_user, filename):
+    """
+    Downloads a specific file, read by Quart in chunks off the event loop,
+    with the same Range/If-Range, ETag, precompressed variant and proxy
+    offload support as the WSGI route
+    Returns:
+        200: File download
+        206: Requested byte range
+        304: Not modified since the ETag in If-None-Match
+        404: File not found
+        416: Range not satisfiable
+    """
+    if filename.startswith('.'):
+        return error_response(404, 'File not found')  # store internals
+
+    try:
+        meta = await run_sync(file_store.get)(filename)
+
+        response = await send_precompressed(meta)
+        if response is not None:
+            return response
+
+        if meta is not None and app.config['FILE_OFFLOAD'] == 'x-accel-redirect':
+            response = Response('', mimetype=meta['content_type'] or 'application/octet-stream',
+                                headers=payloads.accel_headers(filename, app.config))
+            response.set_etag(meta['sha256'])
+            return response
+
+        response = await send_from_directory(
+            app.config['UPLOAD_FOLDER'],
+            filename,
+            as_attachment=True,
+            add_etags=meta is None,
+            conditional=False
+        )
+        if meta is not None:
+            response.set_etag(meta['sha256'])
+        response = conditional(response)
+        if response.status_code == 304:
+            return response
+
+    except (FileNotFoundError, NotFound):
+        return error_response(404, 'File not found')
+
+    size = response.content_length
+    try:
+        # A stale If-Range gets the whole, current file instead of a range
+        return await response.make_conditional(request, accept_ranges=True, complete_length=size)
+    except RequestedRangeNotSatisfiable:
+        response = error_response(416, 'Range Not Satisfiable')
+        response.headers['Content-Range'] = 'bytes */%d' % size
+        return response
+
+@app.route('/files/<filename>/processing', methods=['GET'])
+@token_required
+async def get_file_processing(current_user, filename):
+    """
+    Reports the post-upload processing of a file and its derived artifacts
+    Returns:
+        200: Job status, attempts, last error and result
+        404: File not found, or never queued for processing
+    """
+    meta = await run_sync(file_store.get)(filename) if not filename.startswith('.') else None
+    if meta is None:
+        return error_response(404, 'File not found')
+
+    job = await run_sync(job_queue.get)(meta['sha256'])
+    if job is None:
+        return error_response(404, 'File was not processed')
+    return jsonify(payloads.job_document(job, meta))
+
+@app.route('/files/<filename>/derived/<artifact>', methods=['GET'])
+@token_required
+async def get_file_artifact(current_user, filename, artifact):
+    """
+    Downloads an artifact derived from a file, e.g. thumbnail.png or text.txt
+    Returns:
+        200: The artifact
+        404: File or artifact not found
+    """
+    meta = await run_sync(file_store.get)(filename) if not filename.startswith('.') else None
+    if meta is None:
+        return error_response(404, 'File not found')
+
+    if not payloads.has_artifact(await run_sync(job_queue.get)(meta['sha256']), artifact):
+        return error_response(404, 'Artifact not found')
+    return await send_from_directory(file_store.derived_path(meta['sha256']), artifact)
+
+@app.route('/files/<filename>', methods=['DELETE'])
+@token_required
+async def delete_file(current_user, filename):
+    """
+    Deletes a specific file from the upload directory
+    Returns:
+        200: File deleted successfully
+        404: File not found
+    """
+    if filename.startswith('.'):
+        return error_response(404, 'File not found')  # store internals
+
+    try:
+        if not await run_sync(file_store.remove)(filename):
+            return error_response(404, 'File not found')
+        response_cache.invalidate('files')
+
+        return jsonify({"message": "File deleted successfully"})
+
+    except Exception as e:
+        return error_response(500, str(e))
+
+# =============================================
+# ERROR HANDLERS
+# =============================================
+@app.errorhandler(400)
+async def bad_request_error(error):
+    """
+    Handles Bad Request errors
+    """
+    return error_response(400, "Bad Request")
+
+@app.errorhandler(401)
+async def unauthorized_error(error):
+    """
+    Handles Unauthorized errors
+    """
+    return error_response(401, "Unauthorized")
+
+@app.errorhandler(403)
+async def forbidden_error(error):
+    """
+    Handles Forbidden errors
+    """
+    return error_response(403, "Forbidden")
+
+@app.errorhandler(404)
+async def not_found_error(error):
+    """
+    Handles Not Found errors
+    """
+    return error_response(404, "Page Not Found")
+
+@app.errorhandler(406)
+async def not_acceptable_error(error):
+    """
+    Handles Not Acceptable errors
+    """
+    return error_response(406, "Not Acceptable")
+
+@app.errorhandler(415)
+async def unsupported_media_error(error):
+    """
+    Handles Unsupported Media Type errors
+    """
+    return error_response(415, "Unsupported Media Type")
+
+@app.errorhandler(429)
+async def too_many_requests_error(error):
+    """
+    Handles Too Many Requests errors
+    """
+    return error_response(429, "Too Many Requests")
+
+if __name__ == "__main__":
+    app.run(debug=True, port=5001)
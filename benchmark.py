@@ -0,0 +1,496 @@
+import argparse
+import base64
+import datetime
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+# =============================================
+# LOAD TESTING AND BENCHMARKS
+# =============================================
+"""
+Drives every endpoint at a given concurrency and reports throughput and
+latency percentiles as JSON.
+
+By default the app is started in-process (create_app with the SQLite backend
+in a temporary directory, served by the threaded werkzeug server). Point
+--url at a running server to measure a real deployment instead, e.g.
+
+    FLASK_DB_BACKEND=sqlite FLASK_RATELIMIT_ENABLED=false gunicorn -c gunicorn.conf.py
+    python benchmark.py --url http://127.0.0.1:5001 --output baseline.json
+
+and later compare a build against it; the exit status is 1 when a scenario
+regressed by more than --max-regression:
+
+    python benchmark.py --baseline baseline.json
+
+--micro instead times building single responses in-process (JSON encoding
+and error bodies), without any network or database.
+"""
+SEED_USER = ('emmanuel_montoya', 'em12345')  # created by /create_table
+
+
+class Client:
+    """
+    Minimal keep-alive HTTP client, one per benchmark thread
+    Args:
+        base_url (str): Scheme, host and port of the server
+        token (str): JWT sent as a Bearer token, if any
+    """
+    def __init__(self, base_url, token=None):
+        url = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.conn = connection_class(url.hostname, url.port, timeout=60)
+        self.token = token
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Sends a request and reads the whole response
+        Returns:
+            tuple: (status, body bytes)
+        """
+        headers = dict(headers or {})
+        if self.token:
+            headers['Authorization'] = 'Bearer %s' % self.token
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            # Dropped keep-alive connection; the next request reconnects
+            self.conn.close()
+            raise
+
+    def json(self, method, path, payload=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if payload is not None:
+            body = json.dumps(payload)
+            headers['Content-Type'] = 'application/json'
+        status, data = self.request(method, path, body, headers)
+        return status, json.loads(data) if data else None
+
+    def close(self):
+        self.conn.close()
+
+
+def basic_auth(username, password):
+    return {'Authorization': 'Basic %s' % base64.b64encode(
+        ('%s:%s' % (username, password)).encode()).decode()}
+
+
+def multipart(filename, content):
+    """
+    Encodes a file as the multipart/form-data body /admin/upload expects
+    Returns:
+        tuple: (body bytes, headers)
+    """
+    boundary = 'benchmark%016x' % random.getrandbits(64)
+    body = b''.join([
+        b'--%s\r\n' % boundary.encode(),
+        b'Content-Disposition: form-data; name="file"; filename="%s"\r\n' % filename.encode(),
+        b'Content-Type: application/octet-stream\r\n\r\n',
+        content,
+        b'\r\n--%s--\r\n' % boundary.encode()
+    ])
+    return body, {'Content-Type': 'multipart/form-data; boundary=%s' % boundary}
+
+
+# =============================================
+# SCENARIOS
+# =============================================
+class Benchmark:
+    """
+    Seeds the server and runs the scenarios against it
+    Args:
+        base_url (str): Server to benchmark
+        options (Namespace): Parsed command line options
+    """
+    def __init__(self, base_url, options):
+        self.base_url = base_url
+        self.options = options
+        self.run_id = '%x' % int(time.time())
+        self.token = None
+        self.user_ids = []
+        self.created_ids = []
+        self.filenames = []
+
+    def seed(self):
+        """
+        Creates the table, N users and M files, and logs in
+        """
+        client = Client(self.base_url)
+        status, _ = client.request('GET', '/create_table')
+        if status != 200:
+            raise RuntimeError('GET /create_table answered %d' % status)
+        status, data = client.json('POST', '/login', headers=basic_auth(*SEED_USER))
+        if status != 200:
+            raise RuntimeError('POST /login answered %d' % status)
+        self.token = data['token']
+        client.token = self.token
+
+        users = [{"username": self.username(i), "password": 'pw%d' % i}
+                 for i in range(self.options.users)]
+        for i in range(0, len(users), 1000):
+            status, _ = client.json('POST', '/users/batch', users[i:i + 1000])
+            if status != 200:
+                raise RuntimeError('POST /users/batch answered %d' % status)
+
+        after = ''
+        while True:
+            status, data = client.json('GET', '/users?limit=1000' + after)
+            self.user_ids.extend(user['id'] for user in data['users']
+                                 if user['username'].startswith('b%s_' % self.run_id))
+            if not data['next_cursor']:
+                break
+            after = '&after=' + data['next_cursor']
+
+        for i in range(self.options.files):
+            name = 'bench_%s_%d.txt' % (self.run_id, i)
+            body, headers = multipart(name, os.urandom(self.options.file_size))
+            status, _ = client.request('POST', '/admin/upload', body, headers)
+            if status != 200:
+                raise RuntimeError('POST /admin/upload answered %d' % status)
+            self.filenames.append(name)
+        client.close()
+
+    def username(self, i):
+        return 'b%s_%d' % (self.run_id, i)  # at most 20 characters
+
+    def scenarios(self):
+        """
+        Returns:
+            dict: Scenario name -> function(client, i) sending one request
+        """
+        return {
+            'login': self.login,
+            'users_list': lambda c, i: c.request('GET', '/users?limit=100'),
+            'user_get': lambda c, i: c.request('GET', '/users/%d' % random.choice(self.user_ids)),
+            'user_create': self.user_create,
+            'user_update': self.user_update,
+            'user_delete': self.user_delete,
+            'upload': self.upload,
+            'files_list': lambda c, i: c.request('GET', '/files?limit=100'),
+            'file_download': lambda c, i: c.request('GET', '/files/%s' % random.choice(self.filenames))
+        }
+
+    def login(self, client, i):
+        n = random.randrange(len(self.user_ids)) if self.user_ids else 0
+        token, client.token = client.token, None
+        try:
+            return client.request('POST', '/login', headers=basic_auth(self.username(n), 'pw%d' % n))
+        finally:
+            client.token = token
+
+    def user_create(self, client, i):
+        status, data = client.json('POST', '/users', {
+            "username": 'c%s_%d' % (self.run_id, i), "password": 'pw'})
+        if status == 201:
+            self.created_ids.append(data['id'])
+        return status, data
+
+    def user_update(self, client, i):
+        return client.json('PUT', '/users/%d' % random.choice(self.user_ids), {"password": 'pw%d' % i})
+
+    def user_delete(self, client, i):
+        # Deletes the users user_create made, so it runs after it
+        if not self.created_ids:
+            return 404, None
+        return client.request('DELETE', '/users/%d' % self.created_ids.pop())
+
+    def upload(self, client, i):
+        body, headers = multipart('bench_%s_up_%d.txt' % (self.run_id, i),
+                                  os.urandom(self.options.file_size))
+        return client.request('POST', '/admin/upload', body, headers)
+
+    def run(self, name, send):
+        """
+        Sends --warmup unrecorded requests, then --requests recorded ones
+        from --concurrency threads
+        Returns:
+            dict: Throughput, latency percentiles and status counts
+        """
+        counter = itertools.count()
+        total = self.options.warmup + self.options.requests
+        latencies = []
+        statuses = {}
+        errors = [0]
+        lock = threading.Lock()
+
+        def worker():
+            client = Client(self.base_url, self.token)
+            while True:
+                i = next(counter)
+                if i >= total:
+                    break
+                start = time.perf_counter()
+                try:
+                    status = send(client, i)[0]
+                except Exception:
+                    status = None
+                elapsed = time.perf_counter() - start
+                if i < self.options.warmup:
+                    continue
+                with lock:
+                    if status is None or status >= 500:
+                        errors[0] += 1
+                    statuses[str(status)] = statuses.get(str(status), 0) + 1
+                    latencies.append(elapsed)
+            client.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.options.concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - started
+        return summarize(latencies, duration, statuses, errors[0])
+
+
+def summarize(latencies, duration, statuses, errors):
+    """
+    Reduces the latencies of a scenario to the reported statistics
+    Args:
+        latencies (list): Seconds per recorded request
+        duration (float): Wall time of the scenario in seconds
+        statuses (dict): Response count per status code
+        errors (int): Failed requests (no response or 5xx)
+    Returns:
+        dict: requests, errors, throughput and latency_ms percentiles
+    """
+    ms = sorted(latency * 1000 for latency in latencies)
+    if len(ms) >= 2:
+        cuts = statistics.quantiles(ms, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = ms[0] if ms else 0.0
+    return {
+        "requests": len(ms),
+        "errors": errors,
+        "statuses": statuses,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(ms) / duration, 1) if duration else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(ms), 3) if ms else 0.0,
+            "p50": round(p50, 3),
+            "p95": round(p95, 3),
+            "p99": round(p99, 3),
+            "max": round(ms[-1], 3) if ms else 0.0
+        }
+    }
+
+
+def compare(results, baseline, max_regression):
+    """
+    Compares each scenario with the same scenario of a previous run
+    A scenario regresses when its p95 latency grew, or its throughput
+    dropped, by more than max_regression (a fraction)
+    Returns:
+        dict: Per-scenario relative changes and a regressed flag
+    """
+    comparison = {}
+    for name, current in results.items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        changes = {}
+        for metric in ('p50', 'p95', 'p99'):
+            before = previous['latency_ms'][metric]
+            changes[metric] = round((current['latency_ms'][metric] - before) / before, 4) if before else 0.0
+        before = previous['throughput_rps']
+        changes['throughput_rps'] = round((current['throughput_rps'] - before) / before, 4) if before else 0.0
+        changes['regressed'] = (changes['p95'] > max_regression
+                                or changes['throughput_rps'] < -max_regression)
+        comparison[name] = changes
+    return comparison
+
+
+# =============================================
+# IN-PROCESS SERVER
+# =============================================
+def start_server(workdir):
+    """
+    Serves create_app() on a free local port with a throwaway SQLite
+    database and upload folder, no rate limits and no queue backpressure:
+    uploads queue jobs no worker drains, which must not turn into 503s
+    Returns:
+        tuple: (base URL, server to shut down)
+    """
+    from werkzeug.serving import make_server
+    from main import create_app
+
+    app = create_app({
+        'DB_BACKEND': 'sqlite',
+        'SQLITE_PATH': os.path.join(workdir, 'benchmark.db'),
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'RATELIMIT_ENABLED': False,
+        'JOBS_MAX_PENDING': sys.maxsize
+    })
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:%d' % server.server_port, server
+
+
+# =============================================
+# MICRO-BENCHMARKS
+# =============================================
+def micro_json(workdir, iterations):
+    """
+    Times building single responses inside a request context: error bodies
+    serialized on every call (as error_response used to) against the
+    pre-encoded ones, and a page of users with Flask's default JSON provider
+    against FastJSONProvider
+    Returns:
+        dict: Microseconds per response before and after, per case
+    """
+    import timeit
+    from flask import jsonify
+    from flask.json.provider import DefaultJSONProvider
+    from jsonprovider import FastJSONProvider
+    from main import create_app, error_response
+
+    app = create_app({
+        'DB_BACKEND': 'sqlite',
+        'SQLITE_PATH': os.path.join(workdir, 'benchmark.db'),
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads')
+    })
+    page = {
+        "users": [{"id": i, "username": "user_%d" % i} for i in range(100)],
+        "next_cursor": "eyJpZCI6IDEwMH0"
+    }
+
+    def serialized_error():
+        response = jsonify({"error": {"code": 401, "message": "Token is missing"}})
+        response.status_code = 401
+        return response
+
+    def timed(f):
+        return min(timeit.repeat(f, number=iterations, repeat=5)) / iterations * 1e6
+
+    results = {}
+    with app.test_request_context():
+        app.json = DefaultJSONProvider(app)
+        before = {
+            "error_401": timed(serialized_error),
+            "users_page": timed(lambda: jsonify(page))
+        }
+        app.json = FastJSONProvider(app)
+        after = {
+            "error_401": timed(lambda: error_response(401, 'Token is missing')),
+            "users_page": timed(lambda: jsonify(page))
+        }
+    for case in before:
+        results[case] = {
+            "before_us": round(before[case], 2),
+            "after_us": round(after[case], 2),
+            "saving_us": round(before[case] - after[case], 2),
+            "speedup": round(before[case] / after[case], 2)
+        }
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the API endpoints')
+    parser.add_argument('--url', help='Running server to benchmark; by default one is started in-process')
+    parser.add_argument('--users', type=int, default=1000, help='Users to seed')
+    parser.add_argument('--files', type=int, default=50, help='Files to seed')
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help='Bytes per seeded or uploaded file')
+    parser.add_argument('--requests', type=int, default=1000, help='Recorded requests per scenario')
+    parser.add_argument('--warmup', type=int, default=50, help='Unrecorded requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--scenarios', help='Comma-separated subset of scenarios to run')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    parser.add_argument('--baseline', help='JSON report of a previous run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.10,
+                        help='Tolerated p95 increase or throughput drop, as a fraction')
+    parser.add_argument('--micro', action='store_true',
+                        help='Only time JSON and error response building in-process')
+    parser.add_argument('--iterations', type=int, default=20000, help='Responses built per micro-benchmark')
+    options = parser.parse_args(argv)
+
+    if options.micro:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = micro_json(workdir, options.iterations)
+        json.dump({"revision": git_revision(), "python": platform.python_version(), "micro": results},
+                  sys.stdout, indent=2)
+        print()
+        return 0
+
+    with tempfile.TemporaryDirectory() as workdir:
+        server = None
+        base_url = options.url
+        if base_url is None:
+            base_url, server = start_server(workdir)
+
+        try:
+            benchmark = Benchmark(base_url.rstrip('/'), options)
+            benchmark.seed()
+            scenarios = benchmark.scenarios()
+            selected = options.scenarios.split(',') if options.scenarios else list(scenarios)
+            unknown = set(selected) - set(scenarios)
+            if unknown:
+                parser.error('unknown scenarios: %s' % ', '.join(sorted(unknown)))
+
+            results = {}
+            for name in selected:
+                results[name] = benchmark.run(name, scenarios[name])
+                print('%-14s %8.1f req/s  p50 %7.2fms  p95 %7.2fms  p99 %7.2fms  errors %d' % (
+                    name, results[name]['throughput_rps'], results[name]['latency_ms']['p50'],
+                    results[name]['latency_ms']['p95'], results[name]['latency_ms']['p99'],
+                    results[name]['errors']), file=sys.stderr)
+        finally:
+            if server is not None:
+                server.shutdown()
+
+    report = {
+        "created_at": datetime.datetime.utcnow().isoformat() + 'Z',
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "target": options.url or 'in-process',
+        "settings": {
+            "users": options.users,
+            "files": options.files,
+            "file_size": options.file_size,
+            "requests": options.requests,
+            "warmup": options.warmup,
+            "concurrency": options.concurrency
+        },
+        "scenarios": results
+    }
+
+    regressed = False
+    if options.baseline:
+        with open(options.baseline) as f:
+            report['comparison'] = compare(results, json.load(f), options.max_regression)
+        regressed = any(changes['regressed'] for changes in report['comparison'].values())
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,476 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# =============================================
+# IN-PROCESS CACHES
+# =============================================
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a deadline
+    Args:
+        maxsize (int): Maximum number of entries kept before the least
+            recently used one is evicted
+        ttl (float): Default time to live of an entry in seconds
+    """
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Looks up a key and marks it as recently used
+        Args:
+            key: Cache key
+            default: Value returned on a miss
+        Returns:
+            The cached value, or default when missing or expired
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, deadline = entry
+                if deadline > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores a value, evicting the least recently used entry when full
+        Args:
+            key: Cache key
+            value: Value to store
+            ttl (float): Time to live in seconds, defaults to the cache ttl
+        """
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def pop(self, key):
+        """
+        Removes a key if present
+        Args:
+            key: Cache key
+        """
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        """
+        Drops every entry, keeping the counters
+        """
+        with self._lock:
+            for key in list(self._data):
+                self._remove(key)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Size, capacity and hit/miss/eviction counters
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def _store(self, key, value, ttl):
+        # Called with the lock held
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._added(key, value)
+        while len(self._data) > self.maxsize:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    # Hooks for subclasses keeping secondary indexes, called with the lock held
+    def _added(self, key, value):
+        pass
+
+    def _remove(self, key):
+        del self._data[key]
+
+
+class TokenCache(TTLCache):
+    """
+    Caches verified JWTs to the user row they resolved to, so that
+    token_required skips both the signature check and the user lookup.
+    Entries never outlive the token's own expiry and can be dropped per
+    user when the user is updated or deleted.
+    Args:
+        maxsize (int): Maximum number of cached tokens
+        ttl (float): Upper bound on how long a token stays cached in seconds
+    """
+    def __init__(self, maxsize=10000, ttl=300.0):
+        super().__init__(maxsize, ttl)
+        self._by_user = {}
+
+    def put(self, token, user, exp):
+        """
+        Caches a verified token
+        Args:
+            token (str): Encoded JWT
+            user (tuple): User row the token resolved to, id first
+            exp (int): Token expiry as a UNIX timestamp
+        """
+        self.set(token, user, ttl=min(self.ttl, exp - time.time()))
+
+    def invalidate_user(self, user_id):
+        """
+        Drops every cached token that resolved to the given user
+        Args:
+            user_id (int): ID of the changed or deleted user
+        """
+        with self._lock:
+            for token in list(self._by_user.get(user_id, ())):
+                self._remove(token)
+
+    def _added(self, key, value):
+        self._by_user.setdefault(value[0], set()).add(key)
+
+    def _remove(self, key):
+        user, _ = self._data.pop(key)
+        tokens = self._by_user.get(user[0])
+        if tokens is not None:
+            tokens.discard(key)
+            if not tokens:
+                del self._by_user[user[0]]
+
+
+class TagVersions:
+    """
+    Version counters of the cache tags, shared by every worker on the host
+    through a SQLite file in shared memory (/dev/shm) when available. A
+    response cached by one worker is only served while the versions of its
+    tags are those read before it was computed, so a write handled by
+    another worker retires it at once rather than when its ttl runs out.
+    Args:
+        path (str): Database file
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS tag_versions(tag TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def get(self, tags):
+        """
+        Args:
+            tags (tuple): Cache tags
+        Returns:
+            tuple: Current version of each tag, 0 for one never bumped
+        """
+        if not tags:
+            return ()
+        rows = self._connection().execute(
+            "SELECT tag, version FROM tag_versions WHERE tag IN (%s)" % ', '.join('?' * len(tags)),
+            tuple(tags)
+        ).fetchall()
+        versions = dict(rows)
+        return tuple(versions.get(tag, 0) for tag in tags)
+
+    def bump(self, tags):
+        """
+        Retires every response built from the given tags, in every worker
+        Args:
+            tags (tuple): Cache tags touched by a write
+        """
+        if not tags:
+            return
+        self._connection().executemany(
+            "INSERT INTO tag_versions (tag, version) VALUES (?, 1) "
+            "ON CONFLICT(tag) DO UPDATE SET version = version + 1",
+            [(tag,) for tag in tags]
+        )
+
+    def _connection(self):
+        # One connection per thread; reopened in a forked worker
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=OFF")  # lost on reboot along with the caches
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+def create_tag_versions(config):
+    """
+    Builds the tag versions selected by RESPONSE_CACHE_SHARED
+    Args:
+        config (dict): App configuration
+    Returns:
+        TagVersions, or None to keep invalidations within the worker
+    """
+    if not config.get('RESPONSE_CACHE_SHARED', True):
+        return None
+    folder = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return TagVersions(config.get('RESPONSE_CACHE_SQLITE_PATH')
+                       or os.path.join(folder, 'flask_api_cache_tags.db'))
+
+
+class ResponseCache(TTLCache):
+    """
+    Caches the serialized bytes of read endpoint responses, so hits skip
+    both the database and JSON encoding. Each entry is tagged with the data
+    it was built from, and writes purge exactly the entries of the tags
+    they touch. A generation counter, bumped by every invalidation, keeps a
+    response computed before a concurrent write from being cached after it.
+    With shared tag versions, writes handled by the other workers of the
+    host retire entries too: each hit costs one lookup of those versions.
+    Args:
+        maxsize (int): Maximum number of cached responses
+        ttl (float): Default lifetime of a response in seconds
+        max_body (int): Larger bodies are never cached
+        versions (TagVersions): Tag versions shared by the workers, or None
+    """
+    def __init__(self, maxsize=2048, ttl=30.0, max_body=1024 * 1024, versions=None):
+        super().__init__(maxsize, ttl)
+        self.max_body = max_body
+        self.versions = versions
+        self._by_tag = {}
+        self._generation = 0
+
+    def get(self, key, default=None):
+        """
+        Looks up a response, missing when another worker changed its data
+        Args:
+            key: Cache key
+            default: Value returned on a miss
+        Returns:
+            The (body, status, headers, tags, versions) entry, or default
+        """
+        entry = super().get(key)
+        if entry is None:
+            return default
+        if self.versions is not None and self.versions.get(entry[3]) != entry[4]:
+            with self._lock:
+                if key in self._data and self._data[key][0] is entry:
+                    self._remove(key)
+                self.hits -= 1
+                self.misses += 1
+            return default
+        return entry
+
+    def generation(self, tags=()):
+        """
+        Snapshots the generation before a response is computed
+        Args:
+            tags (list): Data the response is about to be built from
+        Returns:
+            tuple: Value to hand back to put()
+        """
+        tags = tuple(tags)
+        return self._generation, self.versions.get(tags) if self.versions is not None else None
+
+    def put(self, key, body, status, headers, tags, ttl, generation):
+        """
+        Caches a response unless one of its tags was invalidated meanwhile
+        Args:
+            key: Cache key, usually the request path and query
+            body (bytes): Serialized response body
+            status (int): HTTP status code
+            headers (list): (name, value) pairs
+            tags (list): Data the response was built from
+            ttl (float): Lifetime in seconds
+            generation (tuple): Value of generation(tags) taken beforehand
+        """
+        if len(body) > self.max_body:
+            return
+        local, versions = generation
+        with self._lock:
+            if self._generation == local:
+                self._store(key, (body, status, headers, tuple(tags), versions), ttl)
+
+    def invalidate(self, *tags, publish=True):
+        """
+        Drops every response built from any of the given tags
+        Args:
+            tags (str): Tags of the changed data
+            publish (bool): Also retire the responses of the other workers;
+                False when the change was learnt from them
+        """
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._by_tag.get(tag, ())):
+                    self._remove(key)
+        if publish and self.versions is not None:
+            self.versions.bump(tags)
+
+    def _added(self, key, value):
+        for tag in value[3]:
+            self._by_tag.setdefault(tag, set()).add(key)
+
+    def _remove(self, key):
+        value, _ = self._data.pop(key)
+        for tag in value[3]:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+
+class RevocationList:
+    """
+    Compact in-memory view of the shared token revocation log, so stateless
+    tokens are checked without a database round trip, and every worker
+    learns which users changed to drop their cached tokens (on_revoke).
+    Each worker pulls only the entries logged since its last refresh, at
+    most once per interval. Concurrent transactions can commit their entries
+    out of id order, so the entries of the last overlap seconds are read
+    again whatever their id, and those already applied are skipped.
+    Args:
+        fetch (callable): Returns (id, user_id, min_version, created_at) rows
+            logged after the given id or since the given time
+        prune (callable): Deletes log entries created before the given time
+        lifetime (float): Seconds a token stays valid; older entries are dropped
+        refresh_interval (float): Seconds between two pulls of the log
+        on_revoke (callable): Called with each revoked user id
+        overlap (float): Seconds an entry may take to commit, clock skew
+            between hosts included
+    """
+    def __init__(self, fetch, prune, lifetime, refresh_interval=5.0, on_revoke=None, overlap=60.0):
+        self._fetch = fetch
+        self._prune = prune
+        self.lifetime = lifetime
+        self.refresh_interval = refresh_interval
+        self.overlap = overlap
+        self._on_revoke = on_revoke
+        self._revoked = {}  # user_id -> (min_version or None, logged_at)
+        self._last_id = 0
+        self._recent = {}  # id -> logged_at of the entries within the overlap
+        self._next_refresh = 0.0
+        self._next_prune = 0.0
+        self._lock = threading.Lock()
+        self._async_lock = None  # created inside the serving loop
+
+    def is_revoked(self, user_id, version):
+        """
+        Args:
+            user_id (int): User the token was issued to
+            version (int): Row version of the user when the token was issued
+        Returns:
+            bool: True if the user was deleted or changed since
+        """
+        entry = self._revoked.get(user_id)
+        if entry is None:
+            return False
+        min_version = entry[0]
+        return min_version is None or version < min_version
+
+    def refresh(self, force=False):
+        """
+        Pulls new log entries if the refresh interval elapsed; concurrent
+        callers keep using the current state instead of waiting
+        Args:
+            force (bool): Refresh now, e.g. right after this worker wrote
+        """
+        now = time.time()
+        if not force and now < self._next_refresh:
+            return
+        if not self._lock.acquire(blocking=force):
+            return
+        try:
+            try:
+                entries = self._fetch(self._last_id, now - self.overlap)
+            except Exception:
+                # Keep serving from the current state and retry next interval
+                # rather than failing the request that triggered the refresh
+                self._next_refresh = now + self.refresh_interval
+                return
+            cutoff = self._apply(entries, now)
+            if cutoff is not None:
+                try:
+                    self._prune(cutoff)
+                except Exception:
+                    pass  # the log is pruned again by the next refresh due
+        finally:
+            self._lock.release()
+
+    async def refresh_async(self, force=False):
+        """
+        Same as refresh(), for an event loop where fetch and prune are
+        coroutine functions
+        """
+        now = time.time()
+        if not force and now < self._next_refresh:
+            return
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        if not force and self._async_lock.locked():
+            return
+        async with self._async_lock:
+            try:
+                entries = await self._fetch(self._last_id, now - self.overlap)
+            except Exception:
+                self._next_refresh = now + self.refresh_interval
+                return
+            cutoff = self._apply(entries, now)
+            if cutoff is not None:
+                try:
+                    await self._prune(cutoff)
+                except Exception:
+                    pass
+
+    def _apply(self, entries, now):
+        # Merges fetched entries; returns the cutoff to prune the shared
+        # log at when the hourly prune is due, else None
+        for entry_id, user_id, min_version, logged_at in entries:
+            if entry_id in self._recent:
+                continue  # read again within the overlap, already applied
+            self._last_id = max(self._last_id, entry_id)
+            self._recent[entry_id] = logged_at
+            current = self._revoked.get(user_id)
+            if current is None or current[0] is not None and (
+                    min_version is None or min_version > current[0]):
+                self._revoked[user_id] = (min_version, logged_at)
+            if self._on_revoke is not None:
+                self._on_revoke(user_id)
+        self._next_refresh = now + self.refresh_interval
+        # Entries logged before the window are not fetched again
+        self._recent = {
+            entry_id: logged_at for entry_id, logged_at in self._recent.items()
+            if logged_at >= now - self.overlap
+        }
+
+        if now < self._next_prune:
+            return None
+        cutoff = now - self.lifetime
+        self._revoked = {
+            user_id: entry for user_id, entry in self._revoked.items()
+            if entry[1] >= cutoff
+        }
+        self._next_prune = now + 3600
+        return cutoff
+
+    def __len__(self):
+        return len(self._revoked)
@@ -0,0 +1,239 @@
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # optional, br is not offered without it
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional, zstd is not offered without it
+    zstandard = None
+
+# =============================================
+# RESPONSE COMPRESSION
+# =============================================
+CHUNK_SIZE = 64 * 1024
+FLUSH_SIZE = 64 * 1024  # streamed bytes between two flushes to the client
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml'
+}
+VARIANT_NAMES = {
+    'br': 'content.br',
+    'zstd': 'content.zst',
+    'gzip': 'content.gz'
+}
+
+
+def available_encodings():
+    """
+    Returns:
+        tuple: Encodings this process can produce, in order of preference
+    """
+    encodings = []
+    if brotli is not None:
+        encodings.append('br')
+    if zstandard is not None:
+        encodings.append('zstd')
+    encodings.append('gzip')
+    return tuple(encodings)
+
+
+def is_compressible(mimetype):
+    """
+    Returns:
+        bool: True for text-like content worth compressing
+    """
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+
+
+def negotiate(accept_encodings, encodings):
+    """
+    Picks the encoding the client rates highest among the ones offered,
+    the order of encodings breaking ties
+    Args:
+        accept_encodings: request.accept_encodings
+        encodings (iterable): Encodings the server can send
+    Returns:
+        str: The chosen encoding, or None to send the content as it is
+    """
+    best, best_quality = None, 0
+    for encoding in encodings:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class Compressor:
+    """
+    Incremental compressor with one interface for gzip, br and zstd
+    Args:
+        encoding (str): 'gzip', 'br' or 'zstd'
+        level (int): Compression level of the encoding
+    """
+    def __init__(self, encoding, level):
+        if encoding == 'gzip':
+            stream = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+            self._compress, self._flush = stream.compress, stream.flush
+            self._sync = lambda: stream.flush(zlib.Z_SYNC_FLUSH)
+        elif encoding == 'br':
+            stream = brotli.Compressor(quality=level)
+            self._compress, self._flush = stream.process, stream.finish
+            self._sync = stream.flush
+        else:
+            stream = zstandard.ZstdCompressor(level=level).compressobj()
+            self._compress, self._flush = stream.compress, stream.flush
+            self._sync = lambda: stream.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def compress(self, data):
+        return self._compress(data)
+
+    def sync(self):
+        """
+        Returns:
+            bytes: Output letting the client decode everything compressed
+                so far, the stream staying open
+        """
+        return self._sync()
+
+    def flush(self):
+        return self._flush()
+
+
+def compress(data, encoding, level):
+    """
+    Returns:
+        bytes: data compressed with the encoding
+    """
+    compressor = Compressor(encoding, level)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_file(source, target, encoding, level):
+    """
+    Writes a compressed copy of a file, reading it in chunks
+    Returns:
+        int: Size of the compressed copy
+    """
+    compressor = Compressor(encoding, level)
+    with open(source, 'rb') as f, open(target, 'wb') as out:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            out.write(compressor.compress(chunk))
+        out.write(compressor.flush())
+        return out.tell()
+
+
+class StreamCompressor:
+    """
+    Compressor of a streamed body, flushed after the first chunk, for the
+    client to see the stream start, and then every flush_size bytes;
+    without flushes the compressor holds its output until its buffer fills
+    """
+    def __init__(self, encoding, level, flush_size=FLUSH_SIZE):
+        self._compressor = Compressor(encoding, level)
+        self._flush_size = flush_size
+        self._unflushed = flush_size
+
+    def compress(self, chunk):
+        """
+        Returns:
+            bytes: Output to send for a chunk of the body, possibly empty
+        """
+        if not chunk:
+            return b''
+        chunk = chunk.encode() if isinstance(chunk, str) else chunk
+        data = self._compressor.compress(chunk)
+        self._unflushed += len(chunk)
+        if self._unflushed >= self._flush_size:
+            data += self._compressor.sync()
+            self._unflushed = 0
+        return data
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+def _compress_stream(iterable, encoding, level, flush_size=FLUSH_SIZE):
+    compressor = StreamCompressor(encoding, level, flush_size)
+    try:
+        for chunk in iterable:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+
+class Compression:
+    """
+    Flask extension compressing text-like responses (JSON listings, CSV and
+    NDJSON exports) with the best encoding the client accepts. Streamed
+    responses are compressed as they are generated. File downloads are left
+    alone: they are served from the variants precompressed after upload.
+    Strong ETags become weak, since the bytes differ per encoding.
+    Configuration:
+        COMPRESSION_ENABLED: Compress responses on the fly
+        COMPRESSION_MIN_SIZE: Bodies below this many bytes are sent as they are
+        COMPRESSION_LEVELS: Level per encoding, favouring speed over ratio
+        COMPRESSION_FLUSH_SIZE: Bytes of a streamed response between two
+            flushes of the compressor to the client
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['compression'] = available_encodings()
+        app.after_request(self._compress)
+
+    def _compress(self, response):
+        config = current_app.config
+        choice = self._choose(current_app, response, response.is_streamed, request.accept_encodings)
+        if choice is None:
+            return response
+        encoding, level = choice
+
+        if response.is_streamed:
+            response.response = _compress_stream(
+                response.response,
+                encoding,
+                level,
+                config.get('COMPRESSION_FLUSH_SIZE', FLUSH_SIZE)
+            )
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(compress(response.get_data(), encoding, level))
+        self._mark(response, encoding)
+        return response
+
+    def _choose(self, app, response, streamed, accept_encodings):
+        # Returns (encoding, level), or None to send the response as it is
+        config = app.config
+        if not config.get('COMPRESSION_ENABLED', True) or not is_compressible(response.mimetype):
+            return None
+        response.vary.add('Accept-Encoding')
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or getattr(response, 'direct_passthrough', False) or 'Content-Encoding' in response.headers):
+            return None
+        if not streamed and (response.content_length or 0) < config.get('COMPRESSION_MIN_SIZE', 1024):
+            return None
+
+        encoding = negotiate(accept_encodings, app.extensions['compression'])
+        if encoding is None:
+            return None
+        return encoding, config.get('COMPRESSION_LEVELS', {}).get(encoding, 5)
+
+    def _mark(self, response, encoding):
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
@@ -0,0 +1,127 @@
+import os
+
+# =============================================
+# CONFIGURATION
+# =============================================
+# Shared by the WSGI app (main.py) and the ASGI app (asgi.py), which load
+# every uppercase name below with app.config.from_object('config')
+
+# Database Configuration
+DB_BACKEND = os.environ.get('DB_BACKEND', 'mysql')  # 'sqlite' for local load tests
+SQLITE_PATH = 'flask_api.db'
+MYSQL_USER = 'flaskuser'
+MYSQL_PASSWORD = 'flaskpassword'
+MYSQL_HOST = 'localhost'
+MYSQL_DB = 'flask_api_db'
+
+# Connection Pool Configuration
+DB_POOL_MIN_SIZE = 2
+DB_POOL_MAX_SIZE = 10
+DB_POOL_TIMEOUT = 5  # seconds to wait for a free connection
+DB_POOL_MAX_IDLE = 300  # seconds before surplus idle connections close
+DB_POOL_PING_INTERVAL = 30  # idle seconds before a connection is re-checked
+DB_REPLICAS = []  # read replicas, settings overriding the primary's, e.g. [{"MYSQL_HOST": "replica1"}]
+DB_REPLICA_MAX_LAG = 5  # seconds of replication lag before a replica leaves the rotation
+DB_REPLICA_CHECK_INTERVAL = 5  # seconds between replica health checks
+DB_REPLICA_CONNECT_TIMEOUT = 2  # seconds before giving up on a replica
+DB_READ_YOUR_WRITES = 5  # seconds a client reads from the primary after writing
+
+# JWT Configuration
+SECRET_KEY = 'secret'
+TOKEN_CACHE_SIZE = 10000  # verified tokens kept in memory
+TOKEN_CACHE_TTL = 300  # seconds, never beyond the token's exp
+JWT_EXPIRATION = 24 * 3600  # seconds a token is valid
+# Stateless tokens carry the user id and row version and are validated
+# without a database lookup. In both modes, changes and deletions are
+# logged to a shared table each worker pulls every JWT_REVOCATION_REFRESH
+# seconds, revoking stateless tokens and dropping cached ones
+JWT_STATELESS = os.environ.get('JWT_STATELESS', '').lower() in ('1', 'true', 'yes')
+JWT_REVOCATION_REFRESH = 5
+JWT_REVOCATION_OVERLAP = 60  # seconds of log re-read, for entries committed out of id order
+
+# File Upload Configuration
+UPLOAD_FOLDER = 'uploads'
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+UPLOAD_MAX_SIZE = 10 * 1024 * 1024 * 1024  # 10GB max for chunked uploads
+UPLOAD_SESSION_TTL = 24 * 3600  # seconds an idle chunked upload is kept
+ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif'}
+
+# Post-upload Processing Configuration (flask process-files)
+JOBS_PROCESSES = None  # processing pool size; None for one per CPU
+JOBS_MAX_PENDING = 1000  # queued jobs from which uploads get 503, while a worker runs
+JOBS_MAX_ATTEMPTS = 3  # runs of a job before it is marked failed
+JOBS_RETRY_DELAY = 30  # seconds before the first retry, doubled after each
+JOBS_LEASE = 300  # seconds a job may run before another worker takes it over
+JOBS_HEARTBEAT_TIMEOUT = 30  # seconds of silence before a worker counts as gone
+JOBS_WORKER = True  # gunicorn and python main.py start a process-files worker
+
+# Archive Configuration
+ARCHIVE_MAX_FILES = 1000  # files per GET/POST /files/archive
+
+# Compression Configuration
+# JSON and CSV responses are compressed per request at fast levels; text
+# uploads get variants compressed once by process-files at high levels.
+# br and zstd are offered when the brotli and zstandard packages are installed
+COMPRESSION_ENABLED = True
+COMPRESSION_MIN_SIZE = 1024  # bytes below which responses go out as they are
+COMPRESSION_LEVELS = {'br': 4, 'zstd': 3, 'gzip': 6}
+COMPRESSION_FLUSH_SIZE = 64 * 1024  # streamed bytes (CSV/NDJSON exports) between two flushes
+PRECOMPRESS_LEVELS = {'br': 11, 'zstd': 19, 'gzip': 9}
+PRECOMPRESS_MIN_SIZE = 1024
+PRECOMPRESS_MAX_SIZE = 256 * 1024 * 1024  # larger files are not given variants
+
+# Download Configuration
+# None streams files from the worker (kernel sendfile when the WSGI server
+# offers wsgi.file_wrapper); 'x-sendfile' (Apache, lighttpd) or
+# 'x-accel-redirect' (nginx) hand the transfer to the fronting proxy
+FILE_OFFLOAD = os.environ.get('FILE_OFFLOAD') or None
+FILE_ACCEL_PREFIX = '/protected-uploads/'  # nginx internal location aliasing UPLOAD_FOLDER
+USE_X_SENDFILE = FILE_OFFLOAD == 'x-sendfile'
+
+# Rate Limit Configuration (requests per period)
+RATELIMIT_ENABLED = True
+RATELIMIT_STORAGE = 'sqlite'  # shared by all workers on the host; 'memory' per process
+RATELIMIT_LOGIN = '10/minute'  # per IP
+RATELIMIT_UPLOAD = '30/minute'  # per token
+RATELIMIT_USERS = '300/minute'  # per token
+RATELIMIT_IP = '600/minute'  # per IP on every token-limited route, capping invalid tokens
+
+# Batch Configuration
+BATCH_MAX_USERS = 10000  # users accepted by one POST /users/batch
+BATCH_CHUNK_SIZE = 500  # rows per executemany call
+
+# Response Cache Configuration
+RESPONSE_CACHE_SIZE = 2048  # cached responses per worker
+RESPONSE_CACHE_SHARED = True  # writes retire the responses of every worker on the host
+RESPONSE_CACHE_SQLITE_PATH = None  # tag versions file, /dev/shm/flask_api_cache_tags.db by default
+RESPONSE_CACHE_TTLS = {  # seconds, per cached route
+    'users': 5,
+    'user': 30,
+    'files': 5,
+    'public_items': 300
+}
+
+# Metrics Configuration
+# Each worker publishes its metrics to a file in METRICS_DIR (default
+# /dev/shm/flask_api_metrics) so /metrics can report the whole host
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = 1.0  # seconds between two snapshots of a worker
+# Clients /metrics answers, others get 403; None opens it to everyone. Behind
+# a reverse proxy every client has the proxy's address, so do not route
+# /metrics through it
+METRICS_ALLOWED_NETWORKS = ('127.0.0.0/8', '::1/128')
+
+# Query Profiler Configuration
+SLOW_QUERY_THRESHOLD = 0.2  # seconds above which a statement is logged
+N_PLUS_ONE_THRESHOLD = 10  # runs of one statement in a request flagged as N+1
+QUERY_STATS_SIZE = 500  # distinct statements tracked per worker
+
+# Pagination Configuration
+PAGE_SIZE_DEFAULT = 100
+PAGE_SIZE_MAX = 1000  # hard cap whatever the client asks for
+
+# Username Search Configuration
+SEARCH_LIMIT_DEFAULT = 10  # users returned by GET /users?q=
+SEARCH_LIMIT_MAX = 100
+SEARCH_MODES_ENABLED = ('prefix', 'substring', 'fuzzy')  # drop the last two on large tables: they scan
+SEARCH_SCAN_MIN_LENGTH = 3  # characters a substring or fuzzy search needs
@@ -0,0 +1,62 @@
+import base64
+import binascii
+import json
+
+# =============================================
+# PAGINATION CURSORS
+# =============================================
+def encode_cursor(last_id):
+    """
+    Builds the opaque cursor pointing after the given row
+    Args:
+        last_id (int): ID of the last row of the current page
+    Returns:
+        str: URL-safe cursor for the ?after= parameter
+    """
+    return base64.urlsafe_b64encode(('id:%d' % last_id).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Reads a cursor made by encode_cursor
+    Returns:
+        int: ID of the row to continue after
+    Raises:
+        ValueError: Malformed cursor
+    """
+    try:
+        kind, last_id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split(':')
+        if kind != 'id':
+            raise ValueError
+        return int(last_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+def encode_file_cursor(sort, descending, key):
+    """
+    Builds the opaque cursor pointing after a file of a /files listing
+    Args:
+        sort (str): Sort field of the listing
+        descending (bool): Sort direction of the listing
+        key (tuple): (sort value, name) of the last file of the page
+    Returns:
+        str: URL-safe cursor for the ?after= parameter
+    """
+    payload = json.dumps([sort, descending, key[0], key[1]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_file_cursor(cursor, sort, descending):
+    """
+    Reads a cursor made by encode_file_cursor for the same sort
+    Returns:
+        tuple: (sort value, name) to continue after
+    Raises:
+        ValueError: Malformed cursor, or one from a differently sorted listing
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        cursor_sort, cursor_descending, value, name = payload
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError('Invalid cursor')
+    if cursor_sort != sort or cursor_descending != descending:
+        raise ValueError('Cursor does not match the requested sort')
+    return value, name
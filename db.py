@@ -0,0 +1,1187 @@
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+from itertools import count
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, session
+
+# =============================================
+# EXCEPTIONS
+# =============================================
+class DatabaseError(Exception):
+    """Base class for errors raised by the database layer"""
+
+
+class PoolTimeout(DatabaseError):
+    """Raised when no connection could be checked out in time"""
+
+
+class DuplicateError(DatabaseError):
+    """Raised when a write violates a unique key"""
+
+
+class VersionMismatch(DatabaseError):
+    """Raised when a conditional write targets a row whose version moved on"""
+
+
+# =============================================
+# BACKENDS
+# =============================================
+class MySQLBackend:
+    """
+    Opens connections to the configured MySQL server through mysqlclient
+    Args:
+        config (dict): Flask config holding the MYSQL_* settings
+    """
+    name = 'mysql'
+
+    users_table_sql = """
+        CREATE TABLE IF NOT EXISTS midterm_database(
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(20) UNIQUE,
+            password VARCHAR(255),
+            version INT NOT NULL DEFAULT 1
+        )
+    """
+
+    # The unique index on username already compares without case under
+    # the table's default _ci collation
+    search_index_sql = None
+    username_order = 'username'
+
+    revocations_table_sql = """
+        CREATE TABLE IF NOT EXISTS token_revocations(
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            min_version INT NULL,
+            created_at DOUBLE NOT NULL,
+            INDEX (created_at)
+        )
+    """
+
+    def __init__(self, config):
+        import MySQLdb
+        self._driver = MySQLdb
+        self.integrity_error = MySQLdb.IntegrityError
+        self._params = {
+            'host': config['MYSQL_HOST'],
+            'port': config.get('MYSQL_PORT', 3306),
+            'user': config['MYSQL_USER'],
+            'passwd': config['MYSQL_PASSWORD'],
+            'db': config['MYSQL_DB'],
+            'charset': 'utf8mb4',
+            'connect_timeout': config.get('MYSQL_CONNECT_TIMEOUT', 10)
+        }
+
+    def connect(self):
+        conn = self._driver.connect(**self._params)
+        conn.autocommit(False)
+        return conn
+
+    def ping(self, conn):
+        conn.ping()
+
+    def begin(self, conn):
+        pass  # autocommit is off: the first statement opens the transaction
+
+    def replication_lag(self, conn):
+        """
+        Returns:
+            float: Seconds the server is behind its source, 0 if it is not a
+                replica, or None if replication is stopped
+        """
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+            if row is None:
+                return 0.0
+            lag = row[[column[0] for column in cursor.description].index('Seconds_Behind_Master')]
+            return None if lag is None else float(lag)
+        finally:
+            cursor.close()
+
+    def prefix_condition(self, prefix):
+        # LIKE 'abc%' is a range scan of the unique index on username
+        return "username LIKE %s ESCAPE '!'", (like_escape(prefix) + '%',)
+
+    def streaming_cursor(self, conn):
+        import MySQLdb.cursors
+        return conn.cursor(MySQLdb.cursors.SSCursor)
+
+
+class _SQLiteCursor:
+    """
+    Cursor wrapper that accepts the %s placeholders used throughout the API
+    """
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        self._cursor.execute(query.replace('%s', '?'), params)
+        return self
+
+    def executemany(self, query, seq_of_params):
+        self._cursor.executemany(query.replace('%s', '?'), seq_of_params)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedCursor:
+    """
+    Cursor wrapper timing every statement and reporting it to observers,
+    callables taking the query and its duration in seconds
+    """
+    def __init__(self, cursor, observers):
+        self._cursor = cursor
+        self._observers = observers
+
+    def execute(self, query, *args):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(query, *args)
+        finally:
+            self._report(query, time.perf_counter() - start)
+
+    def executemany(self, query, seq_of_params):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(query, seq_of_params)
+        finally:
+            self._report(query, time.perf_counter() - start)
+
+    def _report(self, query, seconds):
+        for observe in self._observers:
+            observe(query, seconds)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _SQLiteConnection:
+    """
+    Connection wrapper handing out placeholder-translating cursors
+    """
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return _SQLiteCursor(self._conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class SQLiteBackend:
+    """
+    File-backed stand-in for MySQL so the service runs without a server
+    Args:
+        config (dict): Flask config holding SQLITE_PATH
+    """
+    name = 'sqlite'
+
+    users_table_sql = """
+        CREATE TABLE IF NOT EXISTS midterm_database(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username VARCHAR(20) UNIQUE,
+            password VARCHAR(255),
+            version INT NOT NULL DEFAULT 1
+        )
+    """
+
+    # Searches compare usernames without case, as MySQL does; this index
+    # keeps them range scans
+    search_index_sql = (
+        "CREATE INDEX IF NOT EXISTS midterm_database_username_nocase "
+        "ON midterm_database (username COLLATE NOCASE)"
+    )
+    username_order = 'username COLLATE NOCASE'
+
+    revocations_table_sql = """
+        CREATE TABLE IF NOT EXISTS token_revocations(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INT NOT NULL,
+            min_version INT NULL,
+            created_at REAL NOT NULL
+        )
+    """
+
+    integrity_error = sqlite3.IntegrityError
+
+    def __init__(self, config):
+        self.path = config.get('SQLITE_PATH', 'flask_api.db')
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return _SQLiteConnection(conn)
+
+    def ping(self, conn):
+        conn.execute('SELECT 1')
+
+    def begin(self, conn):
+        # sqlite3 only opens a transaction before INSERT/UPDATE/DELETE: a
+        # leading SELECT or SAVEPOINT would run in autocommit mode, and
+        # RELEASE would commit. IMMEDIATE takes the write lock up front so
+        # a transaction that read first cannot fail to upgrade later.
+        conn.execute('BEGIN IMMEDIATE')
+
+    def replication_lag(self, conn):
+        # A stand-in replica is a separate database file, never behind
+        return 0.0
+
+    def prefix_condition(self, prefix):
+        # SQLite only uses an index for case-sensitive LIKE; a range of
+        # the NOCASE index does the job
+        return ("username COLLATE NOCASE >= %s AND username COLLATE NOCASE < %s",
+                (prefix, prefix + '\U0010ffff'))
+
+    def streaming_cursor(self, conn):
+        # sqlite3 cursors already step through results lazily
+        return conn.cursor()
+
+
+BACKENDS = {
+    'mysql': MySQLBackend,
+    'sqlite': SQLiteBackend
+}
+
+
+# =============================================
+# CONNECTION POOL
+# =============================================
+class ConnectionPool:
+    """
+    Thread-safe pool of database connections, opened up to min_size on the
+    first checkout of each process
+    Args:
+        connect (callable): Opens a new connection
+        ping (callable): Raises if the given connection is no longer usable
+        min_size (int): Connections kept open even when idle
+        max_size (int): Upper bound on open connections
+        timeout (float): Seconds to wait for a free connection on checkout
+        max_idle (float): Seconds after which idle connections above
+            min_size are closed
+        ping_interval (float): Idle seconds after which a connection is
+            health checked before being handed out
+    """
+    def __init__(self, connect, ping, min_size=1, max_size=10, timeout=5.0,
+                 max_idle=300.0, ping_interval=30.0):
+        if min_size > max_size:
+            raise ValueError('min_size cannot exceed max_size')
+        self._connect = connect
+        self._ping = ping
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.ping_interval = ping_interval
+        self._idle = deque()  # (connection, released_at), most recent last
+        self._size = 0
+        self._in_use = 0
+        self._last_reap = time.monotonic()
+        self._closed = False
+        self._filled = False
+        self._cond = threading.Condition()
+
+        # A worker forked from a preloaded app starts with an empty pool
+        pool = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: pool() is not None and pool()._after_fork())
+
+    def fill(self):
+        """
+        Opens connections until min_size are available
+        """
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def acquire(self):
+        """
+        Checks out a connection, opening one if below max_size
+        Returns:
+            A healthy database connection
+        Raises:
+            PoolTimeout: No connection became free within timeout
+        """
+        if not self._filled:
+            self._warm_up()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn, released_at = self._checkout(deadline)
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._discard(None)
+                    raise
+                return conn
+
+            if time.monotonic() - released_at < self.ping_interval:
+                return conn
+            try:
+                self._ping(conn)
+                return conn
+            except Exception:
+                self._discard(conn)
+
+    def release(self, conn, broken=False):
+        """
+        Returns a connection to the pool
+        Args:
+            conn: Connection obtained from acquire()
+            broken (bool): Close the connection instead of reusing it
+        """
+        if broken or self._closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        self._maybe_reap()
+
+    @contextmanager
+    def connection(self, conn=None):
+        """
+        Context manager that checks a connection out and always returns it
+        Args:
+            conn: Connection already obtained from acquire(), if any
+        """
+        if conn is None:
+            conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        except BaseException:
+            # Interrupted mid-use (e.g. a client dropping a streamed
+            # response), so the connection state is unknown
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def reap(self):
+        """
+        Closes connections idle for longer than max_idle, keeping min_size open
+        """
+        now = time.monotonic()
+        stale = []
+        with self._cond:
+            self._last_reap = now
+            while (self._idle and self._size > self.min_size
+                   and now - self._idle[0][1] > self.max_idle):
+                stale.append(self._idle.popleft()[0])
+                self._size -= 1
+            if stale:
+                self._cond.notify(len(stale))
+        for conn in stale:
+            _close_quietly(conn)
+
+    def close(self):
+        """
+        Closes every idle connection; checked out ones close on release
+        """
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn in idle:
+            _close_quietly(conn)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Open, idle and checked out connection counts
+        """
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "min_size": self.min_size,
+                "max_size": self.max_size
+            }
+
+    def _checkout(self, deadline):
+        # Returns an idle (connection, released_at) pair, or (None, None)
+        # once a slot for a new connection has been reserved
+        with self._cond:
+            while True:
+                if self._idle:
+                    self._in_use += 1
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    self._in_use += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        'No database connection available after %.1fs' % self.timeout
+                    )
+                self._cond.wait(remaining)
+
+    def _discard(self, conn):
+        with self._cond:
+            self._size -= 1
+            self._in_use -= 1
+            self._cond.notify()
+        if conn is not None:
+            _close_quietly(conn)
+
+    def _after_fork(self):
+        # The inherited sockets belong to the parent: they are forgotten, not
+        # closed, since closing would end the parent's sessions. The lock may
+        # have been held by a thread that does not exist in the child.
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._filled = False
+        self._cond = threading.Condition()
+
+    def _warm_up(self):
+        # Fills the pool once per process, on first use rather than when
+        # the app is built: a preloaded master forks its workers with empty
+        # pools. Once only, so a database that is down costs one connect
+        # attempt per checkout; the checkout reports the failure itself
+        self._filled = True
+        try:
+            self.fill()
+        except Exception:
+            pass
+
+    def _maybe_reap(self):
+        if time.monotonic() - self._last_reap > min(self.max_idle, 60):
+            self.reap()
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+# =============================================
+# REPOSITORIES
+# =============================================
+# Statements shared with the asyncio repositories in aiodb.py
+INSERT_USER_SQL = "INSERT INTO midterm_database (username, password) VALUES (%s, %s)"
+
+REVOKE_VERSION_SQL = (
+    "INSERT INTO token_revocations (user_id, min_version, created_at) "
+    "SELECT id, version, %s FROM midterm_database WHERE id = %s"
+)
+
+REVOKE_ALL_SQL = (
+    "INSERT INTO token_revocations (user_id, min_version, created_at) "
+    "VALUES (%s, NULL, %s)"
+)
+
+
+# Queries name their columns instead of SELECT *, so rows only carry what
+# the caller uses, however many columns the table gains; password and
+# version never leave the server
+USER_FIELDS = ('id', 'username')  # what clients can pick with ?fields=
+
+SEARCH_MODES = ('prefix', 'substring', 'fuzzy')
+
+
+def user_columns(fields):
+    """
+    Columns to select for a sparse fieldset
+    Args:
+        fields (iterable): Subset of USER_FIELDS; other names are ignored
+    Returns:
+        tuple: id, which cursors and ETags are built from, then the fields
+    """
+    return ('id',) + tuple(name for name in fields if name != 'id' and name in USER_FIELDS)
+
+
+def like_escape(text):
+    """
+    Returns:
+        str: text with the LIKE wildcards escaped for ESCAPE '!'
+    """
+    return text.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+
+
+def search_statement(backend, text, mode='prefix', limit=10, columns=USER_FIELDS):
+    """
+    Builds the SELECT of the first usernames, in order, matching a search
+    without regard to case
+    Prefix searches are a range scan of the username index and stay fast
+    however large the table is. Substring and fuzzy searches walk the same
+    index in order and stop at the limit-th match, so rare text scans the
+    whole index; SEARCH_MODES_ENABLED and SEARCH_SCAN_MIN_LENGTH bound them.
+    Args:
+        backend: Backend the query runs on
+        text (str): What the user typed
+        mode (str): 'prefix', 'substring', or 'fuzzy' for the characters
+            in that order with anything in between
+        limit (int): Maximum number of users
+        columns (tuple): Columns to select, from user_columns
+    Returns:
+        tuple: (query, params)
+    """
+    if mode == 'prefix':
+        condition, params = backend.prefix_condition(text)
+    elif mode == 'substring':
+        condition, params = "username LIKE %s ESCAPE '!'", ('%' + like_escape(text) + '%',)
+    else:
+        pattern = '%'.join(like_escape(char) for char in text)
+        condition, params = "username LIKE %s ESCAPE '!'", ('%' + pattern + '%',)
+
+    query = "SELECT %s FROM midterm_database WHERE %s ORDER BY %s LIMIT %%s" % (
+        ', '.join(columns), condition, backend.username_order)
+    return query, params + (limit,)
+
+
+def update_statement(user_id, fields, versions=None):
+    """
+    Builds the single UPDATE setting the given columns of a user and
+    bumping its row version
+    Args:
+        user_id (int): ID of the user to update
+        fields (dict): Subset of username/password to set
+        versions (list): Only match the row at one of these versions
+    Returns:
+        tuple: (query, params)
+    """
+    assignments = []
+    update_params = []
+
+    if 'username' in fields:
+        assignments.append("username = %s")
+        update_params.append(fields['username'])
+
+    if 'password' in fields:
+        assignments.append("password = %s")
+        update_params.append(fields['password'])
+
+    assignments.append("version = version + 1")
+    update_params.append(user_id)
+
+    update_query = "UPDATE midterm_database SET %s WHERE id = %%s" % ', '.join(assignments)
+    if versions:
+        update_query += " AND version IN (%s)" % ', '.join(['%s'] * len(versions))
+        update_params.extend(versions)
+    return update_query, tuple(update_params)
+
+
+def delete_statement(user_id, versions=None):
+    """
+    Builds the single DELETE removing a user
+    Args:
+        user_id (int): ID of the user to delete
+        versions (list): Only match the row at one of these versions
+    Returns:
+        tuple: (query, params)
+    """
+    delete_query = "DELETE FROM midterm_database WHERE id = %s"
+    delete_params = [user_id]
+    if versions:
+        delete_query += " AND version IN (%s)" % ', '.join(['%s'] * len(versions))
+        delete_params.extend(versions)
+    return delete_query, tuple(delete_params)
+
+
+class UserRepository:
+    """
+    All SQL touching the midterm_database users table
+    Args:
+        database (Database): Database the queries run against
+    """
+    def __init__(self, database):
+        self.db = database
+
+    def create_table(self, sample_users):
+        """
+        Creates the users table and seeds it when empty
+        Args:
+            sample_users (list): (username, password) pairs to insert
+        """
+        with self.db.transaction(pin=True) as cursor:
+            cursor.execute(self.db.backend.users_table_sql)
+
+            # Tables created before row versions existed get the column added
+            cursor.execute("SELECT * FROM midterm_database LIMIT 0")
+            if 'version' not in [x[0] for x in cursor.description]:
+                cursor.execute("ALTER TABLE midterm_database ADD COLUMN version INT NOT NULL DEFAULT 1")
+
+            if self.db.backend.search_index_sql:
+                cursor.execute(self.db.backend.search_index_sql)
+            cursor.execute(self.db.backend.revocations_table_sql)
+
+            cursor.execute("SELECT COUNT(*) FROM midterm_database")
+            count = cursor.fetchone()[0]
+
+            if count == 0:
+                cursor.executemany(INSERT_USER_SQL, sample_users)
+
+    def dump(self, after_id=0, limit=100, columns=USER_FIELDS):
+        """
+        Returns one keyset page of rows ordered by id
+        Args:
+            after_id (int): Only rows with a greater id are returned
+            limit (int): Maximum number of rows
+            columns (tuple): Columns to select, id first; never the password
+        Returns:
+            tuple: Column names and the rows of the page
+        """
+        with self.db.cursor(replica=True) as cursor:
+            cursor.execute("SELECT %s FROM midterm_database WHERE id > %%s ORDER BY id LIMIT %%s"
+                           % ', '.join(columns), (after_id, limit))
+            row_headers = [x[0] for x in cursor.description]
+            return row_headers, cursor.fetchall()
+
+    def find_by_username(self, username):
+        """
+        Returns:
+            tuple: (id, username, version) of the user, or None
+        """
+        with self.db.cursor(replica=True) as cursor:
+            cursor.execute("SELECT id, username, version FROM midterm_database WHERE username = %s", (username,))
+            return cursor.fetchone()
+
+    def find_by_credentials(self, username, password):
+        """
+        Returns:
+            tuple: (id, version) of the user matching both fields, or None
+        """
+        with self.db.cursor() as cursor:
+            cursor.execute("SELECT id, version FROM midterm_database WHERE username = %s AND password = %s",
+                           (username, password))
+            return cursor.fetchone()
+
+    def exists(self, user_id):
+        """
+        Returns:
+            bool: True if a user with this ID exists
+        """
+        with self.db.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM midterm_database WHERE id = %s", (user_id,))
+            return cursor.fetchone() is not None
+
+    def list(self, after_id=0, limit=100, columns=USER_FIELDS):
+        """
+        Returns one keyset page of users ordered by id
+        Args:
+            after_id (int): Only users with a greater id are returned
+            limit (int): Maximum number of users
+            columns (tuple): Columns to select, from user_columns
+        Returns:
+            list: The columns of the users in the page
+        """
+        with self.db.cursor(replica=True) as cursor:
+            cursor.execute("SELECT %s FROM midterm_database WHERE id > %%s ORDER BY id LIMIT %%s"
+                           % ', '.join(columns), (after_id, limit))
+            return cursor.fetchall()
+
+    def search(self, text, mode='prefix', limit=10, columns=USER_FIELDS):
+        """
+        Returns the first users, by username, matching a search
+        Args:
+            text (str): What the user typed
+            mode (str): One of SEARCH_MODES
+            limit (int): Maximum number of users
+            columns (tuple): Columns to select, from user_columns
+        Returns:
+            list: The columns of the matching users
+        """
+        with self.db.cursor(replica=True) as cursor:
+            cursor.execute(*search_statement(self.db.backend, text, mode, limit, columns))
+            return cursor.fetchall()
+
+    def export(self, batch_size=1000):
+        """
+        Streams every user from a server-side cursor, keeping memory
+        constant however large the table is
+        Args:
+            batch_size (int): Rows fetched per round trip
+        Yields:
+            list: Batches of (id, username) ordered by id
+        """
+        with self.db.cursor(streaming=True, replica=True) as cursor:
+            cursor.execute("SELECT id, username FROM midterm_database ORDER BY id")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield rows
+
+    def get(self, user_id, columns=USER_FIELDS):
+        """
+        Args:
+            user_id (int): ID of the user
+            columns (tuple): Columns to select, from user_columns
+        Returns:
+            tuple: The columns then the row version of the user, or None
+        """
+        with self.db.cursor(replica=True) as cursor:
+            cursor.execute("SELECT %s, version FROM midterm_database WHERE id = %%s" % ', '.join(columns),
+                           (user_id,))
+            return cursor.fetchone()
+
+    def create(self, username, password):
+        """
+        Inserts a new user, relying on the unique key to reject taken names
+        Returns:
+            int: ID of the new user
+        Raises:
+            DuplicateError: The username is taken
+        """
+        try:
+            with self.db.transaction(pin=True) as cursor:
+                cursor.execute(INSERT_USER_SQL, (username, password))
+                return cursor.lastrowid
+        except self.db.backend.integrity_error:
+            raise DuplicateError('Username already exists')
+
+    def create_many(self, users, chunk_size=500):
+        """
+        Inserts many users in a single transaction, skipping usernames that
+        are taken instead of failing the whole batch
+        Args:
+            users (list): (username, password) pairs
+            chunk_size (int): Rows per IN lookup and per executemany call
+        Returns:
+            set: Usernames that were inserted
+        """
+        created = set()
+
+        with self.db.transaction(pin=True) as cursor:
+            for i in range(0, len(users), chunk_size):
+                chunk = users[i:i + chunk_size]
+
+                # One lookup per chunk instead of one per user
+                cursor.execute(
+                    "SELECT username FROM midterm_database WHERE username IN (%s)"
+                    % ', '.join(['%s'] * len(chunk)),
+                    [username for username, _ in chunk]
+                )
+                taken = {row[0] for row in cursor.fetchall()} | created
+                rows = []
+                for username, password in chunk:
+                    if username not in taken:
+                        taken.add(username)
+                        rows.append((username, password))
+                if not rows:
+                    continue
+
+                # A concurrent insert can still win the race; redo just this
+                # chunk row by row so only the clashing usernames are skipped
+                cursor.execute("SAVEPOINT batch_chunk")
+                try:
+                    cursor.executemany(INSERT_USER_SQL, rows)
+                    created.update(username for username, _ in rows)
+                except self.db.backend.integrity_error:
+                    cursor.execute("ROLLBACK TO SAVEPOINT batch_chunk")
+                    for row in rows:
+                        try:
+                            cursor.execute(INSERT_USER_SQL, row)
+                            created.add(row[0])
+                        except self.db.backend.integrity_error:
+                            pass
+                cursor.execute("RELEASE SAVEPOINT batch_chunk")
+
+        return created
+
+    def update(self, user_id, fields, versions=None, revoke_tokens=True):
+        """
+        Updates the given columns of a user in a single statement and bumps
+        its row version
+        Args:
+            user_id (int): ID of the user to update
+            fields (dict): Subset of username/password to set
+            versions (list): Only update if the row is at one of these versions
+            revoke_tokens (bool): Log the new version in token_revocations so
+                every worker drops its cached tokens of the user and
+                stateless tokens issued before the update stop validating
+        Returns:
+            bool: False if no such user exists
+        Raises:
+            DuplicateError: The new username is taken
+            VersionMismatch: The user exists but is at another version
+        """
+        update_query, update_params = update_statement(user_id, fields, versions)
+
+        try:
+            with self.db.transaction(pin=True) as cursor:
+                cursor.execute(update_query, update_params)
+                updated = cursor.rowcount > 0
+                if updated and revoke_tokens:
+                    cursor.execute(REVOKE_VERSION_SQL, (time.time(), user_id))
+        except self.db.backend.integrity_error:
+            raise DuplicateError('Username already exists')
+        return self._check_write(updated, user_id, versions)
+
+    def delete(self, user_id, versions=None, revoke_tokens=True):
+        """
+        Deletes a user in a single statement
+        Args:
+            user_id (int): ID of the user to delete
+            versions (list): Only delete if the row is at one of these versions
+            revoke_tokens (bool): Log the deletion in token_revocations so
+                every worker drops its cached tokens of the user and the
+                user's stateless tokens stop validating
+        Returns:
+            bool: False if no such user exists
+        Raises:
+            VersionMismatch: The user exists but is at another version
+        """
+        delete_query, delete_params = delete_statement(user_id, versions)
+
+        with self.db.transaction(pin=True) as cursor:
+            cursor.execute(delete_query, delete_params)
+            deleted = cursor.rowcount > 0
+            if deleted and revoke_tokens:
+                cursor.execute(REVOKE_ALL_SQL, (user_id, time.time()))
+        return self._check_write(deleted, user_id, versions)
+
+    def _check_write(self, written, user_id, versions):
+        # Only a failed conditional write needs a second query, to tell a
+        # missing user apart from a stale version
+        if written:
+            return True
+        if versions and self.exists(user_id):
+            raise VersionMismatch('User was modified')
+        return False
+
+
+class RevocationRepository:
+    """
+    Append-only log of token revocations shared by every worker
+    Args:
+        database (Database): Database the queries run against
+    """
+    def __init__(self, database):
+        self.db = database
+
+    def since(self, after_id, logged_since=None):
+        """
+        Args:
+            after_id (int): Entries with a greater id are returned
+            logged_since (float): Entries logged at or after this time are
+                returned too, whatever their id
+        Returns:
+            list: (id, user_id, min_version, created_at) of those entries,
+                min_version being None when every token of the user is revoked
+        """
+        with self.db.cursor() as cursor:
+            cursor.execute(
+                "SELECT id, user_id, min_version, created_at FROM token_revocations "
+                "WHERE id > %s OR created_at >= %s ORDER BY id",
+                (after_id, time.time() if logged_since is None else logged_since)
+            )
+            return cursor.fetchall()
+
+    def prune(self, before):
+        """
+        Deletes entries logged before the given time, once every token they
+        could revoke has expired anyway
+        """
+        with self.db.transaction() as cursor:
+            cursor.execute("DELETE FROM token_revocations WHERE created_at < %s", (before,))
+
+
+# =============================================
+# READ REPLICAS
+# =============================================
+class Replica:
+    """
+    One read replica: its backend, its own connection pool and the outcome
+    of the last health check
+    """
+    def __init__(self, name, backend, pool):
+        self.name = name
+        self.backend = backend
+        self.pool = pool
+        self.healthy = True
+        self.lag = None
+        self.error = None
+        self.checked_at = None
+
+    def mark_down(self, error):
+        # Out of rotation until a later check finds it healthy again
+        self.healthy = False
+        self.error = str(error)
+
+
+class ReplicaSet:
+    """
+    Read replicas handed out round-robin among the healthy ones
+    Health and replication lag are checked every check_interval seconds by
+    the first request finding the last check too old. A replica that cannot
+    be reached, stopped replicating or lags more than max_lag seconds leaves
+    the rotation until a later check finds it back in shape; with none left,
+    reads go to the primary.
+    Args:
+        replicas (list): Replica instances
+        max_lag (float): Seconds of lag beyond which a replica is skipped
+        check_interval (float): Seconds between two health checks
+    """
+    def __init__(self, replicas, max_lag=5.0, check_interval=5.0):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._turn = count()
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def pick(self):
+        """
+        Returns:
+            Replica: The next healthy replica, or None
+        """
+        if not self.replicas:
+            return None
+        self._maybe_check()
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+    def check(self):
+        """
+        Pings every replica and measures its replication lag
+        """
+        for replica in self.replicas:
+            replica.checked_at = time.time()
+            try:
+                with replica.pool.connection() as conn:
+                    replica.backend.ping(conn)
+                    lag = replica.backend.replication_lag(conn)
+            except Exception as e:
+                replica.mark_down(e)
+                continue
+            replica.lag = lag
+            if lag is None:
+                replica.mark_down('Replication is stopped')
+            elif lag > self.max_lag:
+                replica.mark_down('Replication lag of %.1fs' % lag)
+            else:
+                replica.healthy = True
+                replica.error = None
+
+    def stats(self):
+        """
+        Returns:
+            list: Name, health, lag, last error and pool counters per replica
+        """
+        return [
+            {
+                "name": replica.name,
+                "healthy": replica.healthy,
+                "lag": replica.lag,
+                "error": replica.error,
+                "checked_at": replica.checked_at,
+                "pool": replica.pool.stats()
+            }
+            for replica in self.replicas
+        ]
+
+    def __len__(self):
+        return len(self.replicas)
+
+    def _maybe_check(self):
+        # Only one thread checks; the others keep using the current state
+        if time.monotonic() < self._next_check or not self._lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() >= self._next_check:
+                self.check()
+                self._next_check = time.monotonic() + self.check_interval
+        finally:
+            self._lock.release()
+
+
+# =============================================
+# FLASK EXTENSION
+# =============================================
+class Database:
+    """
+    Flask extension owning the connection pool and repositories
+    Configuration:
+        DB_BACKEND: 'mysql' (default) or 'sqlite'
+        SQLITE_PATH: Database file used by the sqlite backend
+        DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE: Pool bounds
+        DB_POOL_TIMEOUT: Seconds to wait for a free connection
+        DB_POOL_MAX_IDLE: Seconds before surplus idle connections are closed
+        DB_POOL_PING_INTERVAL: Idle seconds before a connection is re-checked
+        DB_REPLICAS: Settings overriding the primary's for each read replica,
+            e.g. [{"MYSQL_HOST": "replica1"}] or [{"SQLITE_PATH": "copy.db"}]
+        DB_REPLICA_MAX_LAG: Seconds of lag beyond which a replica is skipped
+        DB_REPLICA_CHECK_INTERVAL: Seconds between replica health checks
+        DB_REPLICA_CONNECT_TIMEOUT: Seconds before giving up on a replica
+        DB_READ_YOUR_WRITES: Seconds a client's reads stay on the primary
+            after it wrote, tracked in its session cookie
+    Reads opt into replicas with cursor(replica=True).
+    Other extensions observe statements by appending a callable taking the
+    query and its duration to app.extensions['query_observers'].
+    """
+    def __init__(self, app=None):
+        self.users = UserRepository(self)
+        self.revocations = RevocationRepository(self)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend, pool = self._connect(app.config)
+        replicas = []
+        for i, settings in enumerate(app.config.get('DB_REPLICAS') or []):
+            # A replica that is down should fail fast, not hold the request
+            timeout = app.config.get('DB_REPLICA_CONNECT_TIMEOUT', 2)
+            config = dict(app.config, MYSQL_CONNECT_TIMEOUT=timeout, **settings)
+            replicas.append(Replica(
+                settings.get('NAME') or 'replica%d' % (i + 1),
+                *self._connect(config)
+            ))
+        replica_set = ReplicaSet(
+            replicas,
+            app.config.get('DB_REPLICA_MAX_LAG', 5.0),
+            app.config.get('DB_REPLICA_CHECK_INTERVAL', 5.0)
+        )
+        app.extensions['database'] = (backend, pool, replica_set)
+        app.extensions.setdefault('query_observers', [])
+
+    def _connect(self, config):
+        backend = BACKENDS[config.get('DB_BACKEND', 'mysql')](config)
+        pool = ConnectionPool(
+            backend.connect,
+            backend.ping,
+            min_size=config.get('DB_POOL_MIN_SIZE', 1),
+            max_size=config.get('DB_POOL_MAX_SIZE', 10),
+            timeout=config.get('DB_POOL_TIMEOUT', 5.0),
+            max_idle=config.get('DB_POOL_MAX_IDLE', 300.0),
+            ping_interval=config.get('DB_POOL_PING_INTERVAL', 30.0)
+        )
+        return backend, pool
+
+    @property
+    def backend(self):
+        return current_app.extensions['database'][0]
+
+    @property
+    def pool(self):
+        return current_app.extensions['database'][1]
+
+    @property
+    def replicas(self):
+        return current_app.extensions['database'][2]
+
+    @contextmanager
+    def cursor(self, streaming=False, replica=False):
+        """
+        Yields a cursor on a pooled connection for read-only statements
+        Args:
+            streaming (bool): Use an unbuffered server-side cursor so rows
+                are fetched as they are read instead of all at once
+            replica (bool): The read tolerates replication lag and may go
+                to a read replica
+        """
+        with self._connection(replica) as (backend, conn):
+            cursor = self._instrument(backend.streaming_cursor(conn) if streaming else conn.cursor())
+            # Left open if the block raises: closing an abandoned unbuffered
+            # cursor would drain its remaining rows, and the pool rolls back
+            # or discards the connection anyway
+            yield cursor
+            cursor.close()
+            conn.rollback()  # end the read transaction so the next checkout sees fresh data
+
+    @contextmanager
+    def transaction(self, pin=False):
+        """
+        Yields a cursor whose statements are committed together, or rolled
+        back if the block raises
+        Args:
+            pin (bool): The client asked for this write and must read it
+                back, so its reads go to the primary for a while.
+                Housekeeping such as pruning the revocation log leaves
+                them on the replicas.
+        """
+        with self.pool.connection() as conn:
+            self.backend.begin(conn)
+            cursor = self._instrument(conn.cursor())
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+            conn.commit()
+
+        if pin and self.replicas and has_request_context():
+            # Read your writes: this request, and the client's next ones
+            # for a few seconds, read from the primary
+            g.db_primary = True
+            session['db_primary_until'] = time.time() + current_app.config.get('DB_READ_YOUR_WRITES', 5)
+
+    @contextmanager
+    def _connection(self, replica):
+        # Yields (backend, connection) of a healthy replica when allowed,
+        # falling back to the primary if it cannot be reached
+        node = self.replicas.pick() if replica and not self.pinned() else None
+        if node is not None:
+            try:
+                conn = node.pool.acquire()
+            except Exception as e:
+                node.mark_down(e)
+            else:
+                with node.pool.connection(conn) as conn:
+                    yield node.backend, conn
+                return
+        with self.pool.connection() as conn:
+            yield self.backend, conn
+
+    def pinned(self):
+        """
+        Returns:
+            bool: True if replicas are configured but this request reads from
+                the primary: it wrote, its client wrote moments ago, or it
+                called use_primary
+        """
+        if not self.replicas or not has_request_context():
+            return False
+        return g.get('db_primary', False) or session.get('db_primary_until', 0) > time.time()
+
+    def use_primary(self):
+        """
+        Sends the reads of the rest of this request to the primary
+        """
+        g.db_primary = True
+
+    def _instrument(self, cursor):
+        observers = current_app.extensions['query_observers']
+        return InstrumentedCursor(cursor, observers) if observers else cursor
@@ -0,0 +1,389 @@
+import hashlib
+import mimetypes
+import os
+import re
+import secrets
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+
+# =============================================
+# CONTENT-ADDRESSED FILE STORE
+# =============================================
+CHUNK_SIZE = 64 * 1024
+DIGEST = re.compile(r'^[0-9a-f]{64}$')
+SCHEMA_VERSION = 1
+SORT_COLUMNS = {
+    'name': 'name',
+    'size': 'size',
+    'uploaded_at': 'created_at'
+}
+
+
+class FileStore:
+    """
+    Stores each distinct content once, under UPLOAD_FOLDER/.blobs keyed by its
+    SHA-256 digest. Every uploaded name stays a regular file in UPLOAD_FOLDER,
+    hard-linked to its blob, so downloads are served as before while identical
+    uploads share one copy on disk. A SQLite index maps names to digests and
+    counts the references to each blob; the blob is removed with its last name,
+    along with the artifacts derived from it under UPLOAD_FOLDER/.derived.
+    The index also keeps each file's size, upload time and content type, so
+    listings never have to touch the filesystem.
+    Args:
+        upload_folder (str): Folder the named files live in
+    """
+    def __init__(self, upload_folder):
+        self.upload_folder = upload_folder
+        self.blob_folder = os.path.join(upload_folder, '.blobs')
+        self.tmp_folder = os.path.join(upload_folder, '.tmp')
+        self.derived_folder = os.path.join(upload_folder, '.derived')
+        self.index_path = os.path.join(upload_folder, '.index.db')
+        os.makedirs(self.blob_folder, exist_ok=True)
+        os.makedirs(self.tmp_folder, exist_ok=True)
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")  # readers never wait on writers
+        conn.close()
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS blobs(
+                    digest TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    refcount INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS files(
+                    name TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL REFERENCES blobs(digest)
+                )
+            """)
+            schema_version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if schema_version < SCHEMA_VERSION:
+                self._migrate(conn)
+        if schema_version == 0:
+            # New index: adopt whatever is already in the folder
+            self.reconcile()
+
+    def save(self, name, stream):
+        """
+        Stores the content of a stream under a name, hashing it as it is
+        written to a temporary file
+        Args:
+            name (str): Secured file name
+            stream: File-like object to read the content from
+        Returns:
+            dict: name, size, sha256 and whether the content was already stored
+        """
+        tmp_path = self.temp_path()
+        digest = hashlib.sha256()
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    digest.update(chunk)
+            return self.put(name, tmp_path, digest.hexdigest())
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put(self, name, path, digest):
+        """
+        Moves an already hashed file into the store under a name, replacing
+        whatever the name referred to before
+        Args:
+            name (str): Secured file name
+            path (str): File to take ownership of, on the same filesystem
+            digest (str): SHA-256 hex digest of the file
+        Returns:
+            dict: name, size, sha256 and whether the content was already stored
+        """
+        blob_path = self.blob_path(digest)
+        with self._transaction() as conn:
+            row = conn.execute("SELECT size FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            deduplicated = row is not None
+            if deduplicated:
+                size = row[0]
+                os.remove(path)
+            else:
+                size = os.path.getsize(path)
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(path, blob_path)
+                conn.execute("INSERT INTO blobs (digest, size, refcount) VALUES (?, ?, 0)",
+                             (digest, size))
+            self._bind(conn, name, digest, size)
+        return {"filename": name, "size": size, "sha256": digest, "deduplicated": deduplicated}
+
+    def link(self, name, digest):
+        """
+        Stores a name for content that is already in the store, without the
+        client having to send it again
+        Args:
+            name (str): Secured file name
+            digest (str): SHA-256 hex digest announced by the client
+        Returns:
+            dict: name, size and sha256, or None if the digest is unknown
+        """
+        digest = digest.lower()
+        if not DIGEST.match(digest):
+            return None
+        with self._transaction() as conn:
+            row = conn.execute("SELECT size FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if row is None:
+                return None
+            self._bind(conn, name, digest, row[0])
+        return {"filename": name, "size": row[0], "sha256": digest, "deduplicated": True}
+
+    def has(self, digest):
+        """
+        Returns:
+            bool: True if content with this digest is stored
+        """
+        if not DIGEST.match(digest.lower()):
+            return False
+        with self._transaction(write=False) as conn:
+            return conn.execute("SELECT 1 FROM blobs WHERE digest = ?",
+                                (digest.lower(),)).fetchone() is not None
+
+    def get(self, name):
+        """
+        Looks up the indexed metadata of a file
+        Returns:
+            dict: filename, size, uploaded_at, content_type and sha256, or None
+        """
+        with self._transaction(write=False) as conn:
+            row = conn.execute(
+                "SELECT name, size, created_at, content_type, digest FROM files WHERE name = ?",
+                (name,)
+            ).fetchone()
+        return self._describe(row) if row else None
+
+    def list(self, sort='name', descending=False, after=None, limit=100,
+             extension=None, min_size=None, max_size=None, since=None, until=None):
+        """
+        Returns one keyset page of indexed files
+        Args:
+            sort (str): 'name', 'size' or 'uploaded_at'
+            descending (bool): Reverse the sort order
+            after (tuple): (sort value, name) of the last file of the previous page
+            limit (int): Maximum number of files
+            extension (str): Only files with this extension
+            min_size, max_size (int): Inclusive size bounds in bytes
+            since, until (float): Inclusive upload time bounds as UNIX timestamps
+        Returns:
+            tuple: List of file dicts, and the (sort value, name) key of the
+                next page or None on the last one
+        """
+        column = SORT_COLUMNS[sort]
+        clauses = []
+        params = []
+
+        for clause, value in (("extension = ?", extension),
+                              ("size >= ?", min_size),
+                              ("size <= ?", max_size),
+                              ("created_at >= ?", since),
+                              ("created_at <= ?", until)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+
+        comparison = '<' if descending else '>'
+        if after is not None:
+            if column == 'name':
+                clauses.append("name %s ?" % comparison)
+                params.append(after[1])
+            else:
+                clauses.append("(%s, name) %s (?, ?)" % (column, comparison))
+                params.extend(after)
+
+        direction = 'DESC' if descending else 'ASC'
+        query = "SELECT name, size, created_at, content_type, digest FROM files"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        if column == 'name':
+            query += " ORDER BY name %s LIMIT ?" % direction
+        else:
+            query += " ORDER BY %s %s, name %s LIMIT ?" % (column, direction, direction)
+        params.append(limit)
+
+        with self._transaction(write=False) as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        files = [self._describe(row) for row in rows]
+        next_key = None
+        if len(rows) == limit:
+            last = rows[-1]
+            next_key = ({'name': last[0], 'size': last[1], 'created_at': last[2]}[column], last[0])
+        return files, next_key
+
+    def reconcile(self):
+        """
+        Brings the index back in line with UPLOAD_FOLDER after out-of-band
+        changes: files added by hand are hashed and adopted, files removed by
+        hand are dropped, modified files are re-hashed, and blob reference
+        counts are recomputed
+        Returns:
+            dict: Number of files added, updated and removed
+        """
+        on_disk = {
+            name for name in os.listdir(self.upload_folder)
+            if not name.startswith('.') and os.path.isfile(os.path.join(self.upload_folder, name))
+        }
+        with self._transaction(write=False) as conn:
+            indexed = dict(conn.execute("SELECT name, digest FROM files").fetchall())
+
+        counts = {"added": 0, "updated": 0, "removed": 0}
+        for name in set(indexed) - on_disk:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM files WHERE name = ?", (name,))
+                self._release(conn, indexed[name])
+            counts["removed"] += 1
+
+        for name in sorted(on_disk):
+            path = os.path.join(self.upload_folder, name)
+            if name in indexed:
+                try:
+                    if os.path.samefile(path, self.blob_path(indexed[name])):
+                        continue
+                except FileNotFoundError:
+                    pass
+            # Hash a hard link of the file so the name can be swapped safely
+            tmp_path = self.temp_path()
+            try:
+                os.link(path, tmp_path)
+            except OSError:
+                shutil.copyfile(path, tmp_path)
+            digest = hashlib.sha256()
+            with open(tmp_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            self.put(name, tmp_path, digest.hexdigest())
+            counts["updated" if name in indexed else "added"] += 1
+
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE blobs SET refcount = "
+                "(SELECT COUNT(*) FROM files WHERE files.digest = blobs.digest)"
+            )
+            for (digest,) in conn.execute("SELECT digest FROM blobs WHERE refcount = 0").fetchall():
+                self._release(conn, digest)
+        return counts
+
+    def remove(self, name):
+        """
+        Removes a name, and its blob when no other name refers to it
+        Args:
+            name (str): File name to remove
+        Returns:
+            bool: False if there was no such file
+        """
+        path = os.path.join(self.upload_folder, name)
+        with self._transaction() as conn:
+            row = conn.execute("SELECT digest FROM files WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                # Files placed in the folder before the store existed
+                if not os.path.isfile(path):
+                    return False
+                os.remove(path)
+                return True
+            if os.path.exists(path):
+                os.remove(path)
+            conn.execute("DELETE FROM files WHERE name = ?", (name,))
+            self._release(conn, row[0])
+        return True
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_folder, digest[:2], digest)
+
+    def derived_path(self, digest):
+        return os.path.join(self.derived_folder, digest[:2], digest)
+
+    def temp_path(self):
+        return os.path.join(self.tmp_folder, secrets.token_hex(16))
+
+    def _bind(self, conn, name, digest, size):
+        # Points the name at the blob, atomically replacing any previous file
+        tmp_path = self.temp_path()
+        try:
+            os.link(self.blob_path(digest), tmp_path)
+        except OSError:
+            # No hard links on this filesystem: keep working without sharing
+            shutil.copyfile(self.blob_path(digest), tmp_path)
+        os.replace(tmp_path, os.path.join(self.upload_folder, name))
+
+        row = conn.execute("SELECT digest FROM files WHERE name = ?", (name,)).fetchone()
+        conn.execute(
+            "INSERT OR REPLACE INTO files (name, digest, size, created_at, content_type, extension) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (name, digest, size, time.time(), mimetypes.guess_type(name)[0], _extension(name))
+        )
+        if row is not None and row[0] == digest:
+            return
+        conn.execute("UPDATE blobs SET refcount = refcount + 1 WHERE digest = ?", (digest,))
+        if row is not None:
+            self._release(conn, row[0])
+
+    def _release(self, conn, digest):
+        conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE digest = ?", (digest,))
+        refcount = conn.execute("SELECT refcount FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        if refcount is not None and refcount[0] <= 0:
+            conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            try:
+                os.remove(self.blob_path(digest))
+            except FileNotFoundError:
+                pass
+            shutil.rmtree(self.derived_path(digest), ignore_errors=True)
+
+    def _describe(self, row):
+        return {
+            "filename": row[0],
+            "size": row[1],
+            "uploaded_at": row[2],
+            "content_type": row[3],
+            "sha256": row[4]
+        }
+
+    def _migrate(self, conn):
+        # Version 1: file metadata kept in the index for listings
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(files)")]
+        for column, definition in (("size", "INTEGER NOT NULL DEFAULT 0"),
+                                   ("created_at", "REAL NOT NULL DEFAULT 0"),
+                                   ("content_type", "TEXT"),
+                                   ("extension", "TEXT")):
+            if column not in columns:
+                conn.execute("ALTER TABLE files ADD COLUMN %s %s" % (column, definition))
+        conn.execute("UPDATE files SET size = (SELECT size FROM blobs WHERE blobs.digest = files.digest)")
+        for (name,) in conn.execute("SELECT name FROM files").fetchall():
+            path = os.path.join(self.upload_folder, name)
+            created_at = os.path.getctime(path) if os.path.exists(path) else time.time()
+            conn.execute(
+                "UPDATE files SET created_at = ?, content_type = ?, extension = ? WHERE name = ?",
+                (created_at, mimetypes.guess_type(name)[0], _extension(name), name)
+            )
+        conn.execute("CREATE INDEX IF NOT EXISTS files_size ON files(size, name)")
+        conn.execute("CREATE INDEX IF NOT EXISTS files_created_at ON files(created_at, name)")
+        conn.execute("CREATE INDEX IF NOT EXISTS files_extension ON files(extension, name)")
+        conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+    @contextmanager
+    def _transaction(self, write=True):
+        # BEGIN IMMEDIATE serializes writers across worker processes
+        conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+
+def _extension(name):
+    return name.rsplit('.', 1)[1].lower() if '.' in name else None
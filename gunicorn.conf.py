@@ -0,0 +1,73 @@
+import gc
+import multiprocessing
+import os
+import signal
+
+import config
+from jobs import spawn_worker, stop_worker
+from metrics import SnapshotDirectory, default_directory
+
+# =============================================
+# PRODUCTION LAUNCHER
+# =============================================
+"""
+Gunicorn settings for serving main.py in production:
+
+    gunicorn -c gunicorn.conf.py
+
+The app is built once in the master and forked into the workers, which
+share its memory copy-on-write. Each worker starts with an empty database
+pool; the ones inherited from the master are never used. On SIGTERM a
+worker stops accepting connections, fails /readyz, refuses new chunked
+uploads and lets in-flight requests, uploads included, finish within
+graceful_timeout. Unless JOBS_WORKER is off, the master also runs a
+process-files worker draining the post-upload processing queue.
+"""
+wsgi_app = 'main:create_app()'
+bind = os.environ.get('BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', 4))
+preload_app = True
+
+timeout = 30  # seconds a worker may stay unresponsive before it is killed
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 120))  # drains uploads
+keepalive = 5
+
+# Workers are recycled after a while, staggered so they never restart together
+max_requests = int(os.environ.get('MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+
+
+def on_starting(server):
+    # Metrics left by a previous run would be added to the new totals
+    SnapshotDirectory(config.METRICS_DIR or default_directory()).clear()
+
+
+def when_ready(server):
+    if config.JOBS_WORKER:
+        server.jobs_worker = spawn_worker()
+
+    # Everything the master built is moved out of the collector's reach, so
+    # collections in the workers do not write to (and copy) shared pages
+    gc.freeze()
+
+
+def on_exit(server):
+    worker = getattr(server, 'jobs_worker', None)
+    if worker is not None:
+        stop_worker(worker, graceful_timeout)
+
+
+def post_worker_init(worker):
+    # Gunicorn's own SIGTERM handler stops the worker once its requests are
+    # done; before that, the app is told to drain
+    stop = signal.getsignal(signal.SIGTERM)
+
+    def drain(signum, frame):
+        worker.wsgi.extensions['draining'].set()
+        stop(signum, frame)
+
+    signal.signal(signal.SIGTERM, drain)
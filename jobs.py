@@ -0,0 +1,491 @@
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from compression import VARIANT_NAMES, available_encodings, compress_file, is_compressible
+
+try:
+    from PIL import Image
+except ImportError:  # optional, no thumbnails without it
+    Image = None
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # optional, no PDF text without it
+    PdfReader = None
+
+# =============================================
+# POST-UPLOAD PROCESSING
+# =============================================
+CHUNK_SIZE = 64 * 1024
+THUMBNAIL_SIZE = (256, 256)
+TEXT_LIMIT = 1024 * 1024  # characters of extracted text kept
+VARIANT_MAX_RATIO = 0.9  # compressed variants saving less than 10% are dropped
+IMAGE_TYPES = {'image/png', 'image/jpeg', 'image/gif'}
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf')
+)
+
+
+class JobQueue:
+    """
+    Persistent queue of post-upload processing jobs, one per distinct
+    content, kept in UPLOAD_FOLDER/.jobs.db so the web workers feeding it
+    and the processing workers draining it need no broker.
+    A claimed job is leased: if its worker dies, the job is handed out again
+    once the lease runs out. Failed runs are retried with a doubling delay.
+    Workers report in with heartbeats; uploads are only refused while one
+    is alive, as nothing would free the queue otherwise.
+    Args:
+        store (FileStore): Store whose blobs are processed
+        max_pending (int): Queued and running jobs from which uploads are refused
+        max_attempts (int): Runs of a job before it is marked failed
+        retry_delay (float): Seconds before the first retry
+        lease (float): Seconds a claimed job may run before it is taken over
+        heartbeat_timeout (float): Seconds without a heartbeat after which
+            a worker is considered gone
+    """
+    def __init__(self, store, max_pending=1000, max_attempts=3, retry_delay=30.0, lease=300.0,
+                 heartbeat_timeout=30.0):
+        self.store = store
+        self.path = os.path.join(store.upload_folder, '.jobs.db')
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self.heartbeat_timeout = heartbeat_timeout
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.close()
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs(
+                    digest TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    result TEXT,
+                    updated_at REAL NOT NULL,
+                    run_after REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, run_after)")
+            conn.execute("CREATE TABLE IF NOT EXISTS workers(worker_id TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+
+    def full(self):
+        """
+        Returns:
+            bool: True if max_pending jobs are waiting or running while a
+                worker is draining the queue
+        """
+        with self._transaction(write=False) as conn:
+            pending = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+        return pending >= self.max_pending and self.workers() > 0
+
+    def heartbeat(self, worker_id):
+        """
+        Records that a worker is alive, forgetting the ones long gone
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO workers (worker_id, seen_at) VALUES (?, ?)", (worker_id, now))
+            conn.execute("DELETE FROM workers WHERE seen_at < ?", (now - self.heartbeat_timeout,))
+
+    def retire(self, worker_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+    def workers(self):
+        """
+        Returns:
+            int: Workers that sent a heartbeat within heartbeat_timeout
+        """
+        with self._transaction(write=False) as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM workers WHERE seen_at >= ?", (time.time() - self.heartbeat_timeout,)
+            ).fetchone()[0]
+
+    def enqueue(self, digest, filename):
+        """
+        Queues the processing of a content, unless it is already queued,
+        running, or done with its artifacts still on disk
+        Args:
+            digest (str): SHA-256 of the stored content
+            filename (str): Name it was uploaded under, a hint for its type
+        Returns:
+            bool: True if a job was queued
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE digest = ?", (digest,)).fetchone()
+            if row is not None and (row[0] in ('queued', 'running') or (
+                    row[0] == 'done' and os.path.isdir(self.store.derived_path(digest)))):
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (digest, filename, status, attempts, updated_at, run_after) "
+                "VALUES (?, ?, 'queued', 0, ?, ?)",
+                (digest, filename, now, now)
+            )
+        return True
+
+    def claim(self, limit):
+        """
+        Leases up to limit jobs that are due, including running ones whose
+        lease expired
+        Returns:
+            list: (digest, filename) pairs
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT digest, filename, status, attempts FROM jobs "
+                "WHERE status IN ('queued', 'running') AND run_after <= ? "
+                "ORDER BY run_after LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            claimed = []
+            for digest, filename, status, attempts in rows:
+                if status == 'running' and attempts >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE digest = ?",
+                        ('Worker lost', now, digest)
+                    )
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                    "updated_at = ?, run_after = ? WHERE digest = ?",
+                    (now, now + self.lease, digest)
+                )
+                claimed.append((digest, filename))
+        return claimed
+
+    def complete(self, digest, result):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', error = NULL, result = ?, updated_at = ? WHERE digest = ?",
+                (json.dumps(result), time.time(), digest)
+            )
+
+    def fail(self, digest, error):
+        """
+        Records a failed run, queueing a retry while attempts remain
+        Returns:
+            bool: True if the job is now failed for good
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT attempts FROM jobs WHERE digest = ?", (digest,)).fetchone()
+            if row is None:
+                return False
+            final = row[0] >= self.max_attempts
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ?, run_after = ? WHERE digest = ?",
+                ('failed' if final else 'queued', error, now,
+                 now + self.retry_delay * 2 ** (row[0] - 1), digest)
+            )
+        return final
+
+    def discard(self, digest):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM jobs WHERE digest = ?", (digest,))
+
+    def get(self, digest):
+        """
+        Returns:
+            dict: status, attempts, error, updated_at and result of the
+                content's job, or None if it was never queued
+        """
+        with self._transaction(write=False) as conn:
+            row = conn.execute(
+                "SELECT status, attempts, error, updated_at, result FROM jobs WHERE digest = ?",
+                (digest,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "status": row[0],
+            "attempts": row[1],
+            "error": row[2],
+            "updated_at": row[3],
+            "result": json.loads(row[4]) if row[4] else None
+        }
+
+    def statuses(self, digests):
+        """
+        Returns:
+            dict: digest -> status, for the digests that have a job
+        """
+        digests = list(set(digests))
+        if not digests:
+            return {}
+        with self._transaction(write=False) as conn:
+            return dict(conn.execute(
+                "SELECT digest, status FROM jobs WHERE digest IN (%s)" % ', '.join('?' * len(digests)),
+                digests
+            ).fetchall())
+
+    def counts(self):
+        """
+        Returns:
+            dict: Number of jobs per status
+        """
+        with self._transaction(write=False) as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'failed')}
+
+    @contextmanager
+    def _transaction(self, write=True):
+        # BEGIN IMMEDIATE serializes writers across processes
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+
+# =============================================
+# PROCESSING WORKER
+# =============================================
+def process_file(path, filename, target, levels=None, min_size=0, max_size=None):
+    """
+    Derives the artifacts of one stored content; runs in a pool process
+    Writes info.json (checksums and MIME type) and, depending on the type,
+    thumbnail.png, text.txt and compressed variants (content.gz, .br, .zst)
+    into the target folder, replacing it whole
+    Args:
+        path (str): Blob to read
+        filename (str): Name it was uploaded under, a hint for the type
+        target (str): Folder the artifacts go to
+        levels (dict): Level per encoding of the compressed variants of
+            text-like files; None for no variants
+        min_size, max_size (int): Size bounds of the files given variants
+    Returns:
+        dict: Checksums, MIME type, the names of the artifacts and the size
+            of each compressed variant
+    """
+    md5 = hashlib.md5()
+    sha1 = hashlib.sha1()
+    crc = 0
+    head = b''
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            head = head or chunk
+            md5.update(chunk)
+            sha1.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+    mime = sniff(head) or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    staging = '%s.tmp-%d' % (target, os.getpid())
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    try:
+        artifacts = []
+        if mime in IMAGE_TYPES and Image is not None:
+            with Image.open(path) as image:
+                image.thumbnail(THUMBNAIL_SIZE)
+                if image.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+                    image = image.convert('RGBA')
+                image.save(os.path.join(staging, 'thumbnail.png'), 'PNG')
+            artifacts.append('thumbnail.png')
+
+        text = None
+        if mime == 'text/plain':
+            with open(path, 'rb') as f:
+                text = f.read(TEXT_LIMIT * 4).decode('utf-8', 'replace')[:TEXT_LIMIT]
+        elif mime == 'application/pdf' and PdfReader is not None:
+            text = extract_pdf_text(path)
+        if text is not None:
+            with open(os.path.join(staging, 'text.txt'), 'w', encoding='utf-8') as f:
+                f.write(text)
+            artifacts.append('text.txt')
+
+        # Compressed once here, at the highest levels worth their CPU, so
+        # downloads are sent precompressed instead of compressed per request
+        variants = {}
+        size = os.path.getsize(path)
+        if levels and is_compressible(mime) and min_size <= size <= (max_size or size):
+            for encoding in available_encodings():
+                if encoding not in levels:
+                    continue
+                variant_path = os.path.join(staging, VARIANT_NAMES[encoding])
+                variant_size = compress_file(path, variant_path, encoding, levels[encoding])
+                if variant_size <= size * VARIANT_MAX_RATIO:
+                    variants[encoding] = variant_size
+                else:
+                    os.remove(variant_path)
+
+        result = {
+            "mime_type": mime,
+            "checksums": {"md5": md5.hexdigest(), "sha1": sha1.hexdigest(), "crc32": '%08x' % crc},
+            "artifacts": artifacts,
+            "variants": variants
+        }
+        with open(os.path.join(staging, 'info.json'), 'w') as f:
+            json.dump(result, f)
+
+        shutil.rmtree(target, ignore_errors=True)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return result
+
+
+def sniff(head):
+    """
+    Returns:
+        str: MIME type recognized from the first bytes of a file, or None
+    """
+    for signature, mime in SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    return None
+
+
+def extract_pdf_text(path):
+    parts = []
+    length = 0
+    for page in PdfReader(path).pages:
+        text = page.extract_text() or ''
+        parts.append(text)
+        length += len(text)
+        if length >= TEXT_LIMIT:
+            break
+    return '\n'.join(parts)[:TEXT_LIMIT]
+
+
+class Worker:
+    """
+    Drains a JobQueue with a process pool, so thumbnails and text
+    extraction never run in the web workers
+    Args:
+        queue (JobQueue): Queue to claim jobs from
+        processes (int): Pool size, defaults to the number of CPUs
+        poll_interval (float): Seconds between two looks at an empty queue
+        precompress (tuple): levels, min_size and max_size passed to
+            process_file for the compressed variants
+    """
+    def __init__(self, queue, processes=None, poll_interval=1.0, precompress=(None, 0, None)):
+        self.queue = queue
+        self.processes = processes or os.cpu_count() or 1
+        self.poll_interval = poll_interval
+        self.precompress = precompress
+        self.counts = {"done": 0, "retried": 0, "failed": 0}
+        self.worker_id = '%s:%d' % (socket.gethostname(), os.getpid())
+        self._next_heartbeat = 0.0
+
+    def run(self, once=False):
+        """
+        Processes jobs until interrupted
+        Args:
+            once (bool): Return when no job is due instead of polling
+        Returns:
+            dict: Number of jobs done, retried and failed
+        """
+        try:
+            while True:
+                try:
+                    with ProcessPoolExecutor(self.processes) as pool:
+                        self._drain(pool, once)
+                    return self.counts
+                except BrokenProcessPool:
+                    # A pool process died (e.g. out of memory on a huge image);
+                    # its jobs were recorded as failed runs, start a fresh pool
+                    continue
+        finally:
+            self.queue.retire(self.worker_id)
+
+    def _heartbeat(self):
+        if time.monotonic() >= self._next_heartbeat:
+            self.queue.heartbeat(self.worker_id)
+            self._next_heartbeat = time.monotonic() + self.queue.heartbeat_timeout / 3
+
+    def _drain(self, pool, once):
+        running = {}  # future -> digest
+        while True:
+            self._heartbeat()
+            free = self.processes - len(running)
+            for digest, filename in self.queue.claim(free) if free else ():
+                blob_path = self.queue.store.blob_path(digest)
+                if not os.path.exists(blob_path):
+                    self.queue.discard(digest)  # removed before it was processed
+                    continue
+                future = pool.submit(process_file, blob_path, filename,
+                                     self.queue.store.derived_path(digest), *self.precompress)
+                running[future] = digest
+
+            if not running:
+                if once:
+                    return
+                time.sleep(self.poll_interval)
+                continue
+
+            done, _ = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                digest = running.pop(future)
+                try:
+                    self.queue.complete(digest, future.result())
+                    self.counts['done'] += 1
+                except Exception as e:
+                    broken = broken or isinstance(e, BrokenProcessPool)
+                    final = self.queue.fail(digest, '%s: %s' % (type(e).__name__, e))
+                    self.counts['failed' if final else 'retried'] += 1
+            if broken:
+                for digest in running.values():
+                    final = self.queue.fail(digest, 'BrokenProcessPool: pool restarted')
+                    self.counts['failed' if final else 'retried'] += 1
+                raise BrokenProcessPool('A pool process terminated abruptly')
+
+
+def spawn_worker(app='main'):
+    """
+    Starts `flask process-files` next to a server, so the queue is drained
+    without running the command separately
+    Args:
+        app (str): Module of the Flask app, as given to flask --app
+    Returns:
+        subprocess.Popen: The worker process, for stop_worker
+    """
+    return subprocess.Popen([sys.executable, '-m', 'flask', '--app', app, 'process-files'])
+
+
+def stop_worker(process, timeout=30.0):
+    """
+    Interrupts a spawned worker, which lets its pool finish its jobs, and
+    kills it if it has not exited within timeout seconds
+    """
+    if process.poll() is not None:
+        return
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
@@ -0,0 +1,64 @@
+import json
+from functools import lru_cache
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library is used instead
+    orjson = None
+
+# =============================================
+# JSON ENCODING
+# =============================================
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider encoding responses with orjson when it is installed, and
+    exactly like Flask's default provider otherwise
+    Response bodies are byte for byte those of jsonify: compact, keys sorted,
+    non-ASCII text escaped, dates as HTTP dates, Decimal and dataclasses
+    through the default hook. What orjson would spell differently goes
+    through the standard library instead: non-ASCII text, non-string keys
+    and integers beyond 64 bits. Only floats below 1e-4 or from 1e16 up, NaN
+    and Infinity still differ (1e16 rather than 1e+16, null rather than NaN);
+    the API sends none. Pretty-printed debug responses and dumps() go
+    through the standard library.
+    Install it with app.json = FastJSONProvider(app).
+    """
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            body = orjson.dumps(obj, default=self.default, option=self.option | orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            # Non-string keys and integers beyond 64 bits, which orjson
+            # rejects; objects neither can encode fail there too
+            return super().response(*args, **kwargs)
+        if self.ensure_ascii and not body.isascii():
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+@lru_cache(maxsize=256)
+def error_body(status_code, message):
+    """
+    Encoded body of a standard error response, built once per distinct
+    error and then shared: bytes are immutable, so every 401 or 404 reuses
+    the same object instead of serializing a new dict
+    Args:
+        status_code (int): HTTP status code
+        message (str): Error message
+    Returns:
+        bytes: {"error": {"code": ..., "message": ...}} followed by a newline
+    """
+    error = {"error": {"code": status_code, "message": message}}
+    return json.dumps(error, separators=(',', ':'), sort_keys=True).encode() + b'\n'
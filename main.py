@@ -1,35 +1,117 @@
-from flask import Flask, jsonify, request, send_from_directory
-from flask_mysqldb import MySQL
+from flask import Blueprint, Flask, Response, current_app, jsonify, make_response, request, send_file, send_from_directory, stream_with_context
+from werkzeug.exceptions import NotFound, RequestedRangeNotSatisfiable
+from werkzeug.local import LocalProxy
 from werkzeug.utils import secure_filename
 from functools import wraps
-import jwt
-import datetime
+import click
+from archive import stream_zip
+from cache import ResponseCache, RevocationList, TokenCache, create_tag_versions
+from compression import Compression
+from db import Database, DuplicateError, VersionMismatch, user_columns
+from filestore import FileStore
+from jobs import JobQueue, Worker, spawn_worker, stop_worker
+from jsonprovider import FastJSONProvider, error_body
+from metrics import Metrics, scrape_allowed
+from querylog import QueryProfiler
+from ratelimit import RateLimiter
+from uploads import UploadError, UploadSessions
+import payloads
 import os
+import threading
 
 # =============================================
 # TASK 1: CONFIGURATION AND SETUP
 # =============================================
 # Application Configuration
-app = Flask(__name__)
-
-# Database Configuration
-app.config['MYSQL_USER'] = 'flaskuser'
-app.config['MYSQL_PASSWORD'] = 'flaskpassword'
-app.config['MYSQL_HOST'] = 'localhost'
-app.config['MYSQL_DB'] = 'flask_api_db'
-
-# JWT Configuration
-app.config['SECRET_KEY'] = 'secret'
-
-# File Upload Configuration
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif'}
-
-mysql = MySQL(app)
+api = Blueprint('api', __name__, cli_group=None)
+db = Database()
+limiter = RateLimiter()
+metrics = Metrics()
+compression = Compression()
+query_profiler = QueryProfiler()
+
+# Per-application state, resolved for the app handling the current request
+token_cache = LocalProxy(lambda: current_app.extensions['token_cache'])
+response_cache = LocalProxy(lambda: current_app.extensions['response_cache'])
+revocations = LocalProxy(lambda: current_app.extensions['revocations'])
+file_store = LocalProxy(lambda: current_app.extensions['file_store'])
+upload_sessions = LocalProxy(lambda: current_app.extensions['upload_sessions'])
+job_queue = LocalProxy(lambda: current_app.extensions['job_queue'])
+
+def invalidate_user(user_id, publish=True):
+    """
+    Drops every cached token and response built from a user that changed
+    Args:
+        user_id (int): ID of the updated or deleted user
+        publish (bool): Also retire the responses cached by the other
+            workers; False when the change was read from the revocation log
+    """
+    token_cache.invalidate_user(user_id)
+    response_cache.invalidate('users', 'user:%d' % user_id, publish=publish)
 
-# Create uploads folder if it doesn't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+def create_app(config=None):
+    """
+    Builds and configures an application instance
+    Settings are read from config.py, then from the file named by the
+    FLASK_API_SETTINGS environment variable, then from FLASK_-prefixed
+    environment variables (e.g. FLASK_DB_POOL_MAX_SIZE=20, values parsed as
+    JSON), and finally from the config argument
+    Args:
+        config (dict): Overrides applied last, e.g. by tests
+    Returns:
+        Flask: The application, with every route registered
+    """
+    app = Flask(__name__)
+    app.config.from_object('config')
+    app.config.from_envvar('FLASK_API_SETTINGS', silent=True)
+    app.config.from_prefixed_env()
+    if config:
+        app.config.update(config)
+    app.config['USE_X_SENDFILE'] = app.config['FILE_OFFLOAD'] == 'x-sendfile'
+    app.json = FastJSONProvider(app)  # orjson when installed
+
+    metrics.init_app(app)  # first, so its timer wraps the other request hooks
+    compression.init_app(app)  # after_request runs in reverse: metrics sees compressed sizes
+    db.init_app(app)
+    query_profiler.init_app(app)
+    limiter.init_app(app)
+    app.extensions['token_cache'] = TokenCache(app.config['TOKEN_CACHE_SIZE'], app.config['TOKEN_CACHE_TTL'])
+    app.extensions['response_cache'] = ResponseCache(
+        app.config['RESPONSE_CACHE_SIZE'],
+        versions=create_tag_versions(app.config)
+    )
+    app.extensions['revocations'] = RevocationList(
+        db.revocations.since,
+        db.revocations.prune,
+        app.config['JWT_EXPIRATION'],
+        app.config['JWT_REVOCATION_REFRESH'],
+        on_revoke=lambda user_id: invalidate_user(user_id, publish=False),
+        overlap=app.config['JWT_REVOCATION_OVERLAP']
+    )
+
+    # Create uploads folder if it doesn't exist
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    app.extensions['file_store'] = FileStore(app.config['UPLOAD_FOLDER'])
+    app.extensions['upload_sessions'] = UploadSessions(
+        app.extensions['file_store'],
+        app.config['UPLOAD_MAX_SIZE'],
+        app.config['UPLOAD_SESSION_TTL']
+    )
+    app.extensions['job_queue'] = JobQueue(
+        app.extensions['file_store'],
+        app.config['JOBS_MAX_PENDING'],
+        app.config['JOBS_MAX_ATTEMPTS'],
+        app.config['JOBS_RETRY_DELAY'],
+        app.config['JOBS_LEASE'],
+        app.config['JOBS_HEARTBEAT_TIMEOUT']
+    )
+
+    # Set when the worker is asked to stop (see gunicorn.conf.py): readiness
+    # fails and no new chunked uploads start while in-flight requests finish
+    app.extensions['draining'] = threading.Event()
+
+    app.register_blueprint(api)
+    return app
 
 # =============================================
 # TASK 2: ERROR HANDLING
@@ -43,24 +125,17 @@ def error_response(status_code, message):
     Returns:
         JSON response with error details
     """
-    response = jsonify({
-        "error": {
-            "code": status_code,
-            "message": message
-        }
-    })
-    response.status_code = status_code
-    return response
+    return current_app.response_class(error_body(status_code, message), status=status_code,
+                                      mimetype='application/json')
 
-def allowed_file(filename):
+def busy_response(message):
     """
-    Validates file extension against allowed types
-    Args:
-        filename (str): Name of the uploaded file
-    Returns:
-        bool: True if file extension is allowed, False otherwise
+    503 telling the client to retry shortly, e.g. while the processing
+    queue is full or the worker is shutting down
     """
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    response = error_response(503, message)
+    response.headers['Retry-After'] = '1'
+    return response
 
 # =============================================
 # TASK 3: AUTHENTICATION
@@ -75,23 +150,30 @@ def token_required(f):
     """
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
-
-        if not token:
-            return error_response(401, 'Token is missing')
+        try:
+            token = payloads.request_token(request.headers.get('Authorization'))
+        except ValueError as e:
+            return error_response(401, str(e))
 
         try:
-            token = token.split(' ')[1]  # Remove 'Bearer ' prefix
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
+            # Pulls revocations logged by other workers, at most once per
+            # interval; cached tokens of changed or deleted users are dropped
+            revocations.refresh()
 
-            # Get current user from database
-            cur = mysql.connection.cursor()
-            cur.execute("SELECT * FROM midterm_database WHERE username = %s", (data['username'],))
-            current_user = cur.fetchone()
-            cur.close()
+            # Tokens already verified are served from memory until they expire
+            current_user = token_cache.get(token)
+            if current_user is None:
+                data = payloads.decode_token(token, current_app.config)
 
-            if not current_user:
-                return error_response(401, 'Invalid token')
+                # A stateless token carries the user; others are looked up
+                current_user = payloads.stateless_user(data, current_app.config, revocations)
+                if current_user is None:
+                    current_user = db.users.find_by_username(data['username'])
+
+                if not current_user:
+                    return error_response(401, 'Invalid token')
+
+                token_cache.put(token, current_user, data['exp'])
 
         except Exception as e:
             return error_response(401, 'Invalid token')
@@ -100,8 +182,53 @@ def token_required(f):
 
     return decorated
 
+def cached_response(route, tags):
+    """
+    Decorator serving a read view's 200 responses from the response cache
+    Place it below token_required so authentication still runs on hits
+    With read replicas, misses are read from the primary
+    Args:
+        route (str): Key of RESPONSE_CACHE_TTLS holding the lifetime
+        tags (function): Maps the view's URL arguments to the tags of the
+            data the response is built from, purged by writes
+    Returns:
+        decorated function that caches the serialized response body
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            key = request.full_path
+            # A client that just wrote must see its write, so it skips the
+            # cache; and entries are only filled from the primary, so none
+            # is older than the write that last purged its tags
+            entry = None if db.pinned() else response_cache.get(key)
+            if entry is not None:
+                body, status, headers = entry[:3]
+                response = current_app.response_class(body, status, headers)
+                return response.make_conditional(request) if 'ETag' in response.headers else response
+
+            entry_tags = tags(**kwargs)
+            generation = response_cache.generation(entry_tags)
+            db.use_primary()
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                response_cache.put(
+                    key,
+                    response.get_data(),
+                    response.status_code,
+                    list(response.headers),
+                    entry_tags,
+                    current_app.config['RESPONSE_CACHE_TTLS'][route],
+                    generation
+                )
+            return response
+
+        return decorated
+
+    return decorator
+
 # Database setup route
-@app.route('/create_table')
+@api.route('/create_table')
 def create_table():
     """
     Initializes the database table and populates it with sample users
@@ -110,59 +237,41 @@ def create_table():
         500: Database error
     """
     try:
-        cursor = mysql.connection.cursor()
-
-        # Create table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS midterm_database(
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                username VARCHAR(20) UNIQUE,
-                password VARCHAR(255)
-            )
-        """)
-
-        # Insert sample users
-        sample_users = [
-            ('emmanuel_montoya', 'em12345'),
-            ('renzo_salosagcol', 'rs12345'),
-            ('anthony_weathersby', 'aw12345'),
-            ('alice_johnson', 'aj12345'),
-            ('brian_smith', 'bs12345'),
-            ('carla_brown', 'cb12345'),
-            ('david_taylor', 'dt12345'),
-            ('emily_davis', 'ed12345'),
-            ('frank_wilson', 'fw12345'),
-            ('grace_martinez', 'gm12345')
-        ]
-
-        cursor.execute("SELECT COUNT(*) FROM midterm_database")
-        count = cursor.fetchone()[0]
-
-        if count == 0:
-            cursor.executemany(
-                "INSERT INTO midterm_database (username, password) VALUES (%s, %s)",
-                sample_users
-            )
-
-        mysql.connection.commit()
-        cursor.close()
+        db.users.create_table(payloads.SAMPLE_USERS)
         return jsonify({"message": "Table created and populated successfully"}), 200
 
     except Exception as e:
         return error_response(500, str(e))
 
-@app.route('/show_table', methods=['POST', 'GET'])
+@api.route('/show_table', methods=['POST', 'GET'])
 def show_table():
-    cursor = mysql.connection.cursor()
-    cursor.execute('''SELECT * FROM midterm_database''')
-    row_headers=[x[0] for x in cursor.description] #this will extract row headers
-    rv = cursor.fetchall()
-    json_data=[]
-    for result in rv:
-        json_data.append(dict(zip(row_headers,result)))
-    return jsonify(json_data)
-
-@app.route('/login', methods=['POST'])
+    """
+    Returns one page of table rows, ordered by id, with the columns clients
+    may see
+    Query parameters:
+        limit: Rows per page, capped at PAGE_SIZE_MAX
+        after: Cursor from the previous page's Link header
+        fields: Comma-separated subset of id and username
+    Returns:
+        200: List of rows, with a Link rel="next" header when more remain
+        400: Invalid pagination parameters or unknown field
+    """
+    try:
+        after_id, limit = payloads.page_params(request.args, current_app.config)
+        fields = payloads.fields_param(request.args)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    columns = user_columns(fields)
+    row_headers, rv = db.users.dump(after_id, limit, columns)
+    json_data, link = payloads.table_page(row_headers, rv, fields, request.base_url, limit)
+    response = jsonify(json_data)
+    if link:
+        response.headers['Link'] = link
+    return response
+
+@api.route('/login', methods=['POST'])
+@limiter.limit('RATELIMIT_LOGIN', key='ip')
 def login():
     """
     Authenticates user and provides JWT token
@@ -176,26 +285,19 @@ def login():
     if not auth or not auth.username or not auth.password:
         return error_response(401, 'Login required')
 
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT * FROM midterm_database WHERE username = %s AND password = %s",
-                  (auth.username, auth.password))
-    user = cursor.fetchone()
-    cursor.close()
+    user = db.users.find_by_credentials(auth.username, auth.password)
 
     if not user:
         return error_response(401, 'Invalid credentials')
 
-    token = jwt.encode({
-        'username': auth.username,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
-    }, app.config['SECRET_KEY'])
-
-    return jsonify({'token': token})
+    return jsonify({'token': payloads.issue_token(auth.username, user, current_app.config)})
 
 # =============================================
 # TASK 4: FILE HANDLING
 # =============================================
-@app.route('/admin/upload', methods=['POST'])
+@api.route('/admin/upload', methods=['POST'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_UPLOAD', key='token')
 @token_required
 def upload_file(current_user):
     """
@@ -203,35 +305,211 @@ def upload_file(current_user):
     - Validates file presence
     - Checks file type against allowed extensions
     - Enforces maximum file size (16MB)
-    - Stores files securely in uploads directory
+    - Stores files securely in uploads directory, one copy per distinct content
+
+    Instead of a file, the form or JSON body may carry "filename" and
+    "sha256": if that content is already stored, the name is added without
+    the bytes being sent again.
 
     Returns:
         200: File uploaded successfully
         400: Invalid file or file type
         401: Invalid authentication
+        404: Content with the given sha256 is not stored; send the file
+        503: Too many files waiting to be processed, retry later
     """
+    if job_queue.full():
+        return busy_response('Processing queue is full')
+
     if 'file' not in request.files:
-        return error_response(400, 'No file part')
+        try:
+            filename, sha256 = payloads.link_request(request.get_json(silent=True) or request.form,
+                                                     current_app.config)
+        except ValueError as e:
+            return error_response(400, str(e))
+
+        result = file_store.link(secure_filename(filename), sha256)
+        if result is None:
+            return error_response(404, 'Unknown content, upload the file')
+        job_queue.enqueue(result['sha256'], result['filename'])
+        response_cache.invalidate('files')
+        return jsonify(payloads.uploaded_document(result))
 
     file = request.files['file']
 
     if file.filename == '':
         return error_response(400, 'No selected file')
 
-    if file and allowed_file(file.filename):
+    if file and payloads.allowed_file(file.filename, current_app.config):
         filename = secure_filename(file.filename)
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        return jsonify({
-            "message": "File uploaded successfully",
-            "filename": filename
-        })
+        result = file_store.save(filename, file.stream)
+        # Checksums, thumbnails and text extraction run in the
+        # process-files workers, not here
+        job_queue.enqueue(result['sha256'], filename)
+        response_cache.invalidate('files')
+        return jsonify(payloads.uploaded_document(result))
 
     return error_response(400, 'File type not allowed')
 
+def upload_session_response(session, status_code=200):
+    """
+    Serializes a chunked upload session, exposing its offset as a header too
+    """
+    response = jsonify(payloads.upload_session_document(session))
+    response.status_code = status_code
+    response.headers['Upload-Offset'] = str(session['offset'])
+    return response
+
+def upload_error_response(error):
+    """
+    Converts an UploadError, telling the client where to resume when known
+    """
+    response = error_response(error.status_code, str(error))
+    if error.offset is not None:
+        response.headers['Upload-Offset'] = str(error.offset)
+    return response
+
+@api.route('/admin/uploads', methods=['POST'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_UPLOAD', key='token')
+@token_required
+def create_upload(current_user):
+    """
+    Starts a resumable chunked upload for files beyond MAX_CONTENT_LENGTH
+    Required JSON payload:
+    {
+        "filename": "string",
+        "size": int (optional, total bytes),
+        "sha256": "string" (optional, skips the upload if already stored)
+    }
+    Chunks are then sent with PATCH /admin/uploads/<upload_id>.
+
+    Returns:
+        200: Content with this sha256 was already stored under another name
+        201: Upload session with its upload_id and offset 0
+        400: Invalid input or file type
+        413: Declared size is too large
+        503: The worker is shutting down or the processing queue is full; retry
+    """
+    try:
+        filename, size, sha256 = payloads.upload_request(request.get_json(silent=True), current_app.config)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    if current_app.extensions['draining'].is_set():
+        # Sessions already started are still served; new ones go to
+        # another worker
+        return busy_response('Server is shutting down')
+    if job_queue.full():
+        return busy_response('Processing queue is full')
+
+    if sha256:
+        result = file_store.link(secure_filename(filename), sha256)
+        if result is not None:
+            job_queue.enqueue(result['sha256'], result['filename'])
+            response_cache.invalidate('files')
+            return jsonify(payloads.uploaded_document(result))
+
+    try:
+        session = upload_sessions.create(secure_filename(filename), current_user[0], size)
+    except UploadError as e:
+        return upload_error_response(e)
+
+    response = upload_session_response(session, 201)
+    response.headers['Location'] = '/admin/uploads/%s' % session['upload_id']
+    return response
+
+@api.route('/admin/uploads/<upload_id>', methods=['GET'])
+@token_required
+def get_upload(current_user, upload_id):
+    """
+    Reports how much of a chunked upload has been received, so an
+    interrupted client knows where to resume (HEAD returns just the header)
+
+    Returns:
+        200: Upload session with its current offset
+        404: Upload not found
+    """
+    try:
+        return upload_session_response(upload_sessions.get(upload_id, current_user[0]))
+    except UploadError as e:
+        return upload_error_response(e)
+
+@api.route('/admin/uploads/<upload_id>', methods=['PATCH'])
+@token_required
+def append_upload(current_user, upload_id):
+    """
+    Appends the raw request body to a chunked upload
+    Required header:
+        Upload-Offset: Offset the chunk starts at, i.e. the current offset
+    Each chunk is bounded by MAX_CONTENT_LENGTH and streamed to disk.
+
+    Returns:
+        200: New offset
+        400: Missing or invalid Upload-Offset
+        404: Upload not found
+        409: Offset mismatch or concurrent chunk, with the current offset
+        413: Upload exceeds its declared or the maximum size
+    """
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None or offset < 0:
+        return error_response(400, 'Upload-Offset header is required')
+
+    try:
+        session = upload_sessions.get(upload_id, current_user[0])
+        session['offset'] = upload_sessions.append(upload_id, current_user[0], offset, request.stream)
+        return upload_session_response(session)
+    except UploadError as e:
+        return upload_error_response(e)
+
+@api.route('/admin/uploads/<upload_id>/complete', methods=['POST'])
+@token_required
+def complete_upload(current_user, upload_id):
+    """
+    Finalizes a chunked upload and moves the file into the upload directory
+    Optional JSON payload:
+    {
+        "sha256": "hex digest to verify the assembled file against"
+    }
+    Returns:
+        200: File uploaded successfully
+        404: Upload not found
+        409: Upload is incomplete
+        422: Checksum mismatch
+    """
+    data = request.get_json(silent=True) or {}
+
+    try:
+        result = upload_sessions.complete(upload_id, current_user[0], data.get('sha256'))
+    except UploadError as e:
+        return upload_error_response(e)
+
+    job_queue.enqueue(result['sha256'], result['filename'])
+    response_cache.invalidate('files')
+    return jsonify(payloads.uploaded_document(result))
+
+@api.route('/admin/uploads/<upload_id>', methods=['DELETE'])
+@token_required
+def abort_upload(current_user, upload_id):
+    """
+    Cancels a chunked upload and discards the data received so far
+
+    Returns:
+        200: Upload cancelled
+        404: Upload not found
+    """
+    try:
+        upload_sessions.abort(upload_id, current_user[0])
+    except UploadError as e:
+        return upload_error_response(e)
+
+    return jsonify({"message": "Upload cancelled"})
+
 # =============================================
 # TASK 5: PUBLIC ROUTES
 # =============================================
-@app.route('/public/items', methods=['GET'])
+@api.route('/public/items', methods=['GET'])
+@cached_response('public_items', lambda: ['public_items'])
 def get_public_items():
     """
     Public endpoint that doesn't require authentication
@@ -240,16 +518,84 @@ def get_public_items():
     Returns:
         200: List of public items
     """
-    items = [
-        {"id": 1, "name": "Public Item 1", "description": "This is a public item"},
-        {"id": 2, "name": "Public Item 2", "description": "This is another public item"}
-    ]
-    return jsonify({"items": items})
+    return jsonify({"items": payloads.PUBLIC_ITEMS})
+
+# =============================================
+# HEALTH CHECKS
+# =============================================
+@api.route('/healthz', methods=['GET'])
+def liveness():
+    """
+    Liveness probe: the worker is up and serving requests
+
+    Returns:
+        200: Always
+    """
+    return jsonify({"status": "ok"})
+
+@api.route('/readyz', methods=['GET'])
+def readiness():
+    """
+    Readiness probe: the worker can serve traffic, i.e. it is not shutting
+    down, a database connection answers and the upload folder is writable
+
+    Returns:
+        200: Ready, with the connection pool counters and the state of the
+            read replicas
+        503: Not ready, and why
+    """
+    if current_app.extensions['draining'].is_set():
+        return error_response(503, 'Shutting down')
+
+    try:
+        with db.pool.connection() as conn:
+            db.backend.ping(conn)
+    except Exception as e:
+        return error_response(503, 'Database unavailable: %s' % e)
+
+    if not os.access(current_app.config['UPLOAD_FOLDER'], os.W_OK):
+        return error_response(503, 'Upload folder is not writable')
+
+    return jsonify({"status": "ready", "pool": db.pool.stats(), "replicas": db.replicas.stats()})
+
+@api.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Request, database, cache and pool metrics of every worker on the host,
+    in the Prometheus text format, for clients in METRICS_ALLOWED_NETWORKS
+
+    Returns:
+        200: The exposition
+        403: The client is not allowed to scrape
+    """
+    if not scrape_allowed(request.remote_addr, current_app.config['METRICS_ALLOWED_NETWORKS']):
+        return error_response(403, 'Metrics are not available to this client')
+    return metrics.expose()
+
+@metrics.collector
+def collect_state(registry):
+    """
+    Copies the cache and connection pool counters of this worker into the
+    metrics registry before each snapshot
+    """
+    hits = registry.counter('cache_hits_total', 'Cache lookups answered from memory', ('cache',))
+    misses = registry.counter('cache_misses_total', 'Cache lookups that missed', ('cache',))
+    entries = registry.gauge('cache_entries', 'Entries held by the cache', ('cache',))
+    for name, cache in (('token', token_cache), ('response', response_cache)):
+        stats = cache.stats()
+        hits.set(stats['hits'], cache=name)
+        misses.set(stats['misses'], cache=name)
+        entries.set(stats['size'], cache=name)
+
+    pool = db.pool.stats()
+    connections = registry.gauge('db_pool_connections', 'Pooled database connections', ('state',))
+    connections.set(pool['in_use'], state='in_use')
+    connections.set(pool['idle'], state='idle')
 
 # =============================================
 # TASK 3: PROTECTED ROUTES
 # =============================================
-@app.route('/admin/profile', methods=['GET'])
+@api.route('/admin/profile', methods=['GET'])
 @token_required
 def get_profile(current_user):
     """
@@ -265,11 +611,51 @@ def get_profile(current_user):
         "message": "This is a protected route"
     })
 
+@api.route('/admin/token_cache', methods=['GET'])
+@token_required
+def get_token_cache_stats(current_user):
+    """
+    Protected route that reports how often token_required was served from
+    the token cache instead of the database
+
+    Returns:
+        200: Token cache size and hit/miss counters
+        401: Invalid or missing token
+    """
+    return jsonify(token_cache.stats())
+
+@api.route('/admin/queries', methods=['GET'])
+@token_required
+def get_query_stats(current_user):
+    """
+    Protected route that reports the statements this worker spent the most
+    time on, grouped by fingerprint, and the routes showing N+1 patterns
+
+    Query parameters:
+        sort: 'total' (default), 'max', 'mean' or 'count'
+        limit: Number of fingerprints returned (default 20)
+
+    Returns:
+        200: Top fingerprints with count, total, mean and max time
+        400: Invalid sort or limit
+        401: Invalid or missing token
+    """
+    try:
+        sort, limit = payloads.query_report_params(request.args)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    report = query_profiler.stats.report(sort, limit)
+    report['slow_threshold_ms'] = current_app.config['SLOW_QUERY_THRESHOLD'] * 1000
+    return jsonify(report)
+
 # =============================================
 # TASK 6: CRUD SERVICES
 # =============================================
 # User Management Operations
-@app.route('/users', methods=['POST'])
+@api.route('/users', methods=['POST'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_USERS', key='token')
 @token_required
 def create_user(current_user):
     """
@@ -285,93 +671,188 @@ def create_user(current_user):
         409: Username already exists
     """
     try:
-        data = request.get_json()
+        try:
+            username, password = payloads.new_user(request.get_json())
+        except ValueError as e:
+            return error_response(400, str(e))
 
-        if not data or 'username' not in data or 'password' not in data:
-            return error_response(400, 'Username and password are required')
+        # Insert new user; the unique key rejects taken usernames
+        user_id = db.users.create(username, password)
+        response_cache.invalidate('users')
 
-        cursor = mysql.connection.cursor()
+        response = jsonify(payloads.created_user_document(user_id, username))
+        response.status_code = 201
+        response.set_etag(payloads.user_etag(1))
+        return response
 
-        # Check if username already exists
-        cursor.execute("SELECT * FROM midterm_database WHERE username = %s", (data['username'],))
-        if cursor.fetchone():
-            cursor.close()
-            return error_response(409, 'Username already exists')
+    except DuplicateError:
+        return error_response(409, 'Username already exists')
 
-        # Insert new user
-        cursor.execute(
-            "INSERT INTO midterm_database (username, password) VALUES (%s, %s)",
-            (data['username'], data['password'])
-        )
-        mysql.connection.commit()
-        cursor.close()
+    except Exception as e:
+        return error_response(500, str(e))
 
-        return jsonify({
-            "message": "User created successfully",
-            "username": data['username']
-        }), 201
+@api.route('/users/batch', methods=['POST'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_USERS', key='token')
+@token_required
+def create_users_batch(current_user):
+    """
+    Creates many users in one transaction
+    Accepted payloads:
+        application/json: [{"username": "string", "password": "string"}, ...]
+        application/x-ndjson: one such object per line
+    Every item is validated before anything is written; usernames that
+    already exist are reported as conflicts without aborting the batch.
+    Returns:
+        200: Per-item results plus created/conflict totals
+        400: Malformed payload or invalid items
+    """
+    try:
+        # Validate the whole batch up front
+        try:
+            if request.mimetype == 'application/x-ndjson':
+                items = payloads.ndjson_items(request.get_data(as_text=True))
+            else:
+                items = request.get_json(silent=True)
+            users = payloads.batch_users(items, current_app.config['BATCH_MAX_USERS'])
+        except ValueError as e:
+            return error_response(400, str(e))
+
+        created = db.users.create_many(users, chunk_size=current_app.config['BATCH_CHUNK_SIZE'])
+        if created:
+            response_cache.invalidate('users')
+
+        return jsonify(payloads.batch_document(users, created))
 
     except Exception as e:
         return error_response(500, str(e))
 
-@app.route('/users', methods=['GET'])
+@api.route('/users', methods=['GET'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_USERS', key='token')
 @token_required
+@cached_response('users', lambda: ['users'])
 def get_all_users(current_user):
     """
-    Retrieves all users in the system
+    Retrieves users in the system, one keyset page at a time, or searches
+    them by username for autocompletion
+    Query parameters:
+        limit: Users per page, capped at PAGE_SIZE_MAX (SEARCH_LIMIT_MAX
+            when searching)
+        after: The next_cursor of the previous page
+        q: Only the first users, by username, matching this text
+        mode: How q matches: 'prefix' (default), 'substring' or 'fuzzy'
+        fields: Comma-separated fields to return, e.g. username (all by default)
 
     Returns:
-        200: List of all users
+        200: List of users and the cursor of the next page (null on the last,
+            and for searches)
+        400: Invalid pagination, search or fields parameters
         500: Server error
     """
     try:
-        cursor = mysql.connection.cursor()
-        cursor.execute("SELECT id, username FROM midterm_database")
-        users = cursor.fetchall()
-        cursor.close()
+        fields = payloads.fields_param(request.args)
+    except ValueError as e:
+        return error_response(400, str(e))
+    columns = user_columns(fields)
+
+    if 'q' in request.args:
+        try:
+            text, mode, limit = payloads.search_params(request.args, current_app.config)
+        except ValueError as e:
+            return error_response(400, str(e))
+
+        try:
+            users = db.users.search(text, mode, limit, columns)
+            return jsonify(payloads.users_document(columns, users, fields))
 
-        user_list = []
-        for user in users:
-            user_list.append({
-                "id": user[0],
-                "username": user[1]
-            })
+        except Exception as e:
+            return error_response(500, str(e))
+
+    try:
+        after_id, limit = payloads.page_params(request.args, current_app.config)
+    except ValueError as e:
+        return error_response(400, str(e))
 
-        return jsonify({"users": user_list})
+    try:
+        users = db.users.list(after_id, limit, columns)
+        return jsonify(payloads.users_document(columns, users, fields, limit))
 
     except Exception as e:
         return error_response(500, str(e))
 
-@app.route('/users/<int:user_id>', methods=['GET'])
+@api.route('/users/export', methods=['GET'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_USERS', key='token')
+@token_required
+def export_users(current_user):
+    """
+    Streams every user for bulk syncs, straight from a server-side cursor
+    Query parameters:
+        format: 'ndjson' (default) or 'csv'
+
+    Returns:
+        200: Chunked NDJSON or CSV body of id and username
+        400: Unsupported format
+    """
+    export_format = request.args.get('format', 'ndjson')
+    try:
+        encode, header, mimetype = payloads.export_format(export_format)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    def generate():
+        if header:
+            yield header
+        for rows in db.users.export():
+            yield encode(rows)
+
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename=users.%s' % export_format
+    response.headers['X-Accel-Buffering'] = 'no'  # let proxies pass chunks through
+    return response
+
+@api.route('/users/<int:user_id>', methods=['GET'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_USERS', key='token')
 @token_required
+@cached_response('user', lambda user_id: ['user:%d' % user_id])
 def get_user(current_user, user_id):
     """
     Retrieves a specific user by ID
 
     Args:
         user_id: The ID of the user to retrieve
+    Query parameters:
+        fields: Comma-separated fields to return, e.g. username (all by default)
     Returns:
-        200: User details
+        200: User details, with an ETag of the row version
+        304: Not modified since the ETag sent in If-None-Match
+        400: Unknown field
         404: User not found
     """
     try:
-        cursor = mysql.connection.cursor()
-        cursor.execute("SELECT id, username FROM midterm_database WHERE id = %s", (user_id,))
-        user = cursor.fetchone()
-        cursor.close()
+        fields = payloads.fields_param(request.args)
+    except ValueError as e:
+        return error_response(400, str(e))
+    columns = user_columns(fields)
+
+    try:
+        user = db.users.get(user_id, columns)
 
         if not user:
             return error_response(404, 'User not found')
 
-        return jsonify({
-            "id": user[0],
-            "username": user[1]
-        })
+        response = jsonify(payloads.user_document(columns, user, fields))
+        response.set_etag(payloads.user_etag(user[-1]))
+        return response.make_conditional(request)
 
     except Exception as e:
         return error_response(500, str(e))
 
-@app.route('/users/<int:user_id>', methods=['PUT'])
+@api.route('/users/<int:user_id>', methods=['PUT'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_USERS', key='token')
 @token_required
 def update_user(current_user, user_id):
     """
@@ -381,52 +862,47 @@ def update_user(current_user, user_id):
         "username": "string" (optional),
         "password": "string" (optional)
     }
+    Optional header:
+        If-Match: ETag from GET /users/<id>; the update only applies to that version
     Returns:
         200: User updated successfully
         400: Invalid input
         404: User not found
+        409: Username already exists
+        412: User was modified since the ETag in If-Match
     """
     try:
-        data = request.get_json()
-
-        if not data:
-            return error_response(400, 'No data provided')
+        versions = payloads.if_match_versions(request.if_match)
+    except ValueError as e:
+        return error_response(412, str(e))
 
-        cursor = mysql.connection.cursor()
+    try:
+        try:
+            data = payloads.user_changes(request.get_json())
+        except ValueError as e:
+            return error_response(400, str(e))
 
-        # Check if user exists
-        cursor.execute("SELECT * FROM midterm_database WHERE id = %s", (user_id,))
-        if not cursor.fetchone():
-            cursor.close()
+        # Update user information in one statement; the affected row
+        # count tells whether the user exists
+        if not db.users.update(user_id, data, versions):
             return error_response(404, 'User not found')
+        invalidate_user(user_id)
+        revocations.refresh(force=True)
 
-        # Update user information
-        update_query = "UPDATE midterm_database SET "
-        update_params = []
-
-        if 'username' in data:
-            update_query += "username = %s"
-            update_params.append(data['username'])
-
-        if 'password' in data:
-            if 'username' in data:
-                update_query += ", "
-            update_query += "password = %s"
-            update_params.append(data['password'])
-
-        update_query += " WHERE id = %s"
-        update_params.append(user_id)
+        return jsonify({"message": "User updated successfully"})
 
-        cursor.execute(update_query, tuple(update_params))
-        mysql.connection.commit()
-        cursor.close()
+    except VersionMismatch:
+        return error_response(412, 'Precondition Failed')
 
-        return jsonify({"message": "User updated successfully"})
+    except DuplicateError:
+        return error_response(409, 'Username already exists')
 
     except Exception as e:
         return error_response(500, str(e))
 
-@app.route('/users/<int:user_id>', methods=['DELETE'])
+@api.route('/users/<int:user_id>', methods=['DELETE'])
+@limiter.limit('RATELIMIT_IP', key='ip')
+@limiter.limit('RATELIMIT_USERS', key='token')
 @token_required
 def delete_user(current_user, user_id):
     """
@@ -434,80 +910,234 @@ def delete_user(current_user, user_id):
 
     Args:
         user_id: The ID of the user to delete
+    Optional header:
+        If-Match: ETag from GET /users/<id>; only that version is deleted
     Returns:
         200: User deleted successfully
         404: User not found
+        412: User was modified since the ETag in If-Match
     """
     try:
-        cursor = mysql.connection.cursor()
+        versions = payloads.if_match_versions(request.if_match)
+    except ValueError as e:
+        return error_response(412, str(e))
 
-        # Check if user exists
-        cursor.execute("SELECT * FROM midterm_database WHERE id = %s", (user_id,))
-        if not cursor.fetchone():
-            cursor.close()
+    try:
+        # Delete user in one statement; the affected row count tells
+        # whether the user existed
+        if not db.users.delete(user_id, versions):
             return error_response(404, 'User not found')
-
-        # Delete user
-        cursor.execute("DELETE FROM midterm_database WHERE id = %s", (user_id,))
-        mysql.connection.commit()
-        cursor.close()
+        invalidate_user(user_id)
+        revocations.refresh(force=True)
 
         return jsonify({"message": "User deleted successfully"})
 
+    except VersionMismatch:
+        return error_response(412, 'Precondition Failed')
+
     except Exception as e:
         return error_response(500, str(e))
 
 # File CRUD Operations
-@app.route('/files', methods=['GET'])
+@api.route('/files', methods=['GET'])
 @token_required
+@cached_response('files', lambda: ['files'])
 def get_all_files(current_user):
     """
-    Lists all files in the upload directory
-    Returns file metadata including name, size, and upload date
+    Lists the files in the upload directory from the file index, one
+    keyset page at a time
+    Returns file metadata including name, size, upload date, content type
+    and SHA-256
+    Query parameters:
+        sort: 'name' (default), 'size' or 'uploaded_at'
+        order: 'asc' (default) or 'desc'
+        ext: Only files with this extension
+        min_size, max_size: Inclusive size bounds in bytes
+        since, until: Inclusive upload time bounds, UTC unless given an
+            offset (YYYY-MM-DD, a whole day for until, or ISO 8601)
+        limit: Files per page, capped at PAGE_SIZE_MAX
+        after: The next_cursor of the previous page
 
     Returns:
-        200: List of file information
+        200: List of file information and the cursor of the next page
+        400: Invalid query parameters
         500: Server error
     """
     try:
-        files = []
-        for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            files.append({
-                "filename": filename,
-                "size": os.path.getsize(file_path),
-                "uploaded_at": datetime.datetime.fromtimestamp(
-                    os.path.getctime(file_path)
-                ).strftime('%Y-%m-%d %H:%M:%S')
-            })
-
-        return jsonify({"files": files})
+        sort, descending, after, limit, filters = payloads.file_list_params(request.args, current_app.config)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    try:
+        files, next_key = file_store.list(sort, descending, after, limit, **filters)
+        statuses = job_queue.statuses(file['sha256'] for file in files)
+        return jsonify(payloads.files_document(files, statuses, sort, descending, next_key))
 
     except Exception as e:
         return error_response(500, str(e))
 
-@app.route('/files/<filename>', methods=['GET'])
+@api.route('/files/archive', methods=['GET', 'POST'])
+@token_required
+def get_archive(current_user):
+    """
+    Downloads several files as one ZIP archive, built while it is sent so
+    the first bytes leave immediately and memory use stays flat whatever
+    the total size. Text files are deflated; images, PDFs and other
+    already compressed types are stored as they are.
+    Files are named with ?names=a.txt,b.png (or repeated names=) on GET,
+    or a JSON payload on POST:
+    {
+        "names": ["a.txt", "b.png"]
+    }
+
+    Returns:
+        200: The ZIP archive
+        400: No names, a path instead of a name, or more than ARCHIVE_MAX_FILES
+        404: Some of the files do not exist, before any byte is sent
+    """
+    data = request.get_json(silent=True) if request.method == 'POST' else None
+    try:
+        names = payloads.archive_names(request.method, data, request.args,
+                                       current_app.config['ARCHIVE_MAX_FILES'])
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    try:
+        entries = payloads.archive_entries(names, file_store)
+    except LookupError as e:
+        return error_response(404, str(e))
+
+    response = Response(stream_zip(entries), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename=files.zip'
+    response.headers['X-Accel-Buffering'] = 'no'  # let proxies pass chunks through
+    return response
+
+def send_precompressed(meta):
+    """
+    Sends the compressed variant of a stored file that best matches
+    Accept-Encoding, so downloads never pay for compression per request
+    Args:
+        meta (dict): Indexed metadata of the file
+    Returns:
+        Response: The variant, or None to send the file as it is
+    """
+    variant = payloads.precompressed_variant(meta, request.headers, request.accept_encodings, file_store)
+    if variant is None:
+        return None
+    encoding, path = variant
+
+    response = send_file(
+        path,
+        mimetype=meta['content_type'],
+        as_attachment=True,
+        download_name=meta['filename'],
+        conditional=True,
+        etag='%s-%s' % (meta['sha256'], encoding)
+    )
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Accept-Ranges'] = 'none'
+    response.vary.add('Accept-Encoding')
+    return response
+
+@api.route('/files/<filename>', methods=['GET'])
 @token_required
 def get_file(current_user, filename):
     """
     Downloads a specific file
+    Supports Range/If-Range for partial and resumed downloads, with the
+    file's SHA-256 as a strong ETag, and hands the transfer to the fronting
+    proxy when FILE_OFFLOAD is set
+    Text files are sent precompressed when the client accepts one of the
+    variants process-files made of them
 
     Args:
         filename: Name of the file to download
         Returns:
         200: File download
+        206: Requested byte range
+        304: Not modified since the ETag in If-None-Match
         404: File not found
+        416: Range not satisfiable
     """
+    if filename.startswith('.'):
+        return error_response(404, 'File not found')  # store internals
+
     try:
+        meta = file_store.get(filename)
+
+        response = send_precompressed(meta)
+        if response is not None:
+            return response
+
+        if meta is not None and current_app.config['FILE_OFFLOAD'] == 'x-accel-redirect':
+            # nginx serves the bytes, including ranges, from an internal
+            # location; the worker is free as soon as the headers are out
+            response = Response(mimetype=meta['content_type'] or 'application/octet-stream',
+                                headers=payloads.accel_headers(filename, current_app.config))
+            response.set_etag(meta['sha256'])
+            return response
+
         return send_from_directory(
-            app.config['UPLOAD_FOLDER'],
+            current_app.config['UPLOAD_FOLDER'],
             filename,
-            as_attachment=True
+            as_attachment=True,
+            conditional=True,
+            etag=meta['sha256'] if meta is not None else True
         )
-    except Exception as e:
+    except RequestedRangeNotSatisfiable as e:
+        response = error_response(416, 'Range Not Satisfiable')
+        if e.length is not None:
+            response.headers['Content-Range'] = '%s */%d' % (e.units, e.length)
+        return response
+    except (FileNotFoundError, NotFound):
+        return error_response(404, 'File not found')
+
+@api.route('/files/<filename>/processing', methods=['GET'])
+@token_required
+def get_file_processing(current_user, filename):
+    """
+    Reports the post-upload processing of a file: checksums, sniffed MIME
+    type and the derived artifacts once done
+
+    Args:
+        filename: Name of the file
+    Returns:
+        200: Job status ('queued', 'running', 'done' or 'failed'), attempts,
+            last error and result
+        404: File not found, or never queued for processing
+    """
+    meta = file_store.get(filename) if not filename.startswith('.') else None
+    if meta is None:
+        return error_response(404, 'File not found')
+
+    job = job_queue.get(meta['sha256'])
+    if job is None:
+        return error_response(404, 'File was not processed')
+    return jsonify(payloads.job_document(job, meta))
+
+@api.route('/files/<filename>/derived/<artifact>', methods=['GET'])
+@token_required
+def get_file_artifact(current_user, filename, artifact):
+    """
+    Downloads an artifact derived from a file, e.g. thumbnail.png or text.txt
+
+    Args:
+        filename: Name of the original file
+        artifact: Name listed in the result of /files/<filename>/processing
+    Returns:
+        200: The artifact
+        404: File or artifact not found
+    """
+    meta = file_store.get(filename) if not filename.startswith('.') else None
+    if meta is None:
         return error_response(404, 'File not found')
 
-@app.route('/files/<filename>', methods=['DELETE'])
+    if not payloads.has_artifact(job_queue.get(meta['sha256']), artifact):
+        return error_response(404, 'Artifact not found')
+    return send_from_directory(file_store.derived_path(meta['sha256']), artifact,
+                               conditional=True, etag=meta['sha256'] + '-' + artifact)
+
+@api.route('/files/<filename>', methods=['DELETE'])
 @token_required
 def delete_file(current_user, filename):
     """
@@ -519,17 +1149,50 @@ def delete_file(current_user, filename):
         200: File deleted successfully
         404: File not found
     """
+    if filename.startswith('.'):
+        return error_response(404, 'File not found')  # store internals
+
     try:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if not os.path.exists(file_path):
+        # The stored content goes once no other name refers to it
+        if not file_store.remove(filename):
             return error_response(404, 'File not found')
+        response_cache.invalidate('files')
 
-        os.remove(file_path)
         return jsonify({"message": "File deleted successfully"})
 
     except Exception as e:
         return error_response(500, str(e))
 
+@api.cli.command('reindex-files')
+def reindex_files():
+    """
+    Reconciles the file index with the upload directory after files were
+    added, changed or removed outside the API
+    """
+    counts = file_store.reconcile()
+    if any(counts.values()):
+        response_cache.invalidate('files')  # reaches the running workers through the tag versions
+    print("Files added: %(added)d, updated: %(updated)d, removed: %(removed)d" % counts)
+
+@api.cli.command('process-files')
+@click.option('--processes', type=int, help='Pool size (default: JOBS_PROCESSES or the CPU count)')
+@click.option('--once', is_flag=True, help='Exit when no job is due instead of waiting for more')
+def process_files(processes, once):
+    """
+    Runs the post-upload processing jobs queued by the upload routes:
+    checksums, MIME sniffing, thumbnails and text extraction
+    """
+    worker = Worker(job_queue, processes or current_app.config['JOBS_PROCESSES'], precompress=(
+        current_app.config['PRECOMPRESS_LEVELS'],
+        current_app.config['PRECOMPRESS_MIN_SIZE'],
+        current_app.config['PRECOMPRESS_MAX_SIZE']
+    ))
+    try:
+        counts = worker.run(once)
+    except KeyboardInterrupt:
+        counts = worker.counts  # interrupted jobs are retried once their lease expires
+    print("Jobs done: %(done)d, retried: %(retried)d, failed: %(failed)d" % counts)
+
 # =============================================
 # TASK 2: ERROR HANDLERS
 # =============================================
@@ -544,7 +1207,7 @@ Error Handler Overview:
 429 - Too Many Requests: Rate limit exceeded
 """
 
-@app.errorhandler(400)
+@api.app_errorhandler(400)
 def bad_request_error(error):
     """
     Handles Bad Request errors
@@ -552,7 +1215,7 @@ def bad_request_error(error):
     """
     return error_response(400, "Bad Request")
 
-@app.errorhandler(401)
+@api.app_errorhandler(401)
 def unauthorized_error(error):
     """
     Handles Unauthorized errors
@@ -560,7 +1223,7 @@ def unauthorized_error(error):
     """
     return error_response(401, "Unauthorized")
 
-@app.errorhandler(403)
+@api.app_errorhandler(403)
 def forbidden_error(error):
     """
     Handles Forbidden errors
@@ -568,7 +1231,7 @@ def forbidden_error(error):
     """
     return error_response(403, "Forbidden")
 
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found_error(error):
     """
     Handles Not Found errors
@@ -576,7 +1239,7 @@ def not_found_error(error):
     """
     return error_response(404, "Page Not Found")
 
-@app.errorhandler(406)
+@api.app_errorhandler(406)
 def not_acceptable_error(error):
     """
     Handles Not Acceptable errors
@@ -584,7 +1247,7 @@ def not_acceptable_error(error):
     """
     return error_response(406, "Not Acceptable")
 
-@app.errorhandler(415)
+@api.app_errorhandler(415)
 def unsupported_media_error(error):
     """
     Handles Unsupported Media Type errors
@@ -592,13 +1255,23 @@ def unsupported_media_error(error):
     """
     return error_response(415, "Unsupported Media Type")
 
-@app.errorhandler(429)
+@api.app_errorhandler(429)
 def too_many_requests_error(error):
     """
     Handles Too Many Requests errors
     Returns standardized error response for rate limiting
+    (RateLimit-* and Retry-After headers are added by the limiter)
     """
     return error_response(429, "Too Many Requests")
 
 if __name__ == "__main__":
-    app.run(debug=True, port=5001)
+    app = create_app()
+    # The reloader runs this again in its child; only the parent starts the worker
+    worker = None
+    if app.config['JOBS_WORKER'] and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        worker = spawn_worker()
+    try:
+        app.run(debug=True, port=5001)
+    finally:
+        if worker is not None:
+            stop_worker(worker)
@@ -0,0 +1,433 @@
+import fcntl
+import glob
+import ipaddress
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+from flask import Response, current_app, g, has_request_context, request
+
+# =============================================
+# METRICS
+# =============================================
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+EXPOSITION_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metric:
+    """
+    One labelled counter, gauge or histogram of a Registry
+    Args:
+        name (str): Prometheus metric name
+        kind (str): 'counter', 'gauge' or 'histogram'
+        help (str): Description shown in the exposition
+        labels (tuple): Label names, in the order values are stored
+        buckets (tuple): Upper bounds of a histogram's buckets
+        lock (threading.Lock): Lock of the owning registry
+    """
+    def __init__(self, name, kind, help, labels, buckets, lock):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = lock
+        self._values = {}  # label values -> number, or histogram counts + [sum, count]
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        """
+        Sets a gauge, or a counter whose total is kept elsewhere (e.g. cache hits)
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), list(value) if isinstance(value, list) else value]
+                    for key, value in self._values.items()]
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+
+class Registry:
+    """
+    Metrics of one process
+    """
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labels=()):
+        return self._add(name, 'counter', help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._add(name, 'gauge', help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(name, 'histogram', help, labels, buckets)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: JSON-serializable state of every metric
+        """
+        return {
+            name: {
+                "type": metric.kind,
+                "help": metric.help,
+                "labels": list(metric.labels),
+                "buckets": list(metric.buckets or ()),
+                "samples": metric.samples()
+            }
+            for name, metric in self.metrics.items()
+        }
+
+    def _add(self, name, kind, help, labels, buckets=None):
+        # Declaring a metric again returns the existing one
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = Metric(name, kind, help, tuple(labels), buckets, self._lock)
+            return self.metrics[name]
+
+
+# =============================================
+# AGGREGATION ACROSS WORKERS
+# =============================================
+def merge(snapshots, gauges=True):
+    """
+    Sums the snapshots of several processes sample by sample
+    Args:
+        snapshots (list): Registry.snapshot() results
+        gauges (bool): Include gauges; left out for exited processes
+    Returns:
+        dict: A snapshot holding the totals
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            if metric['type'] == 'gauge' and not gauges:
+                continue
+            target = merged.setdefault(name, dict(metric, samples={}))
+            for labels, value in metric['samples']:
+                key = tuple(labels)
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = value
+                elif isinstance(value, list):
+                    target['samples'][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target['samples'][key] = current + value
+    for metric in merged.values():
+        metric['samples'] = [[list(key), value] for key, value in metric['samples'].items()]
+    return merged
+
+
+def render(snapshot):
+    """
+    Formats a snapshot in the Prometheus text exposition format
+    Returns:
+        str: The exposition
+    """
+    lines = []
+    for name in sorted(snapshot):
+        metric = snapshot[name]
+        lines.append('# HELP %s %s' % (name, metric['help']))
+        lines.append('# TYPE %s %s' % (name, metric['type']))
+        for labels, value in sorted(metric['samples']):
+            pairs = list(zip(metric['labels'], labels))
+            if metric['type'] != 'histogram':
+                lines.append('%s%s %s' % (name, _labels(pairs), _number(value)))
+                continue
+            cumulative = 0
+            for bound, count in zip(metric['buckets'], value):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (name, _labels(pairs + [('le', _number(bound))]), cumulative))
+            lines.append('%s_bucket%s %d' % (name, _labels(pairs + [('le', '+Inf')]), value[-1]))
+            lines.append('%s_sum%s %s' % (name, _labels(pairs), _number(value[-2])))
+            lines.append('%s_count%s %d' % (name, _labels(pairs), value[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+
+
+def _number(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+class SnapshotDirectory:
+    """
+    Directory where every worker process publishes its latest snapshot, so
+    whichever worker serves /metrics reports the totals of all of them.
+    Snapshots of exited workers are folded into an archive file, keeping
+    their counters without keeping one file per recycled worker.
+    Args:
+        path (str): Directory shared by the workers of the host
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, snapshot):
+        target = os.path.join(self.path, 'worker-%d.json' % os.getpid())
+        fd, temp = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(temp, target)
+
+    def collect(self):
+        """
+        Returns:
+            dict: Totals of the live workers, the archive and exited workers
+        """
+        live = []
+        with open(os.path.join(self.path, 'archive.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive = self._read(os.path.join(self.path, 'archive.json')) or {}
+            exited = []
+            for path in glob.glob(os.path.join(self.path, 'worker-*.json')):
+                snapshot = self._read(path)
+                if snapshot is None:
+                    continue
+                pid = int(os.path.basename(path)[7:-5])
+                if _alive(pid):
+                    live.append(snapshot)
+                else:
+                    exited.append((path, snapshot))
+
+            if exited:
+                archive = merge([archive] + [snapshot for _, snapshot in exited], gauges=False)
+                fd, temp = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(archive, f)
+                os.replace(temp, os.path.join(self.path, 'archive.json'))
+                for path, _ in exited:
+                    os.remove(path)
+        return merge([archive] + live)
+
+    def clear(self):
+        """
+        Removes every snapshot, e.g. when the server starts
+        """
+        for path in glob.glob(os.path.join(self.path, '*.json')):
+            os.remove(path)
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def default_directory():
+    folder = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(folder, 'flask_api_metrics')
+
+
+def scrape_allowed(address, networks):
+    """
+    Tells whether a client may read /metrics
+    Args:
+        address (str): IP address of the client
+        networks (tuple): Networks allowed to scrape, e.g. '10.0.0.0/8';
+            None allows everyone
+    Returns:
+        bool: True if the address belongs to one of the networks
+    """
+    if networks is None:
+        return True
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in networks)
+
+
+# =============================================
+# FLASK EXTENSION
+# =============================================
+class Metrics:
+    """
+    Flask extension timing every request and exposing the totals of all
+    worker processes in the Prometheus format
+    Recorded per route (the URL rule, so IDs do not multiply the series):
+    latency histograms, status counters, in-flight requests, request and
+    response bytes, and the number and duration of database statements.
+    Configuration:
+        METRICS_DIR: Directory shared by the workers for their snapshots
+        METRICS_FLUSH_INTERVAL: Seconds between two snapshots of a worker
+    """
+    def __init__(self, app=None):
+        self._collectors = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        registry = Registry()
+        state = _State(
+            registry,
+            SnapshotDirectory(app.config.get('METRICS_DIR') or default_directory()),
+            app.config.get('METRICS_FLUSH_INTERVAL', 1.0)
+        )
+        state.requests = registry.counter(
+            'http_requests_total', 'Requests answered', ('method', 'route', 'status'))
+        state.latency = registry.histogram(
+            'http_request_duration_seconds', 'Time to produce the response', ('method', 'route'))
+        state.in_flight = registry.gauge(
+            'http_requests_in_flight', 'Requests being processed')
+        state.request_bytes = registry.counter(
+            'http_request_bytes_total', 'Request body bytes received', ('route',))
+        state.response_bytes = registry.counter(
+            'http_response_bytes_total', 'Response body bytes sent, when known up front', ('route',))
+        state.queries = registry.histogram(
+            'db_queries_per_request', 'Database statements run by a request', ('route',),
+            QUERY_COUNT_BUCKETS)
+        state.query_time = registry.histogram(
+            'db_time_per_request_seconds', 'Time a request spent in database statements', ('route',))
+        state.query_duration = registry.histogram(
+            'db_query_duration_seconds', 'Duration of database statements', ('operation',))
+        app.extensions['metrics'] = state
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions.setdefault('query_observers', []).append(self._observe_query)
+
+    def collector(self, f):
+        """
+        Registers a function called with the registry before each snapshot,
+        to copy in values kept elsewhere (cache counters, pool sizes)
+        """
+        self._collectors.append(f)
+        return f
+
+    @property
+    def registry(self):
+        return current_app.extensions['metrics'].registry
+
+    def expose(self):
+        """
+        Returns:
+            Response: The totals of every worker, in the Prometheus text format
+        """
+        state = current_app.extensions['metrics']
+        self._flush(state)
+        return Response(render(state.directory.collect()), content_type=EXPOSITION_TYPE)
+
+    def _before_request(self):
+        self._start(current_app.extensions['metrics'], g)
+
+    def _after_request(self, response):
+        state = current_app.extensions['metrics']
+        self._record(state, g, request, response)
+        if time.monotonic() >= state.next_flush:
+            self._flush(state)
+        return response
+
+    def _teardown_request(self, error):
+        self._finish(current_app.extensions['metrics'], g)
+
+    def _observe_query(self, query, seconds):
+        self._record_query(current_app.extensions['metrics'], g if has_request_context() else None,
+                           query, seconds)
+
+    def _start(self, state, g):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = [0, 0.0]
+        state.in_flight.inc()
+
+    def _record(self, state, g, request, response):
+        start = getattr(g, 'metrics_start', None)
+        if start is None:
+            return
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+
+        state.requests.inc(method=request.method, route=route, status=response.status_code)
+        state.latency.observe(time.perf_counter() - start, method=request.method, route=route)
+        if request.content_length:
+            state.request_bytes.inc(request.content_length, route=route)
+        if response.content_length:
+            state.response_bytes.inc(response.content_length, route=route)
+        count, seconds = g.metrics_queries
+        state.queries.observe(count, route=route)
+        if count:
+            state.query_time.observe(seconds, route=route)
+
+    def _finish(self, state, g):
+        if getattr(g, 'metrics_start', None) is not None:
+            state.in_flight.dec()
+
+    def _record_query(self, state, g, query, seconds):
+        # g is None outside of requests, e.g. in CLI commands
+        state.query_duration.observe(seconds, operation=query.split(None, 1)[0].upper())
+        if g is not None and hasattr(g, 'metrics_queries'):
+            g.metrics_queries[0] += 1
+            g.metrics_queries[1] += seconds
+
+    def _flush(self, state):
+        state.next_flush = time.monotonic() + state.flush_interval
+        for collect in self._collectors:
+            collect(state.registry)
+        try:
+            state.directory.write(state.registry.snapshot())
+        except OSError:
+            pass  # metrics must never fail a request; retried next flush
+
+
+class _State:
+    """
+    Per-application metrics, kept in app.extensions['metrics']
+    """
+    def __init__(self, registry, directory, flush_interval):
+        self.registry = registry
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.next_flush = 0.0
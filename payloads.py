@@ -0,0 +1,684 @@
+import csv
+import datetime
+import io
+import json
+import os
+from urllib.parse import quote
+
+import jwt
+
+from compression import VARIANT_NAMES, is_compressible, negotiate
+from cursors import decode_cursor, decode_file_cursor, encode_cursor, encode_file_cursor
+from db import SEARCH_MODES, USER_FIELDS
+from ratelimit import bearer_token
+
+# =============================================
+# REQUEST PARSING AND RESPONSE DOCUMENTS
+# =============================================
+"""
+What the API reads from requests and writes in responses, shared by the
+WSGI app (main.py) and the ASGI app (asgi.py) so both answer alike. The
+functions take the request's args and headers, which Flask and Quart both
+expose as werkzeug structures, and the app config, and return plain values
+or documents to serialize; each app keeps only how it awaits I/O, streams
+and builds responses.
+Invalid input raises ValueError carrying the message sent to the client.
+"""
+SAMPLE_USERS = [
+    ('emmanuel_montoya', 'em12345'),
+    ('renzo_salosagcol', 'rs12345'),
+    ('anthony_weathersby', 'aw12345'),
+    ('alice_johnson', 'aj12345'),
+    ('brian_smith', 'bs12345'),
+    ('carla_brown', 'cb12345'),
+    ('david_taylor', 'dt12345'),
+    ('emily_davis', 'ed12345'),
+    ('frank_wilson', 'fw12345'),
+    ('grace_martinez', 'gm12345')
+]
+
+PUBLIC_ITEMS = [
+    {"id": 1, "name": "Public Item 1", "description": "This is a public item"},
+    {"id": 2, "name": "Public Item 2", "description": "This is another public item"}
+]
+
+FILE_SORTS = ('name', 'size', 'uploaded_at')
+QUERY_SORTS = ('total', 'max', 'mean', 'count')
+USER_CHANGES = ('username', 'password')  # what PUT /users/<id> may set
+
+def format_time(timestamp):
+    """
+    Returns:
+        str: A Unix time as shown in file and job documents
+    """
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+# Authentication
+def issue_token(username, user, config):
+    """
+    Signs the token returned by /login
+    Args:
+        username (str): Name the client logged in with
+        user (tuple): (id, version) of the user
+        config (dict): App configuration
+    Returns:
+        str: The JWT
+    """
+    claims = {
+        'username': username,
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=config['JWT_EXPIRATION'])
+    }
+    if config['JWT_STATELESS']:
+        # Everything token_required needs, so no lookup happens per request
+        claims['uid'] = user[0]
+        claims['ver'] = user[1]
+    return jwt.encode(claims, config['SECRET_KEY'])
+
+def request_token(header):
+    """
+    Args:
+        header (str): Authorization header, possibly None
+    Returns:
+        str: The bearer token
+    Raises:
+        ValueError: Missing header, or no token after the scheme
+    """
+    if not header:
+        raise ValueError('Token is missing')
+    token = bearer_token(header)
+    if token is None:
+        raise ValueError('Invalid token')
+    return token
+
+def decode_token(token, config):
+    """
+    Returns:
+        dict: Claims of a token signed by issue_token
+    Raises:
+        jwt.InvalidTokenError: Forged, malformed or expired token
+    """
+    return jwt.decode(token, config['SECRET_KEY'], algorithms=["HS256"])
+
+def stateless_user(claims, config, revocations):
+    """
+    Reads the user a stateless token carries, checking only revocation
+    Args:
+        claims (dict): Claims of the token
+        config (dict): App configuration
+        revocations (RevocationList): Users changed since tokens were issued
+    Returns:
+        tuple: (id, username, version), or None when the user must be looked
+            up by claims['username']
+    Raises:
+        jwt.InvalidTokenError: The user changed since the token was issued
+    """
+    if not config['JWT_STATELESS'] or 'uid' not in claims:
+        return None
+    if revocations.is_revoked(claims['uid'], claims['ver']):
+        raise jwt.InvalidTokenError('Token revoked')
+    return (claims['uid'], claims['username'], claims['ver'])
+
+# Query parameters
+def int_param(args, name, default=None, minimum=0):
+    """
+    Reads an integer query parameter
+    Returns:
+        int: The value, or default when the parameter is absent
+    Raises:
+        ValueError: Not an integer, or below minimum
+    """
+    value = args.get(name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        number = None
+    if number is None or number < minimum:
+        raise ValueError('%s must be a %s integer' % (name, 'positive' if minimum > 0 else 'non-negative'))
+    return number
+
+def time_param(args, name, end_of_day=False):
+    """
+    Reads a date (YYYY-MM-DD) or ISO 8601 time query parameter, in UTC
+    unless it carries an offset
+    Args:
+        end_of_day (bool): Read a bare date as its last instant rather than
+            its first, for inclusive upper bounds
+    Returns:
+        float: The UNIX timestamp, or None when the parameter is absent
+    Raises:
+        ValueError: Neither a date nor a time
+    """
+    value = args.get(name)
+    if value is None:
+        return None
+    try:
+        day = datetime.date.fromisoformat(value)
+    except ValueError:
+        try:
+            moment = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError('%s must be a date (YYYY-MM-DD) or an ISO 8601 time' % name)
+    else:
+        moment = datetime.datetime.combine(day, datetime.time.max if end_of_day else datetime.time.min)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp()
+
+def page_params(args, config):
+    """
+    Reads the ?limit= and ?after= keyset pagination parameters
+    Returns:
+        tuple: (after_id, limit), limit clamped to PAGE_SIZE_MAX
+    Raises:
+        ValueError: Malformed limit or cursor
+    """
+    limit = min(int_param(args, 'limit', config['PAGE_SIZE_DEFAULT'], minimum=1), config['PAGE_SIZE_MAX'])
+
+    after = args.get('after')
+    if not after:
+        return 0, limit
+    return decode_cursor(after), limit
+
+def search_params(args, config):
+    """
+    Reads the ?q=, ?mode= and ?limit= username search parameters
+    Returns:
+        tuple: (text, mode, limit), limit clamped to SEARCH_LIMIT_MAX
+    Raises:
+        ValueError: Empty search, unknown or disabled mode, text too short
+            for a scanning mode, or malformed limit
+    """
+    text = args.get('q', '')
+    if not text:
+        raise ValueError('q must not be empty')
+
+    modes = [mode for mode in SEARCH_MODES if mode in config['SEARCH_MODES_ENABLED']]
+    mode = args.get('mode', 'prefix')
+    if mode not in modes:
+        raise ValueError('mode must be one of %s' % ', '.join(modes))
+    if mode != 'prefix' and len(text) < config['SEARCH_SCAN_MIN_LENGTH']:
+        raise ValueError('q must be at least %d characters for %s searches'
+                         % (config['SEARCH_SCAN_MIN_LENGTH'], mode))
+
+    limit = int_param(args, 'limit', config['SEARCH_LIMIT_DEFAULT'], minimum=1)
+    return text, mode, min(limit, config['SEARCH_LIMIT_MAX'])
+
+def fields_param(args):
+    """
+    Reads the ?fields= sparse fieldset, e.g. ?fields=username
+    Returns:
+        tuple: Requested fields, all of USER_FIELDS when absent
+    Raises:
+        ValueError: Unknown field
+    """
+    value = args.get('fields')
+    if not value:
+        return USER_FIELDS
+    fields = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    if not fields or any(name not in USER_FIELDS for name in fields):
+        raise ValueError('fields must be among %s' % ', '.join(USER_FIELDS))
+    return fields
+
+def file_list_params(args, config):
+    """
+    Reads the sort, filter and pagination parameters of GET /files
+    Returns:
+        tuple: (sort, descending, after, limit, filters), after being the
+            decoded cursor or None and filters the keyword arguments of
+            FileStore.list
+    Raises:
+        ValueError: Unknown sort or order, malformed bound, limit or cursor
+    """
+    sort = args.get('sort', 'name')
+    order = args.get('order', 'asc')
+    if sort not in FILE_SORTS or order not in ('asc', 'desc'):
+        raise ValueError('Invalid sort or order')
+    descending = order == 'desc'
+
+    limit = min(int_param(args, 'limit', config['PAGE_SIZE_DEFAULT'], minimum=1), config['PAGE_SIZE_MAX'])
+
+    after = args.get('after')
+    after = decode_file_cursor(after, sort, descending) if after else None
+
+    filters = {
+        'min_size': int_param(args, 'min_size'),
+        'max_size': int_param(args, 'max_size'),
+        'since': time_param(args, 'since'),
+        'until': time_param(args, 'until', end_of_day=True)
+    }
+    filters = {name: value for name, value in filters.items() if value is not None}
+    if args.get('ext'):
+        filters['extension'] = args['ext'].lower().lstrip('.')
+    return sort, descending, after, limit, filters
+
+def query_report_params(args):
+    """
+    Reads the ?sort= and ?limit= parameters of GET /admin/queries
+    Returns:
+        tuple: (sort, limit)
+    Raises:
+        ValueError: Unknown sort or malformed limit
+    """
+    sort = args.get('sort', 'total')
+    if sort not in QUERY_SORTS:
+        raise ValueError('sort must be total, max, mean or count')
+    return sort, int_param(args, 'limit', 20, minimum=1)
+
+def if_match_versions(if_match):
+    """
+    Reads the row versions a conditional write is allowed to apply to
+    Args:
+        if_match (ETags): The request's parsed If-Match header
+    Returns:
+        list: Versions named in If-Match, or None when the write is
+            unconditional (no header or "*")
+    Raises:
+        ValueError: If-Match names no entity tag this API issued
+    """
+    if not if_match or if_match.star_tag:
+        return None
+    versions = []
+    for tag in if_match.as_set():
+        if tag.startswith('v') and tag[1:].isdigit():
+            versions.append(int(tag[1:]))
+    if not versions:
+        raise ValueError('Precondition Failed')
+    return versions
+
+# Users
+def user_document(columns, row, fields):
+    """
+    Returns:
+        dict: The requested fields of a user row selected with columns
+    """
+    return {name: value for name, value in zip(columns, row) if name in fields}
+
+def user_etag(version):
+    """
+    Builds the entity tag of a user row
+    Args:
+        version (int): Row version of the user
+    Returns:
+        str: Unquoted ETag value
+    """
+    return 'v%d' % version
+
+def users_document(columns, users, fields, limit=None):
+    """
+    Args:
+        columns (tuple): Columns the rows were selected with
+        users (list): User rows
+        fields (tuple): Fields the client asked for
+        limit (int): Page size, None for search results, which have no
+            next page
+    Returns:
+        dict: The users and the cursor of the next page, null on the last
+    """
+    next_cursor = None
+    if limit is not None and len(users) == limit:
+        next_cursor = encode_cursor(users[-1][0])
+    return {"users": [user_document(columns, user, fields) for user in users], "next_cursor": next_cursor}
+
+def table_page(row_headers, rows, fields, base_url, limit):
+    """
+    Args:
+        row_headers (list): Columns the rows were selected with
+        rows (list): Rows of the page
+        fields (tuple): Fields the client asked for
+        base_url (str): URL of the route, for the next page's link
+        limit (int): Page size
+    Returns:
+        tuple: (list of row documents, Link header of the next page or None)
+    """
+    link = None
+    if len(rows) == limit:
+        link = '<%s?limit=%d&after=%s%s>; rel="next"' % (
+            base_url, limit, encode_cursor(rows[-1][0]),
+            '' if fields == USER_FIELDS else '&fields=' + ','.join(fields))
+    return [user_document(row_headers, row, fields) for row in rows], link
+
+def new_user(data):
+    """
+    Validates the payload of POST /users
+    Returns:
+        tuple: (username, password)
+    Raises:
+        ValueError: Missing username or password
+    """
+    if not data or 'username' not in data or 'password' not in data:
+        raise ValueError('Username and password are required')
+    return data['username'], data['password']
+
+def created_user_document(user_id, username):
+    """
+    Returns:
+        dict: Body of a 201 from POST /users
+    """
+    return {
+        "message": "User created successfully",
+        "id": user_id,
+        "username": username
+    }
+
+def user_changes(data):
+    """
+    Validates the payload of PUT /users/<id>
+    Returns:
+        dict: The changes
+    Raises:
+        ValueError: Not an object, unknown field, neither username nor
+            password given, or a value that is not a non-empty string
+    """
+    if not data:
+        raise ValueError('No data provided')
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object')
+    unknown = sorted(set(data) - set(USER_CHANGES))
+    if unknown:
+        raise ValueError('Unknown fields: %s' % ', '.join(unknown))
+    if not any(name in data for name in USER_CHANGES):
+        raise ValueError('Username or password is required')
+    if any(not isinstance(value, str) or not value for value in data.values()):
+        raise ValueError('Username and password must be non-empty strings')
+    return data
+
+def ndjson_items(text):
+    """
+    Parses an NDJSON batch, skipping blank lines
+    Returns:
+        list: One item per line
+    Raises:
+        ValueError: A line is not JSON
+    """
+    items = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if line.strip():
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                raise ValueError('Invalid JSON on line %d' % number)
+    return items
+
+def batch_users(items, max_users):
+    """
+    Validates the whole payload of POST /users/batch before anything is
+    written
+    Args:
+        items (list): Parsed payload, None when it was not JSON
+        max_users (int): BATCH_MAX_USERS
+    Returns:
+        list: (username, password) pairs
+    Raises:
+        ValueError: Not a list, empty, too long or invalid items
+    """
+    if not isinstance(items, list):
+        raise ValueError('Expected a JSON array of users')
+    if not items:
+        raise ValueError('No users provided')
+    if len(items) > max_users:
+        raise ValueError('At most %d users per batch' % max_users)
+
+    invalid = [
+        index for index, item in enumerate(items)
+        if not isinstance(item, dict)
+        or not isinstance(item.get('username'), str) or not item['username']
+        or len(item['username']) > 20
+        or not isinstance(item.get('password'), str) or not item['password']
+    ]
+    if invalid:
+        raise ValueError('Invalid users at index %s' % ', '.join(map(str, invalid[:20])))
+    return [(item['username'], item['password']) for item in items]
+
+def batch_document(users, created):
+    """
+    Args:
+        users (list): (username, password) pairs of the batch
+        created (set): Usernames actually inserted
+    Returns:
+        dict: Per-item results plus created/conflict totals; a username
+            repeated in the batch is created once and conflicts after
+    """
+    results = []
+    reported = set()
+    for index, (username, _) in enumerate(users):
+        if username in created and username not in reported:
+            status = 'created'
+            reported.add(username)
+        else:
+            status = 'conflict'
+        results.append({"index": index, "username": username, "status": status})
+
+    return {
+        "created": len(created),
+        "conflicts": len(users) - len(created),
+        "results": results
+    }
+
+def export_format(name):
+    """
+    Picks the encoding of GET /users/export
+    Args:
+        name (str): ?format=, 'ndjson' or 'csv'
+    Returns:
+        tuple: (function turning a batch of (id, username) rows into text,
+            header line, mimetype)
+    Raises:
+        ValueError: Unsupported format
+    """
+    if name == 'ndjson':
+        def encode(rows):
+            return ''.join(
+                json.dumps({"id": row[0], "username": row[1]}) + '\n' for row in rows
+            )
+        return encode, '', 'application/x-ndjson'
+    if name == 'csv':
+        def encode(rows):
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            return buffer.getvalue()
+        return encode, 'id,username\r\n', 'text/csv'
+    raise ValueError('Format must be ndjson or csv')
+
+# Files
+def allowed_file(filename, config):
+    """
+    Validates file extension against allowed types
+    Args:
+        filename (str): Name of the uploaded file
+        config (dict): App configuration
+    Returns:
+        bool: True if file extension is allowed, False otherwise
+    """
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in config['ALLOWED_EXTENSIONS']
+
+def link_request(data, config):
+    """
+    Validates a single-request upload sending "filename" and "sha256"
+    instead of the file, for content that is already stored
+    Returns:
+        tuple: (filename, sha256)
+    Raises:
+        ValueError: Not an object, missing field or file type not allowed
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object')
+    filename, sha256 = data.get('filename'), data.get('sha256')
+    if not filename or not sha256 or not isinstance(filename, str) or not isinstance(sha256, str):
+        raise ValueError('No file part')
+    if not allowed_file(filename, config):
+        raise ValueError('File type not allowed')
+    return filename, sha256
+
+def upload_request(data, config):
+    """
+    Validates the payload of POST /admin/uploads
+    Returns:
+        tuple: (filename, size or None, sha256 or None)
+    Raises:
+        ValueError: Not an object, missing filename, file type not allowed
+            or bad size
+    """
+    if data is not None and not isinstance(data, dict):
+        raise ValueError('Expected a JSON object')
+    if not data or not isinstance(data.get('filename'), str) or not data['filename']:
+        raise ValueError('Filename is required')
+    if not allowed_file(data['filename'], config):
+        raise ValueError('File type not allowed')
+    size = data.get('size')
+    if size is not None and (not isinstance(size, int) or size < 0):
+        raise ValueError('Size must be a non-negative integer')
+    sha256 = data.get('sha256')
+    if sha256 is not None and not isinstance(sha256, str):
+        raise ValueError('sha256 must be a string')
+    return data['filename'], size, sha256
+
+def uploaded_document(result):
+    """
+    Returns:
+        dict: Body of a successful upload, from FileStore.save or link
+    """
+    return dict(result, message="File uploaded successfully")
+
+def upload_session_document(session):
+    """
+    Returns:
+        dict: A chunked upload session as sent to the client, whose offset
+            also goes in the Upload-Offset header
+    """
+    return {
+        "upload_id": session['upload_id'],
+        "filename": session['filename'],
+        "size": session['size'],
+        "offset": session['offset']
+    }
+
+def files_document(files, statuses, sort, descending, next_key):
+    """
+    Args:
+        files (list): Page of FileStore.list
+        statuses (dict): Processing status per sha256
+        sort (str), descending (bool): Order of the listing
+        next_key (tuple): Key of the last file when more remain, else None
+    Returns:
+        dict: The files and the cursor of the next page
+    """
+    for file in files:
+        file['uploaded_at'] = format_time(file['uploaded_at'])
+        file['processing'] = statuses.get(file['sha256'])
+    next_cursor = encode_file_cursor(sort, descending, next_key) if next_key else None
+    return {"files": files, "next_cursor": next_cursor}
+
+def job_document(job, meta):
+    """
+    Returns:
+        dict: Processing job of a file, as sent by /files/<filename>/processing
+    """
+    return dict(job, updated_at=format_time(job['updated_at']), filename=meta['filename'], sha256=meta['sha256'])
+
+def has_artifact(job, artifact):
+    """
+    Returns:
+        bool: True if the job finished and produced the artifact
+    """
+    return job is not None and job['status'] == 'done' and artifact in job['result']['artifacts']
+
+def archive_names(method, data, args, max_files):
+    """
+    Reads the files asked for by GET or POST /files/archive
+    Args:
+        method (str): Request method
+        data (dict): JSON payload of a POST, or None
+        args (MultiDict): Query parameters of a GET
+        max_files (int): ARCHIVE_MAX_FILES
+    Returns:
+        list: Distinct file names, in the order given
+    Raises:
+        ValueError: Payload not an object or without a list of names, a path
+            rather than a file name, no names or too many
+    """
+    if method == 'POST':
+        if not isinstance(data, dict):
+            raise ValueError('Expected a JSON object')
+        names = data.get('names')
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            raise ValueError('names must be a list of file names')
+    else:
+        names = [name for value in args.getlist('names') for name in value.split(',')]
+    names = list(dict.fromkeys(name.strip() for name in names if name.strip()))
+    for name in names:
+        # Entries are named like the files asked for: a path could land
+        # outside the folder the archive is extracted to
+        if '/' in name or '\\' in name or name == '..':
+            raise ValueError('Invalid file name: %s' % name)
+
+    if not names:
+        raise ValueError('No file names given')
+    if len(names) > max_files:
+        raise ValueError('At most %d files per archive' % max_files)
+    return names
+
+def archive_entries(names, file_store):
+    """
+    Looks the files of an archive up
+    Args:
+        names (list): File names from archive_names
+        file_store (FileStore): Store of the uploads
+    Returns:
+        list: (name, path, compress) entries for stream_zip, read from the
+            blobs, which keep the content looked up here even if a name is
+            overwritten while the archive is being sent
+    Raises:
+        LookupError: Some of the files do not exist
+    """
+    files = []
+    missing = []
+    for name in names:
+        meta = file_store.get(name) if not name.startswith('.') else None
+        if meta is None:
+            missing.append(name)
+        else:
+            files.append(meta)
+    if missing:
+        raise LookupError('Files not found: %s' % ', '.join(missing))
+    return [
+        (meta['filename'], file_store.blob_path(meta['sha256']), is_compressible(meta['content_type']))
+        for meta in files
+    ]
+
+def precompressed_variant(meta, headers, accept_encodings, file_store):
+    """
+    Picks the compressed variant of a stored file that best matches
+    Accept-Encoding, so downloads never pay for compression per request.
+    Range requests get the original, whose offsets resumable clients know.
+    Args:
+        meta (dict): Indexed metadata of the file, or None
+        headers (Headers): Request headers
+        accept_encodings (MIMEAccept): The request's parsed Accept-Encoding
+        file_store (FileStore): Store of the uploads
+    Returns:
+        tuple: (encoding, path of the variant), or None to send the file as
+            it is
+    """
+    if meta is None or 'Range' in headers or not is_compressible(meta['content_type']):
+        return None
+    folder = file_store.derived_path(meta['sha256'])
+    encoding = negotiate(accept_encodings, [
+        encoding for encoding, name in VARIANT_NAMES.items() if os.path.exists(os.path.join(folder, name))
+    ])
+    if encoding is None:
+        return None
+    return encoding, os.path.join(folder, VARIANT_NAMES[encoding])
+
+def accel_headers(filename, config):
+    """
+    Returns:
+        dict: Headers handing a download to nginx through an internal
+            location, which then serves the bytes, ranges included
+    """
+    quoted = quote(filename)
+    return {
+        'X-Accel-Redirect': config['FILE_ACCEL_PREFIX'] + quoted,
+        'Content-Disposition': "attachment; filename*=UTF-8''%s" % quoted
+    }
@@ -0,0 +1,161 @@
+import os
+import re
+import threading
+from collections import Counter
+from functools import lru_cache
+
+from flask import current_app, g, has_request_context, request
+
+# =============================================
+# QUERY PROFILER
+# =============================================
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|\?')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_ROWS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+_SPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(query):
+    """
+    Normalizes a statement so every execution of the same query, whatever
+    its literals, parameters or IN-list length, maps to one fingerprint
+    Args:
+        query (str): SQL as sent to the cursor
+    Returns:
+        str: e.g. "SELECT * FROM users WHERE id IN (...)"
+    """
+    query = _STRING.sub('?', query)
+    query = _NUMBER.sub('?', query)
+    query = _PLACEHOLDER.sub('?', query)
+    query = _LIST.sub('(...)', query)
+    query = _ROWS.sub('(...)', query)
+    return _SPACE.sub(' ', query).strip()
+
+
+class QueryStats:
+    """
+    Count, total and maximum time per fingerprint, plus the routes that ran
+    the same fingerprint many times in one request (N+1 patterns)
+    Args:
+        maxsize (int): Fingerprints tracked; further ones are counted under "(other)"
+    """
+    def __init__(self, maxsize=500):
+        self.maxsize = maxsize
+        self._queries = {}  # fingerprint -> [count, total seconds, max seconds, slow count]
+        self._repeats = {}  # (route, fingerprint) -> [requests, max executions in one request]
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds, slow):
+        with self._lock:
+            entry = self._queries.get(key)
+            if entry is None:
+                if len(self._queries) >= self.maxsize:
+                    key = '(other)'
+                entry = self._queries.setdefault(key, [0, 0.0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            entry[3] += slow
+
+    def record_repeat(self, route, key, executions):
+        with self._lock:
+            entry = self._repeats.setdefault((route, key), [0, 0])
+            entry[0] += 1
+            entry[1] = max(entry[1], executions)
+
+    def report(self, sort='total', limit=20):
+        """
+        Args:
+            sort (str): 'total', 'max', 'count' or 'mean'
+            limit (int): Fingerprints returned
+        Returns:
+            dict: The top fingerprints and the N+1 patterns seen so far
+        """
+        with self._lock:
+            queries = [
+                {
+                    "fingerprint": key,
+                    "count": count,
+                    "total_ms": round(total * 1000, 3),
+                    "mean_ms": round(total * 1000 / count, 3),
+                    "max_ms": round(longest * 1000, 3),
+                    "slow": slow
+                }
+                for key, (count, total, longest, slow) in self._queries.items()
+            ]
+            repeats = [
+                {"route": route, "fingerprint": key, "requests": requests, "max_per_request": most}
+                for (route, key), (requests, most) in self._repeats.items()
+            ]
+        field = 'count' if sort == 'count' else sort + '_ms'
+        queries.sort(key=lambda q: q[field], reverse=True)
+        repeats.sort(key=lambda r: (r['requests'], r['max_per_request']), reverse=True)
+        return {"pid": os.getpid(), "queries": queries[:limit], "n_plus_one": repeats}
+
+
+class QueryProfiler:
+    """
+    Flask extension fingerprinting every statement run through the Database
+    extension, logging the slow ones with the route that ran them and
+    flagging requests that repeat one fingerprint many times
+    Statistics are kept per worker process.
+    Configuration:
+        SLOW_QUERY_THRESHOLD: Seconds above which a statement is logged
+        N_PLUS_ONE_THRESHOLD: Executions of one fingerprint in a request
+            from which it is reported as an N+1 pattern
+        QUERY_STATS_SIZE: Fingerprints tracked per worker
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['query_stats'] = QueryStats(app.config.get('QUERY_STATS_SIZE', 500))
+        app.extensions.setdefault('query_observers', []).append(self._observe)
+        app.teardown_request(self._check_repeats)
+
+    @property
+    def stats(self):
+        return current_app.extensions['query_stats']
+
+    def _observe(self, query, seconds):
+        self._record(current_app, g if has_request_context() else None, request, query, seconds)
+
+    def _check_repeats(self, error):
+        self._report_repeats(current_app, g, request)
+
+    def _record(self, app, g, request, query, seconds):
+        # g is None outside of requests, e.g. in CLI commands
+        key = fingerprint(query)
+        slow = seconds >= app.config.get('SLOW_QUERY_THRESHOLD', 0.2)
+        app.extensions['query_stats'].record(key, seconds, slow)
+
+        if g is None:
+            if slow:
+                app.logger.warning('Slow query (%.1f ms): %s', seconds * 1000, key)
+            return
+        if slow:
+            app.logger.warning('Slow query (%.1f ms) on %s %s: %s',
+                               seconds * 1000, request.method, _route(request), key)
+        counts = g.get('query_fingerprints')
+        if counts is None:
+            counts = g.query_fingerprints = Counter()
+        counts[key] += 1
+
+    def _report_repeats(self, app, g, request):
+        counts = g.get('query_fingerprints')
+        if not counts:
+            return
+        threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 10)
+        for key, executions in counts.items():
+            if executions >= threshold:
+                app.extensions['query_stats'].record_repeat(_route(request), key, executions)
+                app.logger.warning('Possible N+1: %s %s ran %d times: %s',
+                                   request.method, _route(request), executions, key)
+
+
+def _route(request):
+    return request.url_rule.rule if request.url_rule else 'unmatched'
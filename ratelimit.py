@@ -0,0 +1,232 @@
+import hashlib
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from functools import lru_cache, wraps
+
+from flask import current_app, g, request
+from werkzeug.exceptions import TooManyRequests
+
+# =============================================
+# RATE LIMITING
+# =============================================
+PERIODS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400
+}
+
+
+@lru_cache(maxsize=64)
+def parse_limit(limit):
+    """
+    Parses a limit such as '10/minute' or '100/5 seconds'
+    Args:
+        limit (str): Number of requests per period
+    Returns:
+        tuple: (requests, period in seconds)
+    """
+    count, per = limit.split('/')
+    per = per.strip().rstrip('s')
+    multiplier = 1
+    if ' ' in per:
+        multiplier, per = per.split()
+    return int(count), int(multiplier) * PERIODS[per]
+
+
+def bearer_token(header):
+    """
+    Reads the token out of an Authorization header exactly as
+    token_required does, so anything appended after it is ignored
+    Args:
+        header (str): Authorization header, possibly None
+    Returns:
+        str: The token, or None when there is none
+    """
+    parts = (header or '').split(' ')
+    return parts[1] if len(parts) > 1 and parts[1] else None
+
+
+def gcra(tat, now, limit, period):
+    """
+    Generic cell rate algorithm, the single-timestamp form of a token
+    bucket holding `limit` requests refilled over `period` seconds
+    Args:
+        tat (float): Stored theoretical arrival time, or None for a new key
+        now (float): Current time
+        limit (int): Requests allowed per period
+        period (float): Period in seconds
+    Returns:
+        tuple: (allowed, new tat to store, remaining requests, seconds until
+            the bucket is full again, seconds until the next request fits)
+    """
+    interval = period / limit
+    tat = max(tat or now, now)
+    new_tat = tat + interval
+    allow_at = new_tat - period
+    if now < allow_at:
+        return False, tat, 0, tat - now, allow_at - now
+    remaining = int((period - (new_tat - now)) / interval)
+    return True, new_tat, remaining, new_tat - now, 0.0
+
+
+class MemoryStore:
+    """
+    Per-process store, for single-worker deployments and development
+    """
+    def __init__(self):
+        self._tats = {}
+        self._lock = threading.Lock()
+        self._next_sweep = 0.0
+
+    def hit(self, key, limit, period):
+        now = time.time()
+        with self._lock:
+            result = gcra(self._tats.get(key), now, limit, period)
+            self._tats[key] = result[1]
+            if now >= self._next_sweep:
+                # Keys whose bucket refilled carry no state worth keeping
+                self._tats = {k: tat for k, tat in self._tats.items() if tat > now}
+                self._next_sweep = now + 60
+        return result
+
+
+class SQLiteStore:
+    """
+    Store shared by every worker on the host, kept in a SQLite file that
+    lives in shared memory (/dev/shm) when available. Each check is a
+    primary-key lookup and upsert inside one short write transaction.
+    Args:
+        path (str): Database file
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._next_sweep = 0.0
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS rate_limits(key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+
+    def hit(self, key, limit, period):
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            result = gcra(row[0] if row else None, now, limit, period)
+            if result[0]:
+                conn.execute("INSERT OR REPLACE INTO rate_limits (key, tat) VALUES (?, ?)",
+                             (key, result[1]))
+            if now >= self._next_sweep:
+                conn.execute("DELETE FROM rate_limits WHERE tat < ?", (now,))
+                self._next_sweep = now + 60
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def _connection(self):
+        # One connection per thread; reopened in a forked worker
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=OFF")  # counters need no durability
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+def create_store(config):
+    """
+    Builds the store selected by RATELIMIT_STORAGE
+    Args:
+        config (dict): App configuration
+    Returns:
+        MemoryStore or SQLiteStore
+    """
+    if config.get('RATELIMIT_STORAGE', 'sqlite') == 'memory':
+        return MemoryStore()
+    folder = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return SQLiteStore(config.get('RATELIMIT_SQLITE_PATH')
+                       or os.path.join(folder, 'flask_api_ratelimit.db'))
+
+
+class RateLimiter:
+    """
+    Flask extension applying declarative rate limits to views
+    Configuration:
+        RATELIMIT_ENABLED: Turns every limit on or off
+        RATELIMIT_STORAGE: 'sqlite' (shared by the workers of a host) or 'memory'
+        RATELIMIT_SQLITE_PATH: Database file of the sqlite storage
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['ratelimit'] = create_store(app.config)
+        app.after_request(self._add_headers)
+
+    def limit(self, limit, key='ip'):
+        """
+        Decorator limiting how often a view can be called
+        Args:
+            limit (str): Requests per period, e.g. '10/minute', or the name
+                of the config key holding it, read when the view is called
+            key (str): What is counted separately: 'ip', 'token' (the
+                bearer token, checked before it is verified, so stack an
+                'ip' limit to cap invalid tokens) or 'route' (every client
+                together)
+        Returns:
+            decorator that answers 429 once the limit is exceeded
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if current_app.config.get('RATELIMIT_ENABLED', True):
+                    requests_allowed, period = parse_limit(current_app.config.get(limit, limit))
+                    result = current_app.extensions['ratelimit'].hit(
+                        self._bucket(request, key), requests_allowed, period)
+                    self._record(g, requests_allowed, result)
+                return f(*args, **kwargs)
+            return decorated
+        return decorator
+
+    def _bucket(self, request, key):
+        return '%s:%s:%s' % (request.endpoint, key, self._identity(request, key))
+
+    def _identity(self, request, key):
+        if key == 'ip':
+            return request.remote_addr
+        if key == 'token':
+            token = bearer_token(request.headers.get('Authorization'))
+            return hashlib.sha1(token.encode()).hexdigest() if token else request.remote_addr
+        return '*'
+
+    def _record(self, g, requests_allowed, result):
+        allowed, _, remaining, reset, retry_after = result
+
+        # The most restrictive limit applied to the request is reported
+        current = getattr(g, 'rate_limit', None)
+        if current is None or remaining < current[1]:
+            g.rate_limit = (requests_allowed, remaining, reset, retry_after)
+        if not allowed:
+            raise TooManyRequests()
+
+    def _add_headers(self, response):
+        return self._set_headers(getattr(g, 'rate_limit', None), response)
+
+    def _set_headers(self, rate_limit, response):
+        if rate_limit is not None:
+            limit, remaining, reset, retry_after = rate_limit
+            response.headers['RateLimit-Limit'] = str(limit)
+            response.headers['RateLimit-Remaining'] = str(remaining)
+            response.headers['RateLimit-Reset'] = str(math.ceil(reset))
+            if response.status_code == 429:
+                response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
@@ -0,0 +1,46 @@
+import pytest
+
+from main import create_app
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """
+    Builds apps on a SQLite database in a temporary folder, seeded with the
+    sample users; apps built by one test share that database
+    """
+    def make(**config):
+        settings = {
+            'TESTING': True,
+            'DB_BACKEND': 'sqlite',
+            'SQLITE_PATH': str(tmp_path / 'api.db'),
+            'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+            'METRICS_DIR': str(tmp_path / 'metrics'),
+            'RATELIMIT_STORAGE': 'memory',
+            'RESPONSE_CACHE_SQLITE_PATH': str(tmp_path / 'cache_tags.db')
+        }
+        settings.update(config)
+        app = create_app(settings)
+        assert app.test_client().get('/create_table').status_code == 200
+        return app
+    return make
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, username='emmanuel_montoya', password='em12345'):
+    """
+    Returns:
+        dict: Authorization header of a fresh token
+    """
+    response = client.post('/login', auth=(username, password))
+    assert response.status_code == 200
+    return {'Authorization': 'Bearer %s' % response.json['token']}
@@ -0,0 +1,90 @@
+import io
+import zipfile
+
+import pytest
+
+from .conftest import login
+
+FILES = {
+    'notes.txt': b'some text, ' * 500,
+    'photo.png': b'\x89PNG not really',
+    'empty.txt': b''
+}
+
+
+@pytest.fixture
+def headers(client):
+    headers = login(client)
+    for name, content in FILES.items():
+        data = {'file': (io.BytesIO(content), name)}
+        assert client.post('/admin/upload', headers=headers, data=data).status_code == 200
+    return headers
+
+
+def read_archive(response):
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    return zipfile.ZipFile(io.BytesIO(response.data))
+
+
+def test_archive_round_trip(client, headers):
+    response = client.get('/files/archive?names=notes.txt,photo.png&names=empty.txt', headers=headers)
+    assert 'Content-Length' not in response.headers  # sent as it is built
+    assert response.headers['Content-Disposition'] == 'attachment; filename=files.zip'
+    with read_archive(response) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ['notes.txt', 'photo.png', 'empty.txt']
+        for name, content in FILES.items():
+            assert archive.read(name) == content
+        # Text is deflated, already compressed types are stored
+        assert archive.getinfo('notes.txt').compress_type == zipfile.ZIP_DEFLATED
+        assert archive.getinfo('notes.txt').compress_size < len(FILES['notes.txt'])
+        assert archive.getinfo('photo.png').compress_type == zipfile.ZIP_STORED
+
+
+def test_archive_by_post(client, headers):
+    response = client.post('/files/archive', headers=headers, json={'names': ['photo.png', 'notes.txt', 'photo.png']})
+    with read_archive(response) as archive:
+        assert archive.namelist() == ['photo.png', 'notes.txt']
+
+
+def test_missing_file_before_streaming(client, headers):
+    response = client.get('/files/archive?names=notes.txt,missing.txt', headers=headers)
+    assert response.status_code == 404
+    assert response.mimetype == 'application/json'
+    assert response.headers['Content-Length'] == str(len(response.data))
+    assert response.json['error']['message'] == 'Files not found: missing.txt'
+
+    response = client.get('/files/archive?names=.index.db', headers=headers)
+    assert response.status_code == 404
+
+
+def test_too_many_files(make_app):
+    client = make_app(ARCHIVE_MAX_FILES=2).test_client()
+    headers = login(client)
+    response = client.get('/files/archive?names=a.txt,b.txt,c.txt', headers=headers)
+    assert response.status_code == 400
+    assert response.json['error']['message'] == 'At most 2 files per archive'
+
+
+@pytest.mark.parametrize('name', ['../notes.txt', '/notes.txt', '..', 'sub/notes.txt', '..\\notes.txt'])
+def test_paths_rejected(client, headers, name):
+    response = client.post('/files/archive', headers=headers, json={'names': [name]})
+    assert response.status_code == 400
+    assert response.json['error']['message'] == 'Invalid file name: %s' % name
+
+
+def test_entry_names_are_plain(client, headers):
+    response = client.get('/files/archive?names=notes.txt,photo.png,empty.txt', headers=headers)
+    with read_archive(response) as archive:
+        for name in archive.namelist():
+            assert not name.startswith('/') and '..' not in name.split('/') and '\\' not in name
+
+
+@pytest.mark.parametrize('body', [{}, {'names': 'notes.txt'}, {'names': [1]}, {'names': [' ']}, ['notes.txt']])
+def test_bad_payload(client, headers, body):
+    assert client.post('/files/archive', headers=headers, json=body).status_code == 400
+
+
+def test_requires_token(client):
+    assert client.get('/files/archive?names=notes.txt').status_code == 401
@@ -0,0 +1,312 @@
+import asyncio
+import base64
+import gzip
+import importlib
+import io
+import json
+import os
+import zipfile
+
+import pytest
+
+pytest.importorskip('quart')
+pytest.importorskip('aiosqlite')
+from quart.datastructures import FileStorage  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def loop():
+    # The pool's locks belong to the loop that first awaits them
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+@pytest.fixture(scope='module')
+def asgi(loop, tmp_path_factory):
+    """
+    The Quart app on a SQLite database in a temporary folder; asgi.py builds
+    its app on import, so the settings go in through FLASK_* variables
+    """
+    folder = tmp_path_factory.mktemp('asgi')
+    settings = {
+        'FLASK_DB_BACKEND': 'sqlite',
+        'FLASK_SQLITE_PATH': str(folder / 'api.db'),
+        'FLASK_UPLOAD_FOLDER': str(folder / 'uploads'),
+        'FLASK_METRICS_DIR': str(folder / 'metrics'),
+        'FLASK_RATELIMIT_STORAGE': 'memory',
+        'FLASK_RESPONSE_CACHE_SQLITE_PATH': str(folder / 'cache_tags.db')
+    }
+    saved = {name: os.environ.get(name) for name in settings}
+    os.environ.update(settings)
+    try:
+        module = importlib.import_module('asgi')
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    return module
+
+
+@pytest.fixture(scope='module')
+def client(asgi):
+    """
+    Test client of the app served for the module; shutting it down closes
+    the pooled connections, whose threads would otherwise outlive the tests
+    """
+    served = asgi.app.test_app()
+    run(served.startup())
+    client = served.test_client()
+    assert run(client.get('/create_table')).status_code == 200
+    yield client
+    run(served.shutdown())
+
+
+@pytest.fixture(scope='module')
+def headers(client):
+    credentials = base64.b64encode(b'emmanuel_montoya:em12345').decode()
+    response = run(client.post('/login', headers={'Authorization': 'Basic %s' % credentials}))
+    assert response.status_code == 200
+    return {'Authorization': 'Bearer %s' % run(response.get_json())['token']}
+
+
+def test_settings_come_from_environment(asgi):
+    assert asgi.app.config['DB_BACKEND'] == 'sqlite'
+    assert asgi.app.config['RATELIMIT_STORAGE'] == 'memory'
+
+
+def test_public_route(client):
+    response = run(client.get('/public/items'))
+    assert response.status_code == 200
+    assert len(run(response.get_json())['items']) == 2
+
+
+def test_health_checks(client):
+    response = run(client.get('/healthz'))
+    assert response.status_code == 200
+    assert run(response.get_json()) == {'status': 'ok'}
+
+    response = run(client.get('/readyz'))
+    assert response.status_code == 200
+    ready = run(response.get_json())
+    assert ready['status'] == 'ready'
+    assert ready['pool']['size'] >= 1
+
+
+def test_table_hides_password(client):
+    response = run(client.get('/show_table?limit=2'))
+    assert run(response.get_json()) == [{'id': 1, 'username': 'emmanuel_montoya'},
+                                        {'id': 2, 'username': 'renzo_salosagcol'}]
+    assert run(client.get('/show_table?fields=password')).status_code == 400
+
+
+def test_token_required(client):
+    response = run(client.get('/users'))
+    assert response.status_code == 401
+    assert run(response.get_json()) == {'error': {'code': 401, 'message': 'Token is missing'}}
+
+    response = run(client.get('/users', headers={'Authorization': 'Bearer nonsense'}))
+    assert response.status_code == 401
+
+
+def test_user_crud(client, headers):
+    response = run(client.post('/users', json={'username': 'quart_user', 'password': 'pw'}, headers=headers))
+    assert response.status_code == 201
+    user_id = run(response.get_json())['id']
+
+    response = run(client.get('/users/%d' % user_id, headers=headers))
+    assert response.status_code == 200
+    assert run(response.get_json()) == {'id': user_id, 'username': 'quart_user'}
+    etag = response.headers['ETag']
+
+    response = run(client.get('/users/%d' % user_id, headers=dict(headers, **{'If-None-Match': etag})))
+    assert response.status_code == 304
+
+    response = run(client.put('/users/%d' % user_id, json={'username': 'quart_renamed'},
+                              headers=dict(headers, **{'If-Match': etag})))
+    assert response.status_code == 200
+
+    response = run(client.delete('/users/%d' % user_id, headers=headers))
+    assert response.status_code == 200
+    assert run(client.get('/users/%d' % user_id, headers=headers)).status_code == 404
+
+
+def test_pages_and_search(client, headers):
+    response = run(client.get('/users?limit=3', headers=headers))
+    assert response.status_code == 200
+    page = run(response.get_json())
+    assert [user['id'] for user in page['users']] == [1, 2, 3]
+
+    response = run(client.get('/users?limit=3&after=%s' % page['next_cursor'], headers=headers))
+    assert [user['id'] for user in run(response.get_json())['users']] == [4, 5, 6]
+
+    response = run(client.get('/users?q=alice', headers=headers))
+    assert [user['username'] for user in run(response.get_json())['users']] == ['alice_johnson']
+
+    assert run(client.get('/users?fields=password', headers=headers)).status_code == 400
+
+
+def test_export(client, headers):
+    response = run(client.get('/users/export?format=csv', headers=headers))
+    assert response.status_code == 200
+    lines = run(response.get_data()).decode().splitlines()
+    assert lines[:3] == ['id,username', '1,emmanuel_montoya', '2,renzo_salosagcol']
+
+    response = run(client.get('/users/export', headers=headers))
+    ids = [json.loads(line)['id'] for line in run(response.get_data()).decode().splitlines()]
+    assert ids == sorted(ids) and ids[0] == 1
+
+
+def test_upload_and_download(client, headers):
+    upload = FileStorage(io.BytesIO(b'hello asgi'), filename='hello.txt')
+    response = run(client.post('/admin/upload', headers=headers, files={'file': upload}))
+    assert response.status_code == 200
+
+    response = run(client.get('/files', headers=headers))
+    assert [file['filename'] for file in run(response.get_json())['files']] == ['hello.txt']
+
+    response = run(client.get('/files/hello.txt', headers=headers))
+    assert response.status_code == 200
+    assert run(response.get_data()) == b'hello asgi'
+
+    assert run(client.delete('/files/hello.txt', headers=headers)).status_code == 200
+    assert run(client.get('/files/hello.txt', headers=headers)).status_code == 404
+
+
+@pytest.fixture
+def stored(client, headers):
+    upload = FileStorage(io.BytesIO(b'0123456789'), filename='digits.txt')
+    assert run(client.post('/admin/upload', headers=headers, files={'file': upload})).status_code == 200
+    yield 'digits.txt'
+    run(client.delete('/files/digits.txt', headers=headers))
+
+
+def test_download_ranges(client, headers, stored):
+    response = run(client.get('/files/digits.txt', headers=headers))
+    etag = response.headers['ETag']
+
+    response = run(client.get('/files/digits.txt', headers=dict(headers, Range='bytes=2-5')))
+    assert response.status_code == 206
+    assert run(response.get_data()) == b'2345'
+
+    response = run(client.get('/files/digits.txt', headers=dict(headers, **{'Range': 'bytes=2-5',
+                                                                           'If-Range': etag})))
+    assert response.status_code == 206
+
+    response = run(client.get('/files/digits.txt', headers=dict(headers, **{'Range': 'bytes=2-5',
+                                                                           'If-Range': '"stale"'})))
+    assert response.status_code == 200
+    assert run(response.get_data()) == b'0123456789'
+
+    response = run(client.get('/files/digits.txt', headers=dict(headers, Range='bytes=20-30')))
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */10'
+
+    response = run(client.get('/files/digits.txt', headers=dict(headers, **{'If-None-Match': etag})))
+    assert response.status_code == 304
+    assert run(response.get_data()) == b''
+
+
+def test_download_offloaded(asgi, client, headers, stored):
+    asgi.app.config['FILE_OFFLOAD'] = 'x-accel-redirect'
+    try:
+        response = run(client.get('/files/digits.txt', headers=headers))
+    finally:
+        asgi.app.config['FILE_OFFLOAD'] = None
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == '/protected-uploads/digits.txt'
+    assert response.headers['Content-Disposition'] == "attachment; filename*=UTF-8''digits.txt"
+    assert run(response.get_data()) == b''
+
+
+def test_metrics(client, headers):
+    assert run(client.get('/users/1', headers=headers)).status_code == 200
+
+    # Quart's test client leaves the peer out of the scope; servers fill it in
+    response = run(client.get('/metrics', scope_base={'client': ('203.0.113.9', 40000)}))
+    assert response.status_code == 403
+
+    response = run(client.get('/metrics', scope_base={'client': ('127.0.0.1', 40000)}))
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+    text = run(response.get_data()).decode()
+    assert '# TYPE http_requests_total counter' in text
+    assert 'http_requests_total{method="GET",route="/users/<int:user_id>",status="200"}' in text
+    assert 'db_queries_per_request_count{route="/users/<int:user_id>"}' in text
+    assert 'db_pool_connections{state="idle"}' in text
+
+
+def test_query_stats(client, headers):
+    assert run(client.get('/users/2', headers=headers)).status_code == 200
+
+    response = run(client.get('/admin/queries?sort=count', headers=headers))
+    assert response.status_code == 200
+    report = run(response.get_json())
+    fingerprints = [query['fingerprint'] for query in report['queries']]
+    assert any(fingerprint.startswith('SELECT') and '?' in fingerprint for fingerprint in fingerprints)
+    assert run(client.get('/admin/queries?sort=nope', headers=headers)).status_code == 400
+
+
+def test_compressed_responses(client, headers):
+    users = [{'username': 'gzip_%02d' % i, 'password': 'pw'} for i in range(40)]
+    assert run(client.post('/users/batch', json=users, headers=headers)).status_code == 200
+
+    gzipped = dict(headers, **{'Accept-Encoding': 'gzip'})
+    response = run(client.get('/users?limit=50', headers=gzipped))
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(run(response.get_data())))['users'][0]['id'] == 1
+
+    response = run(client.get('/users/export?format=csv', headers=gzipped))
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(run(response.get_data())).startswith(b'id,username\r\n1,emmanuel_montoya\r\n')
+
+
+def test_precompressed_download(asgi, client, headers):
+    content = b'a line of text\n' * 200
+    upload = FileStorage(io.BytesIO(content), filename='lines.txt')
+    result = run(run(client.post('/admin/upload', headers=headers, files={'file': upload})).get_json())
+    folder = asgi.file_store.derived_path(result['sha256'])
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, 'content.gz'), 'wb') as f:
+        f.write(gzip.compress(content))
+
+    gzipped = dict(headers, **{'Accept-Encoding': 'gzip'})
+    response = run(client.get('/files/lines.txt', headers=gzipped))
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(run(response.get_data())) == content
+    etag = response.headers['ETag']
+
+    response = run(client.get('/files/lines.txt', headers=dict(gzipped, **{'If-None-Match': etag})))
+    assert response.status_code == 304
+
+    response = run(client.get('/files/lines.txt', headers=headers))
+    assert 'Content-Encoding' not in response.headers
+    assert run(response.get_data()) == content
+    run(client.delete('/files/lines.txt', headers=headers))
+
+
+def test_archive(client, headers, stored):
+    upload = FileStorage(io.BytesIO(b'letters'), filename='letters.txt')
+    assert run(client.post('/admin/upload', headers=headers, files={'file': upload})).status_code == 200
+
+    response = run(client.get('/files/archive?names=digits.txt,letters.txt', headers=headers))
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(run(response.get_data()))) as archive:
+        assert archive.read('digits.txt') == b'0123456789'
+        assert archive.read('letters.txt') == b'letters'
+
+    response = run(client.post('/files/archive', json={'names': ['digits.txt', 'missing.txt']},
+                               headers=headers))
+    assert response.status_code == 404
+    response = run(client.post('/files/archive', json={'names': ['../digits.txt']}, headers=headers))
+    assert response.status_code == 400
+    run(client.delete('/files/letters.txt', headers=headers))
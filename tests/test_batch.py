@@ -0,0 +1,35 @@
+import pytest
+
+from main import db
+
+from .conftest import login
+
+
+def usernames(app):
+    with app.app_context():
+        rows = db.users.dump(0, 1000)[1]
+    return {row[1] for row in rows}
+
+
+def test_batch_is_all_or_nothing(app):
+    users = [('batch_a', 'pw'), ('batch_b', 'pw'), ('batch_c', 'pw'), ('batch_d', object())]
+    with app.app_context():
+        with pytest.raises(Exception):
+            db.users.create_many(users, chunk_size=2)
+    assert not usernames(app) & {'batch_a', 'batch_b', 'batch_c'}
+
+
+def test_batch_skips_taken_usernames(app):
+    users = [('batch_a', 'pw'), ('alice_johnson', 'pw'), ('batch_a', 'pw'), ('batch_b', 'pw')]
+    with app.app_context():
+        created = db.users.create_many(users, chunk_size=2)
+    assert created == {'batch_a', 'batch_b'}
+    assert {'batch_a', 'batch_b'} <= usernames(app)
+
+
+def test_batch_route(client):
+    headers = login(client)
+    users = [{'username': 'batch_a', 'password': 'pw'}, {'username': 'alice_johnson', 'password': 'pw'}]
+    response = client.post('/users/batch', headers=headers, json=users)
+    assert response.status_code == 200
+    assert [result['status'] for result in response.json['results']] == ['created', 'conflict']
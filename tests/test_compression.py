@@ -0,0 +1,42 @@
+import zlib
+
+import pytest
+
+from compression import _compress_stream, available_encodings, brotli, zstandard
+
+from .conftest import login
+
+
+def decompressor(encoding):
+    """
+    Returns:
+        callable: Decodes the successive pieces of one stream
+    """
+    if encoding == 'gzip':
+        return zlib.decompressobj(31).decompress
+    if encoding == 'br':
+        return brotli.Decompressor().process
+    return zstandard.ZstdDecompressor().decompressobj().decompress
+
+
+@pytest.mark.parametrize('encoding', available_encodings())
+def test_stream_flushes_first_chunk_and_every_flush_size(encoding):
+    rows = ['%d,user_%d\r\n' % (i, i) for i in range(1000)]
+    pieces = _compress_stream(iter(rows), encoding, 3, flush_size=1024)
+    decode = decompressor(encoding)
+
+    assert decode(next(pieces)) == rows[0].encode()
+    received, sent = b'', rows[0].encode()
+    for piece, row in zip(pieces, rows[1:]):
+        received += decode(piece)
+        sent += row.encode()
+        assert len(sent) - len(received) < 1024 + len(row)
+
+
+def test_compressed_export_starts_at_once(client):
+    headers = dict(login(client), **{'Accept-Encoding': 'gzip'})
+    response = client.get('/users/export?format=csv', headers=headers, buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    first = next(iter(response.response))
+    assert zlib.decompressobj(31).decompress(first) == b'id,username\r\n'
+    response.close()
@@ -0,0 +1,82 @@
+import pytest
+
+from .conftest import login
+
+
+@pytest.fixture
+def headers(client):
+    return login(client)
+
+
+def etag(client, headers, user_id=3):
+    response = client.get('/users/%d' % user_id, headers=headers)
+    assert response.status_code == 200
+    return response.headers['ETag']
+
+
+def test_etag_and_not_modified(client, headers):
+    tag = etag(client, headers)
+    assert tag == '"v1"'
+    response = client.get('/users/3', headers=dict(headers, **{'If-None-Match': tag}))
+    assert response.status_code == 304
+    assert response.data == b''
+
+    client.put('/users/3', headers=headers, json={'password': 'changed'})
+    response = client.get('/users/3', headers=dict(headers, **{'If-None-Match': tag}))
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"v2"'
+
+
+def test_update_with_current_version(client, headers):
+    tag = etag(client, headers)
+    response = client.put('/users/3', headers=dict(headers, **{'If-Match': tag}), json={'username': 'anthony_w'})
+    assert response.status_code == 200
+    assert client.get('/users/3', headers=headers).json['username'] == 'anthony_w'
+
+
+def test_stale_version_precondition_failed(client, headers):
+    tag = etag(client, headers)
+    assert client.put('/users/3', headers=headers, json={'password': 'changed'}).status_code == 200
+
+    response = client.put('/users/3', headers=dict(headers, **{'If-Match': tag}), json={'username': 'late'})
+    assert response.status_code == 412
+    response = client.delete('/users/3', headers=dict(headers, **{'If-Match': tag}))
+    assert response.status_code == 412
+    assert client.get('/users/3', headers=headers).json['username'] == 'anthony_weathersby'
+
+
+def test_foreign_etag_precondition_failed(client, headers):
+    response = client.put('/users/3', headers=dict(headers, **{'If-Match': '"abc"'}), json={'username': 'x'})
+    assert response.status_code == 412
+
+
+def test_username_conflict(client, headers):
+    response = client.put('/users/3', headers=headers, json={'username': 'alice_johnson'})
+    assert response.status_code == 409
+
+
+def test_missing_user(client, headers):
+    assert client.get('/users/999', headers=headers).status_code == 404
+    assert client.put('/users/999', headers=headers, json={'username': 'nobody'}).status_code == 404
+    assert client.delete('/users/999', headers=headers).status_code == 404
+
+
+def test_delete_with_current_version(client, headers):
+    tag = etag(client, headers)
+    assert client.delete('/users/3', headers=dict(headers, **{'If-Match': tag})).status_code == 200
+    assert client.get('/users/3', headers=headers).status_code == 404
+
+
+@pytest.mark.parametrize('body', [
+    ['username'],
+    'anthony',
+    {'nickname': 'tony'},
+    {'username': 'tony', 'version': 9},
+    {'username': 7},
+    {'password': ''},
+    {'id': 4}
+])
+def test_update_rejects_bad_body(client, headers, body):
+    response = client.put('/users/3', headers=headers, json=body)
+    assert response.status_code == 400
+    assert client.get('/users/3', headers=headers).headers['ETag'] == '"v1"'
@@ -0,0 +1,96 @@
+import hashlib
+import io
+import os
+import sqlite3
+
+import pytest
+
+from .conftest import login
+
+CONTENT = b'the same bytes twice'
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+
+def upload(client, headers, filename, content=CONTENT):
+    data = {'file': (io.BytesIO(content), filename)}
+    return client.post('/admin/upload', headers=headers, data=data)
+
+
+def refcount(app, digest):
+    """
+    Returns:
+        int: References the index counts to a blob, None when it is gone
+    """
+    conn = sqlite3.connect(os.path.join(app.config['UPLOAD_FOLDER'], '.index.db'))
+    row = conn.execute("SELECT refcount FROM blobs WHERE digest = ?", (digest,)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def blob_path(app, digest):
+    return os.path.join(app.config['UPLOAD_FOLDER'], '.blobs', digest[:2], digest)
+
+
+def test_same_bytes_stored_once(app, client):
+    headers = login(client)
+    first = upload(client, headers, 'first.txt').json
+    second = upload(client, headers, 'second.txt').json
+
+    assert (first['sha256'], first['deduplicated']) == (DIGEST, False)
+    assert (second['sha256'], second['deduplicated']) == (DIGEST, True)
+    assert refcount(app, DIGEST) == 2
+    assert os.listdir(os.path.dirname(blob_path(app, DIGEST))) == [DIGEST]
+    assert client.get('/files/second.txt', headers=headers).data == CONTENT
+
+
+def test_link_by_digest(app, client):
+    headers = login(client)
+    upload(client, headers, 'first.txt')
+
+    response = client.post('/admin/upload', headers=headers, json={'filename': 'linked.txt', 'sha256': DIGEST})
+    assert response.status_code == 200
+    assert response.json['deduplicated'] is True
+    assert refcount(app, DIGEST) == 2
+    assert client.get('/files/linked.txt', headers=headers).data == CONTENT
+
+
+def test_link_unknown_digest(client):
+    headers = login(client)
+    response = client.post('/admin/upload', headers=headers, json={'filename': 'linked.txt', 'sha256': '0' * 64})
+    assert response.status_code == 404
+    response = client.post('/admin/upload', headers=headers, json={'filename': 'linked.txt', 'sha256': 'nope'})
+    assert response.status_code == 404
+
+
+def test_delete_releases_blob(app, client):
+    headers = login(client)
+    upload(client, headers, 'first.txt')
+    upload(client, headers, 'second.txt')
+
+    assert client.delete('/files/first.txt', headers=headers).status_code == 200
+    assert refcount(app, DIGEST) == 1
+    assert os.path.exists(blob_path(app, DIGEST))
+
+    assert client.delete('/files/second.txt', headers=headers).status_code == 200
+    assert refcount(app, DIGEST) is None
+    assert not os.path.exists(blob_path(app, DIGEST))
+
+
+def test_replacing_name_releases_old_blob(app, client):
+    headers = login(client)
+    upload(client, headers, 'note.txt')
+    upload(client, headers, 'note.txt', b'new content')
+    assert refcount(app, DIGEST) is None
+
+
+@pytest.mark.parametrize('body', [[], ['linked.txt'], [{'filename': 'linked.txt', 'sha256': DIGEST}],
+                                  {'filename': ['linked.txt'], 'sha256': DIGEST}])
+def test_link_rejects_bad_body(client, body):
+    response = client.post('/admin/upload', headers=login(client), json=body)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('body', [['big.txt'], {'filename': 7}, {'filename': 'big.txt', 'sha256': 7}])
+def test_session_rejects_bad_body(client, body):
+    response = client.post('/admin/uploads', headers=login(client), json=body)
+    assert response.status_code == 400
@@ -0,0 +1,66 @@
+import hashlib
+import io
+
+import pytest
+
+from .conftest import login
+
+
+@pytest.fixture
+def headers(client):
+    headers = login(client)
+    data = {'file': (io.BytesIO(b'0123456789'), 'digits.txt')}
+    assert client.post('/admin/upload', headers=headers, data=data).status_code == 200
+    return headers
+
+
+def test_range(client, headers):
+    response = client.get('/files/digits.txt', headers=dict(headers, Range='bytes=2-5'))
+    assert response.status_code == 206
+    assert response.data == b'2345'
+    assert response.headers['Content-Range'] == 'bytes 2-5/10'
+
+
+def test_unsatisfiable_range(client, headers):
+    response = client.get('/files/digits.txt', headers=dict(headers, Range='bytes=20-30'))
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */10'
+    assert response.json['error']['code'] == 416
+
+
+def test_if_range(client, headers):
+    etag = client.get('/files/digits.txt', headers=headers).headers['ETag']
+
+    response = client.get('/files/digits.txt', headers=dict(headers, **{'Range': 'bytes=2-5', 'If-Range': etag}))
+    assert response.status_code == 206
+
+    # The file changed since the client got its first bytes: start over
+    response = client.get('/files/digits.txt', headers=dict(headers, **{'Range': 'bytes=2-5',
+                                                                       'If-Range': '"stale"'}))
+    assert response.status_code == 200
+    assert response.data == b'0123456789'
+
+
+def test_not_modified(client, headers):
+    etag = client.get('/files/digits.txt', headers=headers).headers['ETag']
+    response = client.get('/files/digits.txt', headers=dict(headers, **{'If-None-Match': etag}))
+    assert response.status_code == 304
+
+
+def test_missing_file(client, headers):
+    assert client.get('/files/nothing.txt', headers=headers).status_code == 404
+    assert client.get('/files/.blobs', headers=headers).status_code == 404
+
+
+def test_accel_redirect(make_app):
+    client = make_app(FILE_OFFLOAD='x-accel-redirect').test_client()
+    headers = login(client)
+    data = {'file': (io.BytesIO(b'0123456789'), 'two words.txt')}
+    assert client.post('/admin/upload', headers=headers, data=data).status_code == 200
+
+    response = client.get('/files/two_words.txt', headers=headers)
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == '/protected-uploads/two_words.txt'
+    assert response.headers['Content-Disposition'] == "attachment; filename*=UTF-8''two_words.txt"
+    assert response.headers['ETag'] == '"%s"' % hashlib.sha256(b'0123456789').hexdigest()
+    assert response.data == b''
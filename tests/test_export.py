@@ -0,0 +1,62 @@
+import csv
+import io
+import json
+
+from main import db
+
+from .conftest import login
+
+
+def add_users(client, headers, users):
+    body = [{'username': username, 'password': 'pw'} for username in users]
+    assert client.post('/users/batch', headers=headers, json=body).status_code == 200
+
+
+def test_ndjson_streams_every_user_in_id_order(client):
+    headers = login(client)
+    add_users(client, headers, ['export_%04d' % i for i in range(2500)])
+
+    response = client.get('/users/export', headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.is_streamed
+    users = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [user['id'] for user in users] == list(range(1, 2511))
+    assert users[0] == {'id': 1, 'username': 'emmanuel_montoya'}
+    assert users[-1]['username'] == 'export_2499'
+
+
+def test_csv_quoting(client):
+    headers = login(client)
+    awkward = ['comma,name', 'quote"name', 'both,"of them"', 'line\nbreak']
+    add_users(client, headers, awkward)
+
+    response = client.get('/users/export?format=csv', headers=headers)
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=users.csv'
+    text = response.get_data(as_text=True)
+    assert text.startswith('id,username\r\n1,emmanuel_montoya\r\n')
+    assert '11,"comma,name"\r\n12,"quote""name"\r\n' in text
+    rows = list(csv.reader(io.StringIO(text)))
+    assert rows[0] == ['id', 'username']
+    assert [row[1] for row in rows[-4:]] == awkward
+
+
+def test_unsupported_format(client):
+    response = client.get('/users/export?format=xml', headers=login(client))
+    assert response.status_code == 400
+
+
+def test_disconnect_returns_connection(app, client):
+    headers = login(client)
+    add_users(client, headers, ['export_%04d' % i for i in range(2500)])
+
+    response = client.get('/users/export', headers=headers, buffered=False)
+    chunks = iter(response.response)
+    assert next(chunks)
+    with app.app_context():
+        assert db.pool.stats()['in_use'] == 1
+    # What the server does when the client goes away mid-stream
+    response.close()
+    with app.app_context():
+        assert db.pool.stats()['in_use'] == 0
@@ -0,0 +1,36 @@
+import pytest
+
+from .conftest import login
+
+
+def test_table_hides_password(client):
+    response = client.get('/show_table')
+    assert response.status_code == 200
+    assert response.json[0] == {'id': 1, 'username': 'emmanuel_montoya'}
+    assert all(set(row) == {'id', 'username'} for row in response.json)
+
+
+def test_table_fields(client):
+    response = client.get('/show_table?fields=username&limit=2')
+    assert response.json == [{'username': 'emmanuel_montoya'}, {'username': 'renzo_salosagcol'}]
+    assert '&fields=username>' in response.headers['Link']
+
+
+@pytest.mark.parametrize('fields', ['password', 'version', 'username,password', 'nickname'])
+def test_table_rejects_hidden_and_unknown_fields(client, fields):
+    response = client.get('/show_table?fields=%s' % fields)
+    assert response.status_code == 400
+    assert response.json['error']['message'] == 'fields must be among id, username'
+
+
+@pytest.mark.parametrize('fields', ['password', 'version', 'nickname'])
+def test_users_reject_hidden_and_unknown_fields(client, fields):
+    response = client.get('/users?fields=%s' % fields, headers=login(client))
+    assert response.status_code == 400
+
+
+def test_users_fields(client):
+    headers = login(client)
+    assert client.get('/users/1?fields=username', headers=headers).json == {'username': 'emmanuel_montoya'}
+    user = client.get('/users/1', headers=headers).json
+    assert user == {'id': 1, 'username': 'emmanuel_montoya'}
@@ -0,0 +1,94 @@
+import datetime
+import io
+import os
+
+import pytest
+
+from .conftest import login
+
+FILES = [('b.txt', b'bb'), ('a.txt', b'aaaa'), ('c.png', b'c' * 8), ('d.txt', b'd')]
+
+
+@pytest.fixture
+def headers(client):
+    headers = login(client)
+    for name, content in FILES:
+        data = {'file': (io.BytesIO(content), name)}
+        assert client.post('/admin/upload', headers=headers, data=data).status_code == 200
+    return headers
+
+
+def names(client, headers, query=''):
+    response = client.get('/files' + query, headers=headers)
+    assert response.status_code == 200
+    return [file['filename'] for file in response.json['files']]
+
+
+def test_ordering(client, headers):
+    assert names(client, headers) == ['a.txt', 'b.txt', 'c.png', 'd.txt']
+    assert names(client, headers, '?order=desc') == ['d.txt', 'c.png', 'b.txt', 'a.txt']
+    assert names(client, headers, '?sort=size') == ['d.txt', 'b.txt', 'a.txt', 'c.png']
+    assert names(client, headers, '?sort=size&order=desc') == ['c.png', 'a.txt', 'b.txt', 'd.txt']
+    assert names(client, headers, '?sort=uploaded_at') == ['b.txt', 'a.txt', 'c.png', 'd.txt']
+
+
+def test_pages(client, headers):
+    seen = []
+    query = '?sort=size&limit=3'
+    while True:
+        response = client.get('/files' + query, headers=headers)
+        seen += [file['filename'] for file in response.json['files']]
+        if response.json['next_cursor'] is None:
+            break
+        query = '?sort=size&limit=3&after=%s' % response.json['next_cursor']
+    assert seen == ['d.txt', 'b.txt', 'a.txt', 'c.png']
+
+    response = client.get('/files?sort=size&limit=3', headers=headers)
+    # A cursor belongs to its sort order
+    assert client.get('/files?sort=name&after=%s' % response.json['next_cursor'],
+                      headers=headers).status_code == 400
+    assert client.get('/files?after=garbage', headers=headers).status_code == 400
+
+
+def test_filters(client, headers):
+    assert names(client, headers, '?ext=txt') == ['a.txt', 'b.txt', 'd.txt']
+    assert names(client, headers, '?ext=.PNG') == ['c.png']
+    assert names(client, headers, '?min_size=2&max_size=4') == ['a.txt', 'b.txt']
+
+
+def test_time_bounds_in_utc(client, headers):
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    tomorrow = today + datetime.timedelta(days=1)
+
+    # A bare until date covers the whole day
+    assert len(names(client, headers, '?since=%s&until=%s' % (today, today))) == 4
+    assert names(client, headers, '?since=%s' % tomorrow) == []
+    assert len(names(client, headers, '?until=%sT23:59:59Z' % today)) == 4
+    assert names(client, headers, '?until=%sT00:00:00%%2B00:00' % (today - datetime.timedelta(days=1))) == []
+
+
+@pytest.mark.parametrize('query, message', [
+    ('limit=abc', 'limit must be a positive integer'),
+    ('limit=0', 'limit must be a positive integer'),
+    ('min_size=big', 'min_size must be a non-negative integer'),
+    ('max_size=-1', 'max_size must be a non-negative integer'),
+    ('since=yesterday', 'since must be a date (YYYY-MM-DD) or an ISO 8601 time'),
+    ('until=2024-13-01', 'until must be a date (YYYY-MM-DD) or an ISO 8601 time'),
+    ('sort=owner', 'Invalid sort or order')
+])
+def test_invalid_parameters(client, headers, query, message):
+    response = client.get('/files?' + query, headers=headers)
+    assert response.status_code == 400
+    assert response.json['error']['message'] == message
+
+
+def test_reindex_after_out_of_band_changes(app, client, headers):
+    assert names(client, headers) == ['a.txt', 'b.txt', 'c.png', 'd.txt']
+    os.remove(os.path.join(app.config['UPLOAD_FOLDER'], 'b.txt'))
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], 'e.txt'), 'wb') as f:
+        f.write(b'added by hand')
+
+    result = app.test_cli_runner().invoke(args=['reindex-files'])
+    assert 'added: 1' in result.output and 'removed: 1' in result.output
+    assert names(client, headers) == ['a.txt', 'c.png', 'd.txt', 'e.txt']
+    assert names(client, headers, '?min_size=10') == ['e.txt']
@@ -0,0 +1,54 @@
+import io
+import time
+
+from jobs import Worker
+
+from .conftest import login
+
+
+def upload(client, headers, content):
+    data = {'file': (io.BytesIO(content), 'note%d.txt' % len(content))}
+    return client.post('/admin/upload', headers=headers, data=data).status_code
+
+
+def test_no_backpressure_without_worker(make_app):
+    client = make_app(JOBS_MAX_PENDING=2).test_client()
+    headers = login(client)
+    statuses = [upload(client, headers, b'x' * (i + 1)) for i in range(4)]
+    assert statuses == [200, 200, 200, 200]
+
+
+def test_backpressure_while_worker_alive(make_app):
+    app = make_app(JOBS_MAX_PENDING=2)
+    client = app.test_client()
+    headers = login(client)
+    queue = app.extensions['job_queue']
+    queue.heartbeat('test-worker')
+    statuses = [upload(client, headers, b'x' * (i + 1)) for i in range(4)]
+    assert statuses == [200, 200, 503, 503]
+
+    queue.retire('test-worker')
+    assert upload(client, headers, b'y') == 200
+
+
+def test_stale_heartbeat_ignored(make_app):
+    app = make_app(JOBS_MAX_PENDING=1, JOBS_HEARTBEAT_TIMEOUT=30)
+    client = app.test_client()
+    headers = login(client)
+    queue = app.extensions['job_queue']
+    with queue._transaction() as conn:
+        conn.execute("INSERT INTO workers (worker_id, seen_at) VALUES ('gone', ?)", (time.time() - 60,))
+    assert [upload(client, headers, b'x' * (i + 1)) for i in range(2)] == [200, 200]
+
+
+def test_worker_drains_queue_and_retires(make_app):
+    app = make_app()
+    client = app.test_client()
+    headers = login(client)
+    assert upload(client, headers, b'hello world') == 200
+    queue = app.extensions['job_queue']
+
+    counts = Worker(queue, processes=1).run(once=True)
+    assert counts == {"done": 1, "retried": 0, "failed": 0}
+    assert queue.counts()['done'] == 1
+    assert queue.workers() == 0
@@ -0,0 +1,78 @@
+import dataclasses
+import datetime
+import decimal
+import uuid
+
+import pytest
+from flask import jsonify
+from flask.json.provider import DefaultJSONProvider
+
+from jsonprovider import FastJSONProvider, error_body
+
+
+@dataclasses.dataclass
+class Point:
+    y: int
+    x: int
+
+
+@pytest.mark.parametrize('obj', [
+    {'b': 1, 'a': {'d': [3, {'f': 4, 'e': 5}], 'c': None}, 'A': True},
+    {'name': 'Zoë 東京 😀', 'separator': 'a b', 'tag': '</script>'},
+    {'at': datetime.datetime(2015, 10, 21, 7, 28, tzinfo=datetime.timezone.utc),
+     'naive': datetime.datetime(2015, 10, 21, 7, 28), 'day': datetime.date(2015, 10, 21)},
+    {'price': decimal.Decimal('1.10'), 'tiny': decimal.Decimal('1E-7')},
+    {'id': uuid.UUID(int=1), 'point': Point(2, 1)},
+    {'mean_ms': 0.123, 'max_ms': 1234567.891, 'zero': 0.0, 'negative': -0.5},
+    {2: 'two', 10: 'ten'},
+    {'big': 2 ** 70, 'small': -2 ** 63},
+    [],
+    'text'
+])
+def test_responses_match_jsonify(app, obj):
+    with app.app_context():
+        fast = FastJSONProvider(app).response(obj)
+        default = DefaultJSONProvider(app).response(obj)
+    assert fast.get_data() == default.get_data()
+    assert fast.mimetype == default.mimetype == 'application/json'
+
+
+def test_installed_provider(app):
+    assert isinstance(app.json, FastJSONProvider)
+    with app.app_context():
+        response = jsonify(price=decimal.Decimal('9.99'), name='Zoë')
+    assert response.get_data() == b'{"name":"Zo\\u00eb","price":"9.99"}\n'
+
+
+def test_unserializable_objects_still_fail(app):
+    with app.app_context():
+        with pytest.raises(TypeError):
+            FastJSONProvider(app).response({'when': datetime.time(12, 0)})
+
+
+def test_debug_responses_are_indented(make_app):
+    app = make_app(DEBUG=True)
+    app.debug = True
+    with app.app_context():
+        assert FastJSONProvider(app).response({'a': 1}).get_data() == b'{\n  "a": 1\n}\n'
+
+
+@pytest.mark.parametrize('status_code, message', [
+    (401, 'Token is missing'),
+    (404, 'Fichier « été.txt » introuvable'),
+    (400, 'Quote " and backslash \\')
+])
+def test_error_body_matches_jsonify(app, status_code, message):
+    with app.app_context():
+        default = DefaultJSONProvider(app).response({"error": {"code": status_code, "message": message}})
+    assert error_body(status_code, message) == default.get_data()
+
+
+def test_error_responses_use_error_body(client):
+    response = client.get('/users')
+    assert response.status_code == 401
+    assert response.get_data() == error_body(401, 'Token is missing')
+
+
+def test_loads(app):
+    assert app.json.loads('{"a": [1, 2.5, "é"], "b": null}') == {'a': [1, 2.5, 'é'], 'b': None}
@@ -0,0 +1,121 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from metrics import Registry, SnapshotDirectory, render, scrape_allowed
+
+from .conftest import login
+
+
+def worker_snapshot(requests, in_flight, latencies=()):
+    registry = Registry()
+    registry.counter('http_requests_total', 'Requests answered', ('route', 'status')).inc(requests, route='/users',
+                                                                                           status=200)
+    registry.gauge('http_requests_in_flight', 'Requests being processed').set(in_flight)
+    latency = registry.histogram('http_request_duration_seconds', 'Time to produce the response', buckets=(0.1, 1.0))
+    for seconds in latencies:
+        latency.observe(seconds)
+    return registry.snapshot()
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_exposition_format():
+    registry = Registry()
+    registry.counter('jobs_total', 'Jobs run', ('queue',)).inc(3, queue='say "hi"\n\\')
+    registry.gauge('temperature', 'Degrees').set(-1.5)
+    registry.gauge('ceiling', 'Highest value').set(float('inf'))
+    latency = registry.histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.5, 0.7, 3.0):
+        latency.observe(seconds, route='/a')
+
+    assert render(registry.snapshot()).splitlines() == [
+        '# HELP ceiling Highest value',
+        '# TYPE ceiling gauge',
+        'ceiling +Inf',
+        '# HELP jobs_total Jobs run',
+        '# TYPE jobs_total counter',
+        'jobs_total{queue="say \\"hi\\"\\n\\\\"} 3',
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1.0"} 3',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a"} 4.25',
+        'latency_seconds_count{route="/a"} 4',
+        '# HELP temperature Degrees',
+        '# TYPE temperature gauge',
+        'temperature -1.5'
+    ]
+
+
+def test_workers_are_summed(tmp_path):
+    directory = SnapshotDirectory(str(tmp_path))
+    directory.write(worker_snapshot(2, 1, [0.05]))
+    other = os.path.join(str(tmp_path), 'worker-%d.json' % os.getppid())
+    os.rename(os.path.join(str(tmp_path), 'worker-%d.json' % os.getpid()), other)
+    directory.write(worker_snapshot(5, 3, [0.5, 2.0]))
+
+    text = render(directory.collect())
+    assert 'http_requests_total{route="/users",status="200"} 7\n' in text
+    assert 'http_requests_in_flight 4\n' in text
+    assert 'http_request_duration_seconds_bucket{le="0.1"} 1\n' in text
+    assert 'http_request_duration_seconds_bucket{le="1.0"} 2\n' in text
+    assert 'http_request_duration_seconds_count 3\n' in text
+
+
+def test_exited_workers_keep_counters_not_gauges(tmp_path):
+    directory = SnapshotDirectory(str(tmp_path))
+    directory.write(worker_snapshot(2, 1))
+    gone = os.path.join(str(tmp_path), 'worker-%d.json' % exited_pid())
+    os.rename(os.path.join(str(tmp_path), 'worker-%d.json' % os.getpid()), gone)
+    directory.write(worker_snapshot(5, 3))
+
+    for _ in range(2):
+        text = render(directory.collect())
+        assert 'http_requests_total{route="/users",status="200"} 7\n' in text
+        assert 'http_requests_in_flight 3\n' in text
+    assert not os.path.exists(gone)
+    assert os.path.exists(os.path.join(str(tmp_path), 'archive.json'))
+
+
+def test_metrics_route(client):
+    assert client.get('/users/1', headers=login(client)).status_code == 200
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+    text = response.get_data(as_text=True)
+    assert '# TYPE http_requests_total counter' in text
+    assert 'http_requests_total{method="GET",route="/users/<int:user_id>",status="200"} 1' in text
+    assert 'db_pool_connections{state="idle"}' in text
+
+
+def test_metrics_refused_outside_allowed_networks(make_app):
+    client = make_app().test_client()
+    response = client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.9'})
+    assert response.status_code == 403
+    assert response.json['error']['code'] == 403
+
+    client = make_app(METRICS_ALLOWED_NETWORKS=['203.0.113.0/24']).test_client()
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.9'}).status_code == 200
+    assert client.get('/metrics').status_code == 403
+
+
+@pytest.mark.parametrize('address, networks, allowed', [
+    ('127.0.0.1', ('127.0.0.0/8', '::1/128'), True),
+    ('::1', ('127.0.0.0/8', '::1/128'), True),
+    ('10.0.0.1', ('127.0.0.0/8', '::1/128'), False),
+    ('10.0.0.1', None, True),
+    ('10.0.0.1', (), False),
+    ('not an address', ('0.0.0.0/0',), False),
+    (None, ('0.0.0.0/0',), False)
+])
+def test_scrape_allowed(address, networks, allowed):
+    assert scrape_allowed(address, networks) is allowed
@@ -0,0 +1,60 @@
+import base64
+
+import pytest
+
+from cursors import decode_cursor, encode_cursor
+from .conftest import login
+
+
+def test_cursor_round_trip():
+    for last_id in (0, 1, 42, 10 ** 12):
+        assert decode_cursor(encode_cursor(last_id)) == last_id
+
+
+def test_pages_cover_every_user_once(client):
+    headers = login(client)
+    seen, cursor = [], ''
+    while cursor is not None:
+        page = client.get('/users?limit=3&after=%s' % cursor, headers=headers).json
+        assert len(page['users']) <= 3
+        seen += [user['id'] for user in page['users']]
+        cursor = page['next_cursor']
+    assert seen == list(range(1, 11))
+
+
+def test_table_link_pages(client):
+    response = client.get('/show_table?limit=4')
+    assert [row['id'] for row in response.json] == [1, 2, 3, 4]
+    link = response.headers['Link']
+    assert link.endswith('; rel="next"')
+
+    response = client.get(link[link.index('/show_table'):link.index('>')])
+    assert [row['id'] for row in response.json] == [5, 6, 7, 8]
+
+
+def test_limit_capped(make_app):
+    client = make_app(PAGE_SIZE_MAX=4).test_client()
+    headers = login(client)
+    page = client.get('/users?limit=50', headers=headers).json
+    assert len(page['users']) == 4
+    assert page['next_cursor'] == encode_cursor(4)
+    assert len(client.get('/show_table?limit=50').json) == 4
+
+
+@pytest.mark.parametrize('cursor', ['nonsense', base64.urlsafe_b64encode(b'file:3').decode(),
+                                    base64.urlsafe_b64encode(b'id:three').decode(), '%ff'])
+def test_bad_cursor(client, cursor):
+    response = client.get('/users?after=%s' % cursor, headers=login(client))
+    assert response.status_code == 400
+    assert response.json['error']['message'] == 'Invalid cursor'
+    assert client.get('/show_table?after=%s' % cursor).status_code == 400
+
+
+@pytest.mark.parametrize('limit', ['abc', '0', '-1', '2.5', ''])
+def test_bad_limit(client, limit):
+    headers = login(client)
+    for url in ('/users?limit=%s', '/users?q=al&limit=%s', '/show_table?limit=%s', '/files?limit=%s',
+                '/admin/queries?limit=%s'):
+        response = client.get(url % limit, headers=headers)
+        assert response.status_code == 400, url
+        assert response.json['error']['message'] == 'limit must be a positive integer'
@@ -0,0 +1,22 @@
+from db import ConnectionPool
+
+
+def test_first_checkout_fills_to_min_size(make_app):
+    client = make_app(DB_POOL_MIN_SIZE=3).test_client()
+    pool = client.get('/readyz').json['pool']
+    assert pool['size'] == 3
+    assert pool['in_use'] == 0
+
+
+def test_fill_failure_leaves_checkout_to_report():
+    opened = []
+
+    def connect():
+        if opened:
+            raise OSError('too many connections')
+        opened.append(object())
+        return opened[-1]
+
+    pool = ConnectionPool(connect, lambda conn: None, min_size=2, max_size=4)
+    assert pool.acquire() is opened[0]
+    assert pool.stats()['size'] == 1
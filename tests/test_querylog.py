@@ -0,0 +1,88 @@
+import logging
+
+import pytest
+
+from main import db
+from querylog import QueryStats, fingerprint
+
+from .conftest import login
+
+
+@pytest.mark.parametrize('query, expected', [
+    ("SELECT * FROM users WHERE id = 42", "SELECT * FROM users WHERE id = ?"),
+    ("SELECT * FROM users WHERE id = %s", "SELECT * FROM users WHERE id = ?"),
+    ("SELECT * FROM users WHERE name = 'o''brien' AND score > 1.5",
+     "SELECT * FROM users WHERE name = ? AND score > ?"),
+    ("SELECT * FROM users WHERE id IN (%s, %s, %s)", "SELECT * FROM users WHERE id IN (...)"),
+    ("SELECT * FROM users WHERE id IN (1,2)", "SELECT * FROM users WHERE id IN (...)"),
+    ("INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s), (%s, %s)", "INSERT INTO t (a, b) VALUES (...)"),
+    ("SELECT id\n  FROM   users\n LIMIT 10", "SELECT id FROM users LIMIT ?"),
+    ("SELECT col2 FROM t1", "SELECT col2 FROM t1")
+])
+def test_fingerprint(query, expected):
+    assert fingerprint(query) == expected
+
+
+def test_one_fingerprint_per_query_shape():
+    assert fingerprint("SELECT * FROM t WHERE id IN (1)") == fingerprint("SELECT * FROM t WHERE id IN (1, 2, 3)")
+    assert fingerprint("SELECT * FROM t WHERE a = 1") != fingerprint("SELECT * FROM t WHERE b = 1")
+
+
+def test_stats_overflow_and_sorting():
+    stats = QueryStats(maxsize=2)
+    stats.record('a', 0.010, False)
+    stats.record('b', 0.001, False)
+    stats.record('b', 0.001, False)
+    stats.record('c', 0.500, True)
+
+    report = stats.report('count')
+    assert [(q['fingerprint'], q['count']) for q in report['queries']] == [('b', 2), ('a', 1), ('(other)', 1)]
+    assert stats.report('max', 1)['queries'][0] == {
+        "fingerprint": '(other)', "count": 1, "total_ms": 500.0, "mean_ms": 500.0, "max_ms": 500.0, "slow": 1
+    }
+
+
+def test_slow_queries_logged(make_app, caplog):
+    client = make_app(SLOW_QUERY_THRESHOLD=0).test_client()
+    headers = login(client)
+    with caplog.at_level(logging.WARNING):
+        assert client.get('/users/5', headers=headers).status_code == 200
+    messages = [record.getMessage() for record in caplog.records if 'Slow query' in record.getMessage()]
+    assert any(' on GET /users/<int:user_id>: SELECT ' in message and 'WHERE id = ?' in message
+               for message in messages)
+
+    report = client.get('/admin/queries', headers=headers).json
+    assert all(query['slow'] == query['count'] for query in report['queries'])
+
+
+def test_fast_queries_not_logged(make_app, caplog):
+    client = make_app(SLOW_QUERY_THRESHOLD=60).test_client()
+    headers = login(client)
+    with caplog.at_level(logging.WARNING):
+        assert client.get('/users/5', headers=headers).status_code == 200
+    assert not [record for record in caplog.records if 'Slow query' in record.getMessage()]
+    assert all(query['slow'] == 0 for query in client.get('/admin/queries', headers=headers).json['queries'])
+
+
+def repeat_lookups(app, times):
+    # Leaving the request context runs the teardown that checks for repeats
+    with app.test_request_context('/users/1'):
+        for user_id in range(1, times + 1):
+            db.users.get(user_id)
+
+
+def test_n_plus_one_flagged(make_app, caplog):
+    app = make_app(N_PLUS_ONE_THRESHOLD=3)
+    with caplog.at_level(logging.WARNING):
+        repeat_lookups(app, 2)
+        assert not app.extensions['query_stats'].report()['n_plus_one']
+        repeat_lookups(app, 3)
+        repeat_lookups(app, 5)
+
+    patterns = app.extensions['query_stats'].report()['n_plus_one']
+    assert len(patterns) == 1
+    assert patterns[0]['route'] == '/users/<int:user_id>'
+    assert patterns[0]['fingerprint'].endswith('FROM midterm_database WHERE id = ?')
+    assert (patterns[0]['requests'], patterns[0]['max_per_request']) == (2, 5)
+    assert sum('Possible N+1: GET /users/<int:user_id> ran' in record.getMessage()
+               for record in caplog.records) == 2
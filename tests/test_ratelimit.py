@@ -0,0 +1,60 @@
+from ratelimit import bearer_token, gcra, parse_limit
+
+from .conftest import login
+
+
+def statuses(client, requests):
+    return [client.get(path, headers=headers).status_code for path, headers in requests]
+
+
+def test_parse_limit():
+    assert parse_limit('10/minute') == (10, 60)
+    assert parse_limit('100/5 seconds') == (100, 5)
+
+
+def test_gcra_allows_burst_then_refills():
+    tat = None
+    for _ in range(3):
+        allowed, tat, _, _, _ = gcra(tat, 0.0, 3, 60)
+        assert allowed
+    assert not gcra(tat, 0.0, 3, 60)[0]
+    assert gcra(tat, 20.0, 3, 60)[0]
+
+
+def test_bearer_token_ignores_trailing_text():
+    assert bearer_token('Bearer abc') == 'abc'
+    assert bearer_token('Bearer abc junk') == 'abc'
+    assert bearer_token('Bearer') is None
+    assert bearer_token(None) is None
+
+
+def test_token_limit(make_app):
+    client = make_app(RATELIMIT_USERS='3/minute').test_client()
+    headers = login(client)
+    assert statuses(client, [('/users', headers)] * 5) == [200, 200, 200, 429, 429]
+
+
+def test_token_limit_not_reset_by_suffixes(make_app):
+    client = make_app(RATELIMIT_USERS='3/minute').test_client()
+    token = login(client)['Authorization']
+    requests = [('/users', {'Authorization': '%s junk%d' % (token, i)}) for i in range(5)]
+    assert statuses(client, requests) == [200, 200, 200, 429, 429]
+
+
+def test_invalid_tokens_capped_per_ip(make_app):
+    client = make_app(RATELIMIT_IP='3/minute').test_client()
+    requests = [('/users/1', {'Authorization': 'Bearer garbage%d' % i}) for i in range(5)]
+    assert statuses(client, requests) == [401, 401, 401, 429, 429]
+
+
+def test_limit_headers(make_app):
+    client = make_app(RATELIMIT_USERS='3/minute').test_client()
+    headers = login(client)
+    client.get('/users', headers=headers)
+    response = client.get('/users', headers=headers)
+    assert response.headers['RateLimit-Limit'] == '3'
+    assert response.headers['RateLimit-Remaining'] == '1'
+    for _ in range(2):
+        response = client.get('/users', headers=headers)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
@@ -0,0 +1,91 @@
+import json
+import sqlite3
+
+import pytest
+
+from .conftest import login
+
+
+@pytest.fixture
+def replicated(make_app, tmp_path):
+    """
+    App whose replica is a snapshot of the primary taken after seeding,
+    so it never sees later writes
+    """
+    app = make_app(DB_REPLICAS=[{'SQLITE_PATH': str(tmp_path / 'replica.db')}])
+    primary = sqlite3.connect(str(tmp_path / 'api.db'))
+    replica = sqlite3.connect(str(tmp_path / 'replica.db'))
+    primary.backup(replica)
+    primary.close()
+    replica.close()
+    return app
+
+
+def username(client, headers, user_id):
+    response = client.get('/users/%d' % user_id, headers=headers)
+    assert response.status_code == 200
+    return response.json['username']
+
+
+def test_reads_go_to_replica(replicated):
+    writer = replicated.test_client()
+    reader = replicated.test_client()
+    headers = login(writer)
+    assert writer.put('/users/6', headers=headers, json={'username': 'carla_renamed'}).status_code == 200
+
+    rows = reader.get('/show_table').json
+    assert [row['username'] for row in rows if row['id'] == 6] == ['carla_brown']
+
+
+def test_writer_reads_its_write(replicated):
+    writer = replicated.test_client()
+    reader = replicated.test_client()
+    headers = login(writer)
+    assert writer.put('/users/6', headers=headers, json={'username': 'carla_renamed'}).status_code == 200
+
+    # The other client's miss fills the cache; it must not hold the stale row
+    reader_headers = login(reader, 'alice_johnson', 'aj12345')
+    assert username(reader, reader_headers, 6) == 'carla_renamed'
+    assert username(writer, headers, 6) == 'carla_renamed'
+
+    rows = writer.get('/show_table').json
+    assert [row['username'] for row in rows if row['id'] == 6] == ['carla_renamed']
+
+
+def test_replica_down_falls_back_to_primary(make_app, tmp_path):
+    app = make_app(DB_REPLICAS=[{'SQLITE_PATH': str(tmp_path / 'missing' / 'replica.db')}])
+    client = app.test_client()
+    assert len(client.get('/show_table').json) == 10
+    replicas = client.get('/readyz').json['replicas']
+    assert replicas[0]['healthy'] is False
+
+
+
+def exported_username(client, headers, user_id):
+    # The export is not cached, so it shows which database answered
+    response = client.get('/users/export', headers=headers)
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    return [row['username'] for row in rows if row['id'] == user_id][0]
+
+
+def test_housekeeping_keeps_reads_on_replica(replicated, tmp_path):
+    reader = replicated.test_client()
+    headers = login(reader)
+    primary = sqlite3.connect(str(tmp_path / 'api.db'))
+    primary.execute("UPDATE midterm_database SET username = 'carla_primary' WHERE id = 6")
+    primary.commit()
+    primary.close()
+
+    # The next token check refreshes the revocation list and prunes its log
+    revocations = replicated.extensions['revocations']
+    revocations._next_refresh = revocations._next_prune = 0
+    assert exported_username(reader, headers, 6) == 'carla_brown'
+    assert revocations._next_prune > 0
+    assert exported_username(reader, headers, 6) == 'carla_brown'
+
+
+def test_write_pins_client_to_primary(replicated, tmp_path):
+    writer = replicated.test_client()
+    headers = login(writer)
+    assert writer.put('/users/7', headers=headers, json={'username': 'david_renamed'}).status_code == 200
+    assert exported_username(writer, headers, 7) == 'david_renamed'
@@ -0,0 +1,33 @@
+from .conftest import login
+
+
+def test_write_retires_other_workers_entries(make_app):
+    # The revocation log is not pulled again, so only the shared tag
+    # versions can tell b that a changed the user
+    config = {'JWT_REVOCATION_REFRESH': 3600}
+    a = make_app(**config).test_client()
+    b = make_app(**config).test_client()
+    headers = login(a)
+
+    stale = b.get('/users/6', headers=headers)
+    assert stale.status_code == 200
+    assert b.get('/users/6', headers=headers).headers['ETag'] == stale.headers['ETag']  # now cached in b
+
+    response = a.put('/users/6', headers={**headers, 'If-Match': stale.headers['ETag']},
+                     json={'username': 'renamed'})
+    assert response.status_code == 200
+
+    fresh = b.get('/users/6', headers=headers)
+    assert fresh.json['username'] == 'renamed'
+    assert fresh.headers['ETag'] != stale.headers['ETag']
+    response = b.put('/users/6', headers={**headers, 'If-Match': fresh.headers['ETag']},
+                     json={'username': 'renamed_again'})
+    assert response.status_code == 200
+
+
+def test_unshared_cache_keeps_local_invalidation(make_app):
+    client = make_app(RESPONSE_CACHE_SHARED=False).test_client()
+    headers = login(client)
+    assert client.get('/users/6', headers=headers).status_code == 200
+    assert client.put('/users/6', headers=headers, json={'username': 'renamed'}).status_code == 200
+    assert client.get('/users/6', headers=headers).json['username'] == 'renamed'
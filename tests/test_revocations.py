@@ -0,0 +1,68 @@
+import time
+
+from cache import RevocationList
+
+
+class Log:
+    """
+    In-memory token_revocations table whose entries become visible when
+    their transaction commits, not in id order
+    """
+    def __init__(self):
+        self.committed = []
+
+    def commit(self, entry_id, user_id, min_version=None, logged_at=None):
+        self.committed.append((entry_id, user_id, min_version, logged_at or time.time()))
+
+    def since(self, after_id, logged_since):
+        return sorted(entry for entry in self.committed if entry[0] > after_id or entry[3] >= logged_since)
+
+    def prune(self, before):
+        self.committed = [entry for entry in self.committed if entry[3] >= before]
+
+
+def revocation_list(log, revoked=None):
+    on_revoke = revoked.append if revoked is not None else None
+    return RevocationList(log.since, log.prune, 3600, refresh_interval=0, on_revoke=on_revoke)
+
+
+def test_entry_committed_out_of_id_order():
+    log = Log()
+    revocations = revocation_list(log)
+    log.commit(2, user_id=20)  # id 1 was allocated first but commits later
+    revocations.refresh()
+    assert revocations.is_revoked(20, 1)
+
+    log.commit(1, user_id=10)
+    revocations.refresh()
+    assert revocations.is_revoked(10, 1)
+
+
+def test_entries_applied_once():
+    log = Log()
+    revoked = []
+    revocations = revocation_list(log, revoked)
+    log.commit(1, user_id=10)
+    for _ in range(3):
+        revocations.refresh()
+    assert revoked == [10]
+
+
+def test_version_revocation():
+    log = Log()
+    revocations = revocation_list(log)
+    log.commit(1, user_id=10, min_version=3)
+    revocations.refresh()
+    assert revocations.is_revoked(10, 2)
+    assert not revocations.is_revoked(10, 3)
+    assert not revocations.is_revoked(11, 1)
+
+
+def test_old_entries_not_read_again():
+    log = Log()
+    revoked = []
+    revocations = revocation_list(log, revoked)
+    log.commit(1, user_id=10, logged_at=time.time() - 120)
+    revocations.refresh()
+    revocations.refresh()
+    assert revoked == [10]
@@ -0,0 +1,61 @@
+import pytest
+
+from .conftest import login
+
+
+def search(client, query, status=200):
+    response = client.get('/users?' + query, headers=login(client))
+    assert response.status_code == status
+    return [user['username'] for user in response.json['users']] if status == 200 else response.json
+
+
+def test_prefix(client):
+    assert search(client, 'q=a') == ['alice_johnson', 'anthony_weathersby']
+    assert search(client, 'q=e&limit=1') == ['emily_davis']
+
+
+def test_prefix_ignores_case(client):
+    headers = login(client)
+    assert client.post('/users', headers=headers, json={'username': 'Alfred', 'password': 'pw'}).status_code == 201
+    assert search(client, 'q=AL') == ['Alfred', 'alice_johnson']
+    assert search(client, 'q=al') == ['Alfred', 'alice_johnson']
+
+
+def test_substring(client):
+    assert search(client, 'q=SON&mode=substring') == ['alice_johnson', 'frank_wilson']
+
+
+def test_fuzzy(client):
+    assert search(client, 'q=ajn&mode=fuzzy') == ['alice_johnson']
+
+
+@pytest.mark.parametrize('mode', ['prefix', 'substring'])
+def test_wildcards_are_literal(client, mode):
+    headers = login(client)
+    assert client.post('/users', headers=headers, json={'username': 'pct%_user', 'password': 'pw'}).status_code == 201
+    assert search(client, 'q=%25_u&mode=' + mode) == (['pct%_user'] if mode == 'substring' else [])
+    assert search(client, 'q=pct%25_&mode=' + mode) == ['pct%_user']
+    assert search(client, 'q=___&mode=substring') == []
+    assert search(client, 'q=%25%25%25&mode=substring') == []
+
+
+def test_limit_capped(make_app):
+    client = make_app(SEARCH_LIMIT_MAX=2).test_client()
+    assert search(client, 'q=a_s&mode=fuzzy&limit=50') == ['alice_johnson', 'anthony_weathersby']
+    assert search(client, 'q=a_s&mode=fuzzy&limit=1') == ['alice_johnson']
+
+
+@pytest.mark.parametrize('query, message', [
+    ('q=', 'q must not be empty'),
+    ('q=al&mode=regex', 'mode must be one of prefix, substring, fuzzy'),
+    ('q=al&mode=substring', 'q must be at least 3 characters for substring searches'),
+    ('q=al&limit=0', 'limit must be a positive integer')
+])
+def test_invalid_search(client, query, message):
+    assert search(client, query, 400)['error']['message'] == message
+
+
+def test_scanning_modes_disabled(make_app):
+    client = make_app(SEARCH_MODES_ENABLED=['prefix']).test_client()
+    assert search(client, 'q=son&mode=substring', 400)['error']['message'] == 'mode must be one of prefix'
+    assert search(client, 'q=al') == ['alice_johnson']
@@ -0,0 +1,34 @@
+import pytest
+
+from .conftest import login
+
+
+@pytest.fixture(params=[False, True], ids=['lookup', 'stateless'])
+def workers(request, make_app):
+    """
+    Two apps on one database, standing in for two gunicorn workers
+    """
+    config = {'JWT_STATELESS': request.param, 'JWT_REVOCATION_REFRESH': 0}
+    return make_app(**config).test_client(), make_app(**config).test_client()
+
+
+def test_delete_reaches_other_workers(workers):
+    a, b = workers
+    headers = login(a, 'brian_smith', 'bs12345')
+    assert a.get('/admin/profile', headers=headers).status_code == 200
+    assert b.get('/admin/profile', headers=headers).status_code == 200  # now cached in b
+
+    admin = login(a)
+    assert a.delete('/users/5', headers=admin).status_code == 200
+    assert a.get('/admin/profile', headers=headers).status_code == 401
+    assert b.get('/admin/profile', headers=headers).status_code == 401
+
+
+def test_rename_reaches_other_workers(workers):
+    a, b = workers
+    headers = login(a, 'brian_smith', 'bs12345')
+    assert b.get('/admin/profile', headers=headers).json['username'] == 'brian_smith'
+
+    admin = login(a)
+    assert a.put('/users/5', headers=admin, json={'username': 'brian_renamed'}).status_code == 200
+    assert b.get('/admin/profile', headers=headers).status_code == 401
@@ -0,0 +1,180 @@
+import hashlib
+import io
+import os
+import time
+
+import pytest
+
+from uploads import CHUNK_SIZE
+
+from .conftest import login
+
+CONTENT = b'0123456789' * 10
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+
+@pytest.fixture
+def headers(client):
+    return login(client)
+
+
+def start(client, headers, size=len(CONTENT)):
+    body = {'filename': 'big.txt'}
+    if size is not None:
+        body['size'] = size
+    response = client.post('/admin/uploads', headers=headers, json=body)
+    assert response.status_code == 201
+    return response.json['upload_id']
+
+
+def send(client, headers, upload_id, offset, chunk):
+    return client.patch('/admin/uploads/%s' % upload_id, headers=dict(headers, **{'Upload-Offset': str(offset)}),
+                        data=chunk)
+
+
+def complete(client, headers, upload_id, sha256=None):
+    body = {'sha256': sha256} if sha256 else {}
+    return client.post('/admin/uploads/%s/complete' % upload_id, headers=headers, json=body)
+
+
+class DroppedConnection(io.RawIOBase):
+    """
+    Request body whose connection drops after the given bytes
+    """
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, size=-1):
+        if not self.data:
+            raise OSError('Connection reset by peer')
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+def test_chunks_then_complete(client, headers):
+    upload_id = start(client, headers)
+    assert send(client, headers, upload_id, 0, CONTENT[:40]).headers['Upload-Offset'] == '40'
+    assert send(client, headers, upload_id, 40, CONTENT[40:]).json['offset'] == len(CONTENT)
+
+    response = complete(client, headers, upload_id, DIGEST.upper())
+    assert response.status_code == 200
+    assert response.json['sha256'] == DIGEST
+    assert client.get('/files/big.txt', headers=headers).data == CONTENT
+    assert client.get('/admin/uploads/%s' % upload_id, headers=headers).status_code == 404
+
+
+def test_offset_mismatch(client, headers):
+    upload_id = start(client, headers)
+    send(client, headers, upload_id, 0, CONTENT[:40])
+
+    for offset in (0, 30, 50):
+        response = send(client, headers, upload_id, offset, CONTENT[offset:])
+        assert response.status_code == 409
+        assert response.headers['Upload-Offset'] == '40'
+    assert client.get('/admin/uploads/%s' % upload_id, headers=headers).json['offset'] == 40
+    assert send(client, headers, upload_id, 0, b'x').status_code == 409
+
+    response = client.patch('/admin/uploads/%s' % upload_id, headers=headers, data=b'x')
+    assert response.status_code == 400
+
+
+def test_resume_after_interrupted_chunk(app, client, headers):
+    upload_id = start(client, headers)
+    sent = CONTENT[:70]
+    with pytest.raises(OSError):
+        app.extensions['upload_sessions'].append(upload_id, 1, 0, DroppedConnection(sent))
+
+    # Whatever arrived before the drop is kept; the client asks where to resume
+    response = client.head('/admin/uploads/%s' % upload_id, headers=headers)
+    offset = int(response.headers['Upload-Offset'])
+    assert offset == len(sent)
+    assert send(client, headers, upload_id, offset, CONTENT[offset:]).status_code == 200
+    assert complete(client, headers, upload_id, DIGEST).status_code == 200
+    assert client.get('/files/big.txt', headers=headers).data == CONTENT
+
+
+def test_resume_across_chunk_reads(app, client, headers):
+    content = os.urandom(CHUNK_SIZE * 2 + 10)
+    upload_id = start(client, headers, size=len(content))
+    with pytest.raises(OSError):
+        app.extensions['upload_sessions'].append(upload_id, 1, 0, DroppedConnection(content[:CHUNK_SIZE + 5]))
+
+    offset = client.get('/admin/uploads/%s' % upload_id, headers=headers).json['offset']
+    assert offset == CHUNK_SIZE + 5
+    send(client, headers, upload_id, offset, content[offset:])
+    response = complete(client, headers, upload_id, hashlib.sha256(content).hexdigest())
+    assert response.status_code == 200
+
+
+def test_exceeding_declared_size(client, headers):
+    upload_id = start(client, headers, size=50)
+    send(client, headers, upload_id, 0, CONTENT[:40])
+
+    response = send(client, headers, upload_id, 40, CONTENT[40:])
+    assert response.status_code == 413
+    # The rejected chunk is dropped whole, so the session can still finish
+    assert client.get('/admin/uploads/%s' % upload_id, headers=headers).json['offset'] == 40
+    assert send(client, headers, upload_id, 40, CONTENT[40:50]).status_code == 200
+    assert complete(client, headers, upload_id).status_code == 200
+
+
+def test_exceeding_max_size(make_app):
+    client = make_app(UPLOAD_MAX_SIZE=64).test_client()
+    headers = login(client)
+    response = client.post('/admin/uploads', headers=headers, json={'filename': 'big.txt', 'size': 65})
+    assert response.status_code == 413
+
+    upload_id = start(client, headers, size=None)
+    assert send(client, headers, upload_id, 0, CONTENT).status_code == 413
+    assert client.get('/admin/uploads/%s' % upload_id, headers=headers).json['offset'] == 0
+
+
+def test_incomplete_and_checksum_mismatch(client, headers):
+    upload_id = start(client, headers)
+    send(client, headers, upload_id, 0, CONTENT[:40])
+    response = complete(client, headers, upload_id)
+    assert response.status_code == 409
+    assert response.headers['Upload-Offset'] == '40'
+
+    send(client, headers, upload_id, 40, CONTENT[40:])
+    response = complete(client, headers, upload_id, hashlib.sha256(b'other').hexdigest())
+    assert response.status_code == 422
+    assert client.get('/files/big.txt', headers=headers).status_code == 404
+    # The session survives a mismatch, so the right digest still finishes it
+    assert complete(client, headers, upload_id, DIGEST).status_code == 200
+
+
+def test_other_users_cannot_see_session(client, headers):
+    upload_id = start(client, headers)
+    other = login(client, 'alice_johnson', 'aj12345')
+    assert client.get('/admin/uploads/%s' % upload_id, headers=other).status_code == 404
+    assert send(client, other, upload_id, 0, CONTENT).status_code == 404
+    assert client.get('/admin/uploads/not-a-session', headers=headers).status_code == 404
+
+
+def test_idle_sessions_expire(make_app):
+    app = make_app(UPLOAD_SESSION_TTL=3600)
+    client = app.test_client()
+    headers = login(client)
+    idle = start(client, headers)
+    active = start(client, headers)
+    send(client, headers, idle, 0, CONTENT[:10])
+
+    sessions = app.extensions['upload_sessions']
+    stale = time.time() - 3601
+    for path in (sessions._part_path(idle), sessions._meta_path(idle)):
+        os.utime(path, (stale, stale))
+    sessions._last_cleanup = 0  # cleanup runs at most once a minute
+    start(client, headers)
+
+    assert client.get('/admin/uploads/%s' % idle, headers=headers).status_code == 404
+    assert not os.path.exists(sessions._part_path(idle))
+    assert client.get('/admin/uploads/%s' % active, headers=headers).status_code == 200
+
+
+def test_abort(client, headers):
+    upload_id = start(client, headers)
+    send(client, headers, upload_id, 0, CONTENT[:10])
+    assert client.delete('/admin/uploads/%s' % upload_id, headers=headers).status_code == 200
+    assert client.get('/admin/uploads/%s' % upload_id, headers=headers).status_code == 404
+    assert complete(client, headers, upload_id).status_code == 404
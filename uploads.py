@@ -0,0 +1,305 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+import time
+
+# =============================================
+# RESUMABLE CHUNKED UPLOADS
+# =============================================
+CHUNK_SIZE = 64 * 1024  # bytes read from the request stream at a time
+SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{22}$')
+
+
+class UploadError(Exception):
+    """
+    Raised when an upload session operation cannot be carried out
+    Args:
+        status_code (int): HTTP status code to answer with
+        message (str): Error message
+        offset (int): Current offset of the session, if relevant
+    """
+    def __init__(self, status_code, message, offset=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+class UploadSessions:
+    """
+    Stages uploads sent in chunks under UPLOAD_FOLDER/.partial, hashing them
+    as they arrive, and hands finished files to the content-addressed FileStore.
+    The offset of a session is the size of its partial file, so any worker
+    can resume it after a dropped connection or a restart.
+    Args:
+        store (FileStore): Store finished files are moved into
+        max_size (int): Largest file accepted, in bytes
+        ttl (float): Seconds an idle session is kept before being discarded
+    """
+    def __init__(self, store, max_size, ttl=24 * 3600):
+        self.store = store
+        self.staging_folder = os.path.join(store.upload_folder, '.partial')
+        self.max_size = max_size
+        self.ttl = ttl
+        self._hashes = {}  # upload_id -> (offset, running sha256)
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+        os.makedirs(self.staging_folder, exist_ok=True)
+
+    def create(self, filename, owner, size=None):
+        """
+        Opens a new upload session
+        Args:
+            filename (str): Secured name the file will be stored under
+            owner (int): ID of the user allowed to send chunks
+            size (int): Total size in bytes, if known up front
+        Returns:
+            dict: The session metadata, including its upload_id
+        """
+        if size is not None and size > self.max_size:
+            raise UploadError(413, 'File exceeds the maximum upload size')
+        self.cleanup()
+
+        upload_id = secrets.token_urlsafe(16)
+        session = {
+            "upload_id": upload_id,
+            "filename": filename,
+            "owner": owner,
+            "size": size,
+            "created_at": time.time()
+        }
+        open(self._part_path(upload_id), 'wb').close()
+        with open(self._meta_path(upload_id), 'w') as f:
+            json.dump(session, f)
+        with self._lock:
+            self._hashes[upload_id] = (0, hashlib.sha256())
+        return dict(session, offset=0)
+
+    def get(self, upload_id, owner):
+        """
+        Looks up a session and its current offset
+        Returns:
+            dict: The session metadata with its offset
+        Raises:
+            UploadError: Unknown session, or owned by another user
+        """
+        if not SESSION_ID.match(upload_id):
+            raise UploadError(404, 'Upload not found')
+        try:
+            with open(self._meta_path(upload_id)) as f:
+                session = json.load(f)
+            offset = os.path.getsize(self._part_path(upload_id))
+        except (OSError, ValueError):
+            raise UploadError(404, 'Upload not found')
+        if session['owner'] != owner:
+            raise UploadError(404, 'Upload not found')
+        return dict(session, offset=offset)
+
+    def append(self, upload_id, owner, offset, stream):
+        """
+        Writes a chunk read from a stream at the given offset
+        Args:
+            upload_id (str): Session to append to
+            owner (int): ID of the user sending the chunk
+            offset (int): Offset the client believes the session is at
+            stream: File-like object the chunk is read from
+        Returns:
+            int: The offset after the chunk
+        Raises:
+            UploadError: Unknown session, offset mismatch, concurrent
+                writer or size exceeded
+        """
+        f, digest, limit = self._open_append(upload_id, owner, offset)
+        with f:
+            written = offset
+            try:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written = self._write(f, digest, chunk, written, limit)
+            except Exception as e:
+                self._abandon(upload_id, f, offset, e)
+                raise
+            f.flush()
+
+        with self._lock:
+            self._hashes[upload_id] = (written, digest)
+        return written
+
+    async def append_async(self, upload_id, owner, offset, chunks):
+        """
+        Same as append(), for an ASGI request body: the chunk arrives from an
+        async iterator and every disk operation runs on the default executor
+        so the event loop never waits on the filesystem
+        Args:
+            chunks: Async iterator of bytes, e.g. a Quart request body
+        """
+        loop = asyncio.get_running_loop()
+        f, digest, limit = await loop.run_in_executor(None, self._open_append, upload_id, owner, offset)
+        try:
+            written = offset
+            try:
+                async for chunk in chunks:
+                    written = await loop.run_in_executor(
+                        None, self._write, f, digest, chunk, written, limit)
+            except Exception as e:
+                await loop.run_in_executor(None, self._abandon, upload_id, f, offset, e)
+                raise
+            await loop.run_in_executor(None, f.flush)
+        finally:
+            await loop.run_in_executor(None, f.close)
+
+        with self._lock:
+            self._hashes[upload_id] = (written, digest)
+        return written
+
+    def complete(self, upload_id, owner, sha256=None):
+        """
+        Verifies a finished upload and moves it into the file store
+        Args:
+            upload_id (str): Session to finalize
+            owner (int): ID of the user finalizing it
+            sha256 (str): Expected hex digest, checked when given
+        Returns:
+            dict: filename, size, sha256 and deduplicated flag of the stored file
+        """
+        session = self.get(upload_id, owner)
+
+        with self._open_locked(upload_id, 'rb', session['offset']) as f:
+            size = os.fstat(f.fileno()).st_size
+            if session['size'] is not None and size != session['size']:
+                raise UploadError(409, 'Upload is incomplete', size)
+
+            digest = self._running_hash(upload_id, size).hexdigest()
+            if sha256 and sha256.lower() != digest:
+                raise UploadError(422, 'Checksum mismatch', size)
+            os.fsync(f.fileno())
+            result = self.store.put(session['filename'], self._part_path(upload_id), digest)
+
+        self._discard(upload_id)
+        return result
+
+    def abort(self, upload_id, owner):
+        """
+        Discards a session and everything uploaded so far
+        """
+        self.get(upload_id, owner)
+        self._discard(upload_id)
+
+    def cleanup(self):
+        """
+        Discards sessions idle for longer than the ttl, at most once a minute
+        """
+        now = time.time()
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        for name in os.listdir(self.staging_folder):
+            upload_id, ext = os.path.splitext(name)
+            if ext != '.json':
+                continue
+            try:
+                last_write = max(os.path.getmtime(os.path.join(self.staging_folder, name)),
+                                 os.path.getmtime(self._part_path(upload_id)))
+            except OSError:
+                last_write = 0
+            if now - last_write > self.ttl:
+                self._discard(upload_id)
+
+    def _open_locked(self, upload_id, mode, offset):
+        # Opens the partial file under an exclusive lock, never recreating it
+        # and refusing it if it was finalized or discarded in the meantime
+        path = self._part_path(upload_id)
+        flags = os.O_WRONLY | os.O_APPEND if mode == 'ab' else os.O_RDONLY
+        try:
+            f = os.fdopen(os.open(path, flags), mode)
+        except FileNotFoundError:
+            raise UploadError(404, 'Upload not found')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            raise UploadError(409, 'Another chunk is being written', offset)
+        try:
+            same_file = os.path.samestat(os.fstat(f.fileno()), os.stat(path))
+        except FileNotFoundError:
+            same_file = False
+        if not same_file:
+            f.close()
+            raise UploadError(404, 'Upload not found')
+        return f
+
+    def _open_append(self, upload_id, owner, offset):
+        # Returns the locked partial file, positioned at its end, with the
+        # running hash and the size limit of the session
+        session = self.get(upload_id, owner)
+        limit = session['size'] if session['size'] is not None else self.max_size
+
+        f = self._open_locked(upload_id, 'ab', session['offset'])
+        try:
+            current = f.seek(0, os.SEEK_END)
+            if offset != current:
+                raise UploadError(409, 'Offset mismatch', current)
+            return f, self._running_hash(upload_id, current), limit
+        except BaseException:
+            f.close()
+            raise
+
+    def _write(self, f, digest, chunk, written, limit):
+        written += len(chunk)
+        if written > limit:
+            raise UploadError(413, 'File exceeds the declared or maximum size')
+        f.write(chunk)
+        digest.update(chunk)
+        return written
+
+    def _abandon(self, upload_id, f, offset, error):
+        if isinstance(error, UploadError):
+            # Drop the partial chunk so the session stays at a known offset
+            f.truncate(offset)
+        else:
+            # A dropped connection keeps whatever arrived; the hash is
+            # rebuilt from disk on the next chunk
+            f.flush()
+        self._forget(upload_id)
+
+    def _running_hash(self, upload_id, offset):
+        # The hash kept in memory is only usable if this worker saw every
+        # chunk so far; otherwise re-read what is on disk once
+        with self._lock:
+            state = self._hashes.get(upload_id)
+        if state is not None and state[0] == offset:
+            return state[1]
+        digest = hashlib.sha256()
+        with open(self._part_path(upload_id), 'rb') as f:
+            remaining = offset
+            while remaining:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+        return digest
+
+    def _forget(self, upload_id):
+        with self._lock:
+            self._hashes.pop(upload_id, None)
+
+    def _discard(self, upload_id):
+        self._forget(upload_id)
+        for path in (self._part_path(upload_id), self._meta_path(upload_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.staging_folder, upload_id + '.part')
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.staging_folder, upload_id + '.json')